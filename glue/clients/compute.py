@@ -0,0 +1,239 @@
+from __future__ import absolute_import, division, print_function
+"""
+Scheduling of expensive layer artist computations.
+
+Layer artists split their work into a *compute* step, which does the
+numerical work (extracting masks, binning data, etc.) and does not touch
+matplotlib, and an *apply* step, which updates the plot with the result.
+A :class:`ComputeScheduler` runs the compute steps, either immediately
+or in a pool of worker threads (numpy releases the GIL for most of the
+heavy lifting), and runs the apply steps on the main thread.
+
+By default, computations are synchronous. GUI applications can install
+a threaded scheduler with :func:`set_scheduler`, passing a ``dispatch``
+function that forwards results to the event loop. The Qt application does
+this while its event loop runs (see
+:func:`glue.qt.qtutil.event_loop_scheduler`). Scripts without an event
+loop can call :meth:`ComputeScheduler.wait` to apply all the outstanding
+results.
+"""
+
+import time
+import threading
+from collections import deque
+
+from ..external.six.moves import queue
+
+__all__ = ['ComputeJob', 'ComputeScheduler', 'get_scheduler',
+           'set_scheduler']
+
+
+class ComputeJob(object):
+
+    """
+    A computation submitted to a :class:`ComputeScheduler`
+
+    :param key: Jobs with the same key supersede each other
+    :param compute: Function of no arguments that computes the result
+    :param apply: Function of the form apply(result), called on the
+                  main thread
+    :param error: Optional function of the form error(exception), called
+                  on the main thread if compute raises an exception
+    """
+
+    def __init__(self, key, compute, apply, error=None):
+        self.key = key
+        self._compute = compute
+        self._apply = apply
+        self._error = error
+
+        self.result = None
+        self.exception = None
+        self.cancelled = False
+        self.done = False
+
+    def cancel(self):
+        """
+        Prevent the job from running, or discard its result if it is
+        already running
+        """
+        self.cancelled = True
+
+    def run(self):
+        """ Run the compute step, storing the result or exception """
+        try:
+            self.result = self._compute()
+        except Exception as exc:
+            self.exception = exc
+        self.done = True
+
+    def finish(self):
+        """ Pass the result (or exception) to the apply (or error) step """
+        if self.exception is None:
+            self._apply(self.result)
+        elif self._error is not None:
+            self._error(self.exception)
+        else:
+            raise self.exception
+
+
+class ComputeScheduler(object):
+
+    """
+    Run layer artist computations, optionally in background threads.
+
+    Each job has a key (usually the layer artist that submitted it).
+    Submitting a new job supersedes any outstanding job with the same key:
+    if the old job has not started it is never run, and if it is already
+    running its result is discarded.
+
+    :param workers: The number of worker threads. If 0 (the default),
+                    jobs are computed and applied as soon as they are
+                    submitted.
+    :param dispatch: Optional function of the form dispatch(func), which
+                     arranges for func() to be called on the main thread
+                     (e.g. through a GUI event loop). If not provided,
+                     results are applied when :meth:`process_results` or
+                     :meth:`wait` is called.
+    """
+
+    def __init__(self, workers=0, dispatch=None):
+        self._workers = workers
+        self._dispatch = dispatch
+
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._latest = {}        # key -> most recently submitted job
+        self._finished = deque()  # computed jobs, waiting to be applied
+        self._outstanding = 0    # jobs submitted but not yet computed
+        self._queue = queue.Queue()
+        self._threads = []
+
+    @property
+    def asynchronous(self):
+        """ Whether jobs are computed in background threads """
+        return self._workers > 0
+
+    def submit(self, key, compute, apply, error=None):
+        """
+        Submit a new job. See :class:`ComputeJob` for the arguments.
+
+        :returns: The new :class:`ComputeJob`
+        """
+        job = ComputeJob(key, compute, apply, error)
+
+        if not self.asynchronous:
+            job.run()
+            job.finish()
+            return job
+
+        with self._lock:
+            old = self._latest.get(key)
+            if old is not None:
+                old.cancel()
+            self._latest[key] = job
+            self._outstanding += 1
+            self._start_threads()
+        self._queue.put(job)
+        return job
+
+    def cancel(self, key):
+        """ Cancel the outstanding job for a key, if any """
+        with self._lock:
+            job = self._latest.pop(key, None)
+        if job is not None:
+            job.cancel()
+
+    def pending(self, key):
+        """ Whether a job for a key is waiting to be computed or applied """
+        with self._lock:
+            return key in self._latest
+
+    def process_results(self):
+        """
+        Apply the results of finished jobs. Must be called from the
+        main thread.
+
+        :returns: The number of results applied
+        """
+        applied = 0
+        while True:
+            with self._lock:
+                if not self._finished:
+                    return applied
+                job = self._finished.popleft()
+                if job.cancelled or self._latest.get(job.key) is not job:
+                    continue
+                self._latest.pop(job.key)
+            job.finish()
+            applied += 1
+
+    def wait(self, timeout=None):
+        """
+        Block until all submitted jobs are computed, and apply their
+        results. Useful for scripts that do not run an event loop.
+
+        :param timeout: Optional maximum time to wait, in seconds
+        :returns: True if all jobs finished within the timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._idle:
+            while self._outstanding > 0:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._idle.wait(remaining)
+            finished = self._outstanding == 0
+        self.process_results()
+        return finished
+
+    def shutdown(self):
+        """
+        Stop the worker threads once the submitted jobs are computed
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for t in threads:
+            self._queue.put(None)
+        for t in threads:
+            t.join()
+
+    def _start_threads(self):
+        while len(self._threads) < self._workers:
+            t = threading.Thread(target=self._work)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            if not job.cancelled:
+                job.run()
+            with self._idle:
+                self._finished.append(job)
+                self._outstanding -= 1
+                self._idle.notify_all()
+            if self._dispatch is not None:
+                self._dispatch(self.process_results)
+
+
+_scheduler = ComputeScheduler()
+
+
+def get_scheduler():
+    """ The :class:`ComputeScheduler` used by layer artists by default """
+    return _scheduler
+
+
+def set_scheduler(scheduler):
+    """
+    Set the :class:`ComputeScheduler` used by layer artists by default
+
+    :returns: The previous scheduler
+    """
+    global _scheduler
+    previous, _scheduler = _scheduler, scheduler
+    return previous
@@ -26,13 +26,24 @@ import numpy as np
 from matplotlib.colors import Normalize
 
 from ..utils import fast_limits
+from ..core.percentiles import PercentileSketch
+from ..config import render_precision
 
 
-def norm(x, vmin, vmax):
+def norm(x, vmin, vmax, out=None):
     """
     Linearly scale data between [vmin, vmax] to [0, 1]. Clip outliers
+
+    If out is provided, the result is stored in it, at its precision.
+    Otherwise, a new float64 array is returned.
     """
-    result = (x - 1.0 * vmin)
+    if out is None:
+        result = (x - 1.0 * vmin)
+    else:
+        # subtract at the precision of the input if it is higher, so that
+        # large offsets do not swamp the variations within the image
+        dtype = np.promote_types(np.asarray(x).dtype, out.dtype)
+        result = np.subtract(x, vmin, out=out, dtype=dtype)
     result = np.divide(result, vmax - vmin, out=result)
     result = np.clip(result, 0, 1, out=result)
     return result
@@ -60,13 +71,12 @@ def cscale(x, bias, contrast):
     return x
 
 
-def linear_warp(x, vmin, vmax, bias, contrast):
-    return cscale(norm(x, vmin, vmax), bias, contrast)
+def linear_warp(x, vmin, vmax, bias, contrast, out=None):
+    return cscale(norm(x, vmin, vmax, out=out), bias, contrast)
 
 
-def log_warp(x, vmin, vmax, bias, contrast, exp=1000.0):
-    black = x < vmin
-    x = norm(x, vmin, vmax)
+def log_warp(x, vmin, vmax, bias, contrast, exp=1000.0, out=None):
+    x = norm(x, vmin, vmax, out=out)
     x = np.multiply(exp, x, out=x)
     # sidestep numpy bug that masks log(1)
     # when out is provided
@@ -77,31 +87,31 @@ def log_warp(x, vmin, vmax, bias, contrast, exp=1000.0):
     return x
 
 
-def pow_warp(x, vmin, vmax, bias, contrast, exp=1000.0):
-    x = norm(x, vmin, vmax)
+def pow_warp(x, vmin, vmax, bias, contrast, exp=1000.0, out=None):
+    x = norm(x, vmin, vmax, out=out)
     x = np.power(exp, x, out=x)
     x = np.subtract(x, 1, out=x)
-    x = np.divide(x, exp - 1)
+    x = np.divide(x, exp - 1, out=x)
     x = cscale(x, bias, contrast)
     return x
 
 
-def sqrt_warp(x, vmin, vmax, bias, contrast):
-    x = norm(x, vmin, vmax)
+def sqrt_warp(x, vmin, vmax, bias, contrast, out=None):
+    x = norm(x, vmin, vmax, out=out)
     x = np.sqrt(x, out=x)
     x = cscale(x, bias, contrast)
     return x
 
 
-def squared_warp(x, vmin, vmax, bias, contrast):
-    x = norm(x, vmin, vmax)
+def squared_warp(x, vmin, vmax, bias, contrast, out=None):
+    x = norm(x, vmin, vmax, out=out)
     x = np.power(x, 2, out=x)
     x = cscale(x, bias, contrast)
     return x
 
 
-def asinh_warp(x, vmin, vmax, bias, contrast):
-    x = norm(x, vmin, vmax)
+def asinh_warp(x, vmin, vmax, bias, contrast, out=None):
+    x = norm(x, vmin, vmax, out=out)
     x = np.divide(np.arcsinh(np.multiply(x, 10, out=x), out=x), 3, out=x)
     x = cscale(x, bias, contrast)
     return x
@@ -113,6 +123,30 @@ warpers = dict(linear=linear_warp,
                squared=squared_warp,
                arcsinh=asinh_warp)
 
+#: Integer images with at most this many bytes per pixel are normalized
+#: with a lookup table of the output for every representable value
+LUT_MAX_ITEMSIZE = 2
+
+
+def _lut_index_type(dtype):
+    """
+    The unsigned type with the same size and byte order as an integer type,
+    whose values index the lookup table
+    """
+    return np.dtype(dtype.str.replace('i', 'u'))
+
+
+def render_dtype():
+    """
+    The dtype of normalized images (see :data:`glue.config.render_precision`)
+    """
+    return np.dtype(render_precision())
+
+
+def _use_lut(value):
+    return (type(value) is np.ndarray and value.dtype.kind in 'iu' and
+            value.dtype.itemsize <= LUT_MAX_ITEMSIZE)
+
 
 # for mpl <= 1.1, Normalize is an old-style class
 # explicitly inheriting from object allows property to work
@@ -125,6 +159,9 @@ class DS9Normalize(Normalize, object):
         self.contrast = 1.0
         self.clip_lo = 5.
         self.clip_hi = 95.
+        self.exact_clip = False
+        self._lut_key = None
+        self._lut = None
 
     @property
     def stretch(self):
@@ -138,32 +175,88 @@ class DS9Normalize(Normalize, object):
         self._stretch = value
 
     def update_clip(self, image):
-        vmin, vmax = fast_limits(image, self.clip_lo, self.clip_hi)
+        """
+        Set vmin and vmax from the clip_lo and clip_hi percentiles
+
+        :param image: A :class:`~glue.core.percentiles.PercentileSketch`
+                      of the image values, or an array to estimate the
+                      percentiles from. Sketches give exact percentiles
+                      if exact_clip is True.
+        """
+        if isinstance(image, PercentileSketch):
+            vmin = image.percentile(self.clip_lo, exact=self.exact_clip)
+            vmax = image.percentile(self.clip_hi, exact=self.exact_clip)
+            if not np.isfinite(vmin):
+                vmin, vmax = 0.0, 1.0
+        else:
+            vmin, vmax = fast_limits(image, self.clip_lo, self.clip_hi)
         self.vmin = vmin
         self.vmax = vmax
 
-    def __call__(self, value, clip=False):
+    def __call__(self, value, clip=False, out=None):
+        """
+        Normalize an array
+
+        :param value: The array to normalize
+        :param out: Optional floating-point array to store the result in.
+                    If not provided, a new array with the precision given by
+                    :data:`glue.config.render_precision` is created.
+        :returns: The normalized values, as a masked array
+        """
         # XXX ignore clip
 
         self.autoscale_None(value)  # set vmin, vmax if unset
+
+        mask = np.ma.getmask(value)
+        value = np.ma.getdata(value)
+        if out is None:
+            out = np.empty(value.shape, dtype=render_dtype())
+
+        if _use_lut(value):
+            lut = self._lookup_table(value.dtype, out.dtype)
+            np.take(lut, value.view(_lut_index_type(value.dtype)), out=out)
+        else:
+            self._warp(value, out)
+
+        result = np.ma.MaskedArray(out, mask=mask, copy=False)
+
+        return result
+
+    def _lookup_table(self, dtype, out_dtype):
+        """
+        The normalized output for each value of a small integer type,
+        indexed by the value reinterpreted as an unsigned integer.
+
+        The table is cached until the normalization parameters change
+        """
+        dtype = dtype.newbyteorder('=')
+        key = (dtype, out_dtype, self.vmin, self.vmax, self.stretch,
+               self.bias, self.contrast)
+        if self._lut_key != key:
+            index = _lut_index_type(dtype)
+            values = np.arange(2 ** (8 * dtype.itemsize), dtype=index)
+            self._lut = self._warp(values.view(dtype),
+                                   np.empty(values.size, dtype=out_dtype))
+            self._lut_key = key
+        return self._lut
+
+    def _warp(self, value, out):
         inverted = self.vmax <= self.vmin
 
         hi, lo = max(self.vmin, self.vmax), min(self.vmin, self.vmax)
 
         warp = warpers[self.stretch]
-        result = warp(value, lo, hi, self.bias, self.contrast)
+        result = warp(value, lo, hi, self.bias, self.contrast, out=out)
 
         if inverted:
             result = np.subtract(1, result, out=result)
 
-        result = np.ma.MaskedArray(result, copy=False)
-
         return result
 
     def __gluestate__(self, context):
         return dict(vmin=self.vmin, vmax=self.vmax, clip_lo=self.clip_lo,
                     clip_hi=self.clip_hi, stretch=self.stretch, bias=self.bias,
-                    contrast=self.contrast)
+                    contrast=self.contrast, exact_clip=self.exact_clip)
 
     @classmethod
     def __setgluestate__(cls, rec, context):
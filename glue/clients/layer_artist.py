@@ -22,9 +22,13 @@ from ..external import six
 from ..core.exceptions import IncompatibleAttribute
 from ..core.util import PropertySetMixin, Pointer
 from ..core.subset import Subset
+from ..core.pyramid import ImagePyramid, image_pyramid, get_image_pyramid
+from ..core.percentiles import percentile_sketch
+from ..config import enable_image_pyramid
 from .util import small_view, small_view_array
+from .compute import get_scheduler
 from ..utils import view_cascade, get_extent, color2rgb
-from .ds9norm import DS9Normalize
+from .ds9norm import DS9Normalize, render_dtype
 
 
 __all__ = ['LayerArtistBase', 'LayerArtist', 'DendroLayerArtist',
@@ -86,6 +90,7 @@ class LayerArtistBase(PropertySetMixin):
         self._changed = True  # hint at whether underlying data has changed since last render
 
         self._disabled_reason = ''  # A string explaining why this layer is disabled.
+        self._scheduler = None  # ComputeScheduler, if not the default one
 
     def disable(self, reason):
         """
@@ -145,6 +150,47 @@ class LayerArtistBase(PropertySetMixin):
     def layer(self, value):
         self._layer = value
 
+    @property
+    def scheduler(self):
+        """
+        The :class:`~glue.clients.compute.ComputeScheduler` that runs
+        this layer's computations. Defaults to the global scheduler
+        """
+        return self._scheduler or get_scheduler()
+
+    @scheduler.setter
+    def scheduler(self, value):
+        self._scheduler = value
+
+    def _submit(self, compute, apply):
+        """
+        Run compute() with the layer's scheduler, and pass the result
+        to apply on the main thread.
+
+        compute should not access the plot, or any attributes of the
+        layer artist that may change before it runs. If compute raises
+        an IncompatibleAttribute exception, the layer is disabled.
+        When computations are asynchronous, the plot is redrawn once
+        the result is applied.
+        """
+        scheduler = self.scheduler
+
+        def finish(result):
+            apply(result)
+            if scheduler.asynchronous:
+                self.redraw()
+
+        def error(exc):
+            if not isinstance(exc, IncompatibleAttribute):
+                raise exc
+            self._changed = True
+            self.disable_invalid_attributes(*exc.args)
+            if scheduler.asynchronous:
+                self.redraw()
+
+        self._changed = False
+        scheduler.submit(self, compute, finish, error)
+
     @abstractmethod
     def redraw(self):
         """
@@ -372,6 +418,7 @@ class LayerArtist(LayerArtistBase):
         return len(self.artists) > 0
 
     def clear(self):
+        self.scheduler.cancel(self)
         for artist in self.artists:
             try:
                 artist.remove()
@@ -389,6 +436,7 @@ class ImageLayerArtist(LayerArtist, ImageLayerBase):
         self._cmap = gray
         self._override_image = None
         self._clip_cache = None
+        self._last_update = None  # (view, transpose) of the last update
 
     @property
     def norm(self):
@@ -415,8 +463,8 @@ class ImageLayerArtist(LayerArtist, ImageLayerBase):
         result.stretch = 'arcsinh'
         result.clip = True
         if vals.size > 0:
-            result.vmin = vals[.01 * vals.size]
-            result.vmax = vals[.99 * vals.size]
+            result.vmin = vals[int(.01 * vals.size)]
+            result.vmax = vals[int(.99 * vals.size)]
         return result
 
     def override_image(self, image):
@@ -426,44 +474,89 @@ class ImageLayerArtist(LayerArtist, ImageLayerBase):
     def clear_override(self):
         self._override_image = None
 
-    def _extract_view(self, view, transpose):
+    def _extract_view(self, view, transpose, pyramid=None):
+        """
+        Extract the image for a view.
+
+        :returns: The image, and the view into the data that it covers
+                  (which differs from the input view when the image is
+                  read from a coarse pyramid level)
+        """
         if self._override_image is None:
-            result = self.layer[view]
+            if pyramid is None:
+                result = self.layer[view]
+            else:
+                result, view = pyramid.extract(view)
             if transpose:
                 result = result.T
-            return result
+            return result, view
         else:
             v = [v for v in view if isinstance(v, slice)]
             if transpose:
                 v = v[::-1]
-            result = self._override_image[v]
+            result = self._override_image[tuple(v)]
+            return result, view
+
+    def _image_pyramid(self, view):
+        """
+        The image pyramid for the displayed slice, or None if pyramids
+        are disabled or the pyramid has not been built yet.
+
+        Missing pyramids are built with the layer's scheduler. When this
+        happens in the background, the layer is redrawn once the pyramid
+        is ready.
+        """
+        if self._override_image is not None or not enable_image_pyramid():
+            return None
+
+        result = get_image_pyramid(self.layer, view)
+        if result is not None:
             return result
 
+        scheduler = self.scheduler
+        key = (ImagePyramid, self)
+        if scheduler.pending(key):
+            return None
+
+        def ready(pyramid):
+            if pyramid is not None and scheduler.asynchronous and \
+                    self.artists:
+                self.update(*self._last_update)
+                self.redraw()
+
+        layer = self.layer
+        job = scheduler.submit(key, lambda: image_pyramid(layer, view), ready)
+        return None if scheduler.asynchronous else job.result
+
     def _update_clip(self, att):
+        exact = getattr(self.norm, 'exact_clip', False)
         key = (att, id(self._override_image),
-               self.norm.clip_lo, self.norm.clip_hi)
+               self.norm.clip_lo, self.norm.clip_hi, exact)
         if self._clip_cache == key:
             return
         self._clip_cache = key
 
         if self._override_image is None:
-            data = small_view(self.layer, att)
+            data = percentile_sketch(self.layer, att)
+            if data is None:
+                data = small_view(self.layer, att)
         else:
             data = small_view_array(self._override_image)
         self.norm.update_clip(data)
 
     def update(self, view, transpose=False):
         self.clear()
-        views = view_cascade(self.layer, view)
+        self._last_update = (view, transpose)
+        pyramid = self._image_pyramid(view)
+        views = [self._extract_view(v, transpose, pyramid)
+                 for v in view_cascade(self.layer, view)]
         artists = []
 
-        lr0 = self._extract_view(views[0], transpose)
+        lr0 = views[0][0]
         self.norm = self.norm or self._default_norm(lr0)
-        self.norm = self.norm or self._default_norm(lr0)
-        self._update_clip(views[0][0])
+        self._update_clip(view[0])
 
-        for v in views:
-            image = self._extract_view(v, transpose)
+        for image, v in views:
             extent = get_extent(v, transpose)
             artists.append(self._axes.imshow(image, cmap=self.cmap,
                                              norm=self.norm,
@@ -476,7 +569,7 @@ class ImageLayerArtist(LayerArtist, ImageLayerBase):
 
     def set_norm(self, vmin=None, vmax=None,
                  bias=None, contrast=None, stretch=None, norm=None,
-                 clip_lo=None, clip_hi=None):
+                 clip_lo=None, clip_hi=None, exact_clip=None):
         if norm is not None:
             self.norm = norm  # XXX Should wrap ala DS9Normalize(norm)
             return norm
@@ -494,6 +587,8 @@ class ImageLayerArtist(LayerArtist, ImageLayerBase):
             self.norm.clip_lo = clip_lo
         if clip_hi is not None:
             self.norm.clip_hi = clip_hi
+        if exact_clip is not None:
+            self.norm.exact_clip = exact_clip
         if stretch is not None:
             self.norm.stretch = stretch
         return self.norm
@@ -528,6 +623,19 @@ class RGBImageLayerArtist(ImageLayerArtist, RGBImageLayerBase):
         self.contrast_layer = 'green'
         self.layer_visible = dict(red=True, green=True, blue=True)
         self.last_view = last_view
+        self._buffers = {}  # index in view cascade -> RGB image buffer
+
+    def _rgb_buffer(self, index, shape):
+        """
+        An array to render an RGB image into, reused across updates as
+        long as the shape and rendering precision are unchanged
+        """
+        dtype = render_dtype()
+        result = self._buffers.get(index)
+        if result is None or result.shape != shape or result.dtype != dtype:
+            result = np.empty(shape, dtype=dtype)
+            self._buffers[index] = result
+        return result
 
     def set_norm(self, *args, **kwargs):
         spr = super(RGBImageLayerArtist, self).set_norm
@@ -572,20 +680,28 @@ class RGBImageLayerArtist(ImageLayerArtist, RGBImageLayerBase):
             self.gnorm = self.gnorm or self._default_norm(g)
             self.bnorm = self.bnorm or self._default_norm(b)
             if v is views[0]:
-                self.rnorm.update_clip(small_view(self.layer, self.r))
-                self.gnorm.update_clip(small_view(self.layer, self.g))
-                self.bnorm.update_clip(small_view(self.layer, self.b))
-
-            image = np.dstack((self.rnorm(r),
-                               self.gnorm(g),
-                               self.bnorm(b)))
+                for norm, att in [(self.rnorm, self.r), (self.gnorm, self.g),
+                                  (self.bnorm, self.b)]:
+                    sketch = percentile_sketch(self.layer, att)
+                    if sketch is None:
+                        sketch = small_view(self.layer, att)
+                    norm.update_clip(sketch)
+
+            image = self._rgb_buffer(len(artists), r.shape + (3,))
+            for i, (norm, values) in enumerate([(self.rnorm, r),
+                                                (self.gnorm, g),
+                                                (self.bnorm, b)]):
+                if isinstance(norm, DS9Normalize):
+                    norm(values, out=image[:, :, i])
+                else:
+                    image[:, :, i] = norm(values)
 
             if not self.layer_visible['red']:
-                image[:, :, 0] *= 0
+                image[:, :, 0] = 0
             if not self.layer_visible['green']:
-                image[:, :, 1] *= 0
+                image[:, :, 1] = 0
             if not self.layer_visible['blue']:
-                image[:, :, 2] *= 0
+                image[:, :, 2] = 0
 
             artists.append(self._axes.imshow(image,
                                              interpolation='nearest',
@@ -600,31 +716,35 @@ class SubsetImageLayerArtist(LayerArtist, SubsetImageLayerBase):
 
     def update(self, view, transpose=False):
         subset = self.layer
-        self.clear()
         logging.debug("View into subset %s is %s", self.layer, view)
 
-        try:
+        r, g, b = color2rgb(self.layer.style.color)
+        extent = get_extent(view, transpose)
+
+        def compute():
             mask = subset.to_mask(view[1:])
-        except IncompatibleAttribute as exc:
-            self.disable_invalid_attributes(*exc.args)
-            return False
-        logging.debug("View mask has shape %s", mask.shape)
+            logging.debug("View mask has shape %s", mask.shape)
 
-        # shortcut for empty subsets
-        if not mask.any():
-            return
+            # shortcut for empty subsets
+            if not mask.any():
+                return None
 
-        if transpose:
-            mask = mask.T
+            if transpose:
+                mask = mask.T
 
-        extent = get_extent(view, transpose)
-        r, g, b = color2rgb(self.layer.style.color)
-        mask = np.dstack((r * mask, g * mask, b * mask, mask * .5))
-        mask = (255 * mask).astype(np.uint8)
-        self.artists = [self._axes.imshow(mask, extent=extent,
-                                          interpolation='nearest',
-                                          origin='lower',
-                                          zorder=5, visible=self.visible)]
+            mask = np.dstack((r * mask, g * mask, b * mask, mask * .5))
+            return (255 * mask).astype(np.uint8)
+
+        def apply(image):
+            self.clear()
+            if image is None:
+                return
+            self.artists = [self._axes.imshow(image, extent=extent,
+                                              interpolation='nearest',
+                                              origin='lower',
+                                              zorder=5, visible=self.visible)]
+
+        self._submit(compute, apply)
 
 
 class DendroLayerArtist(LayerArtist):
@@ -646,7 +766,7 @@ class DendroLayerArtist(LayerArtist):
 
         try:
             if isinstance(self.layer, Subset):
-                ids = ids[self.layer.to_mask()]
+                ids = ids[self.layer.to_index_list()]
 
             x, y = self.layout
             blank = np.zeros(ids.size) * np.nan
@@ -692,27 +812,29 @@ class ScatterLayerArtist(LayerArtist, ScatterLayerBase):
         self.emphasis = None  # an optional SubsetState of emphasized points
 
     def _recalc(self):
-        self.clear()
-        assert len(self.artists) == 0
+        """Submit a job to extract the points to plot"""
+        layer, xatt, yatt = self.layer, self.xatt, self.yatt
 
-        try:
-            x = self.layer[self.xatt].ravel()
-            y = self.layer[self.yatt].ravel()
-        except IncompatibleAttribute as exc:
-            self.disable_invalid_attributes(*exc.args)
-            return False
+        def compute():
+            return layer[xatt].ravel(), layer[yatt].ravel()
 
-        self.artists = self._axes.plot(x, y)
-        return True
+        self._submit(compute, self._plot_points)
+
+    def _plot_points(self, points):
+        self.clear()
+        assert len(self.artists) == 0
+        self.artists = self._axes.plot(*points)
+        self._update_style()
 
     def update(self, view=None, transpose=False):
         self._check_subset_state_changed()
 
         if self._changed:  # erase and make a new artist
-            if not self._recalc():  # no need to update style
-                return
-            self._changed = False
+            self._recalc()
+        else:
+            self._update_style()
 
+    def _update_style(self):
         has_emph = False
         if self.emphasis is not None:
             try:
@@ -875,38 +997,49 @@ class HistogramLayerArtist(LayerArtist, HistogramLayerBase):
         self._y = np.array([])
 
     def _calculate_histogram(self):
-        """Recalculate the histogram, creating new patches"""
-        self.clear()
-        try:
-            data = self.layer[self.att].ravel()
+        """
+        Submit a job to recalculate the histogram. The new patches are
+        created and styled by :meth:`_plot_histogram`
+        """
+        layer, att, nbins = self.layer, self.att, self.nbins
+        lo, hi, xlog = self.lo, self.hi, self.xlog
+
+        def compute():
+            data = layer[att].ravel()
             if not np.isfinite(data).any():
-                return False
-        except IncompatibleAttribute as exc:
-            self.disable_invalid_attributes(*exc.args)
-            return False
+                return None
 
-        if data.size == 0:
-            return
+            if lo > np.nanmax(data) or hi < np.nanmin(data):
+                return None
+            if xlog:
+                data = np.log10(data)
+                rng = [np.log10(lo), np.log10(hi)]
+            else:
+                rng = lo, hi
+            return np.histogram(data, bins=nbins, range=rng)
 
-        if self.lo > np.nanmax(data) or self.hi < np.nanmin(data):
+        self._submit(compute, self._plot_histogram)
+
+    def _plot_histogram(self, histogram):
+        """Create new patches for a (counts, bin edges) histogram"""
+        self.clear()
+        if histogram is None:
+            self._changed = True  # try again on the next update
             return
-        if self.xlog:
-            data = np.log10(data)
-            rng = [np.log10(self.lo), np.log10(self.hi)]
-        else:
-            rng = self.lo, self.hi
-        nbinpatch = self._axes.hist(data,
-                                    bins=self.nbins,
-                                    range=rng)
+
+        counts, edges = histogram
+        nbinpatch = self._axes.hist(edges[:-1], bins=edges, weights=counts)
         self._y, self.x, self.artists = nbinpatch
-        return True
+        self._scale_state = None
+        self._check_scale_histogram()
+        self._sync_style()
 
     def _scale_histogram(self):
         """Modify height of bins to match ylog, cumulative, and norm"""
         if self.x.size == 0:
             return
 
-        y = self._y.astype(np.float)
+        y = self._y.astype(float)
         dx = self.x[1] - self.x[0]
         if self.normed:
             div = y.sum() * dx
@@ -944,10 +1077,11 @@ class HistogramLayerArtist(LayerArtist, HistogramLayerBase):
         """
         self._check_subset_state_changed()
         if self._changed:
-            if not self._calculate_histogram():
-                return
+            # the new patches are scaled and styled once they are ready
             self._changed = False
             self._scale_state = None
+            self._calculate_histogram()
+            return
         self._check_scale_histogram()
         self._sync_style()
 
@@ -0,0 +1,193 @@
+# pylint: disable=I0011,W0613,W0201,W0212,E1101,E1103
+
+from __future__ import absolute_import, division, print_function
+
+import threading
+
+import pytest
+import numpy as np
+from mock import MagicMock
+
+from .util import renderless_figure
+from ..compute import ComputeScheduler, get_scheduler, set_scheduler
+from ..layer_artist import (ScatterLayerArtist, HistogramLayerArtist,
+                            SubsetImageLayerArtist)
+from ...core import Data
+
+FIGURE = renderless_figure()
+
+
+class TestComputeScheduler(object):
+
+    def setup_method(self, method):
+        self.scheduler = ComputeScheduler(workers=2)
+
+    def teardown_method(self, method):
+        self.scheduler.shutdown()
+
+    def test_synchronous(self):
+        scheduler = ComputeScheduler()
+        apply = MagicMock()
+        job = scheduler.submit('a', lambda: 3, apply)
+        apply.assert_called_once_with(3)
+        assert job.done
+        assert not scheduler.asynchronous
+        assert not scheduler.pending('a')
+
+    def test_results_applied_on_wait(self):
+        apply = MagicMock()
+        self.scheduler.submit('a', lambda: 3, apply)
+        self.scheduler.submit('b', lambda: 4, apply)
+        assert self.scheduler.wait(timeout=5)
+        assert sorted(c[0][0] for c in apply.call_args_list) == [3, 4]
+        assert not self.scheduler.pending('a')
+
+    def test_results_applied_on_calling_thread(self):
+        threads = []
+
+        def apply(result):
+            threads.append((result, threading.current_thread()))
+
+        self.scheduler.submit('a', threading.current_thread, apply)
+        self.scheduler.wait(timeout=5)
+        (worker, main), = threads
+        assert main is threading.current_thread()
+        assert worker is not main
+
+    def test_superseded_job_discarded(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return 'old'
+
+        apply = MagicMock()
+        self.scheduler.submit('a', slow, apply)
+        started.wait(5)
+        self.scheduler.submit('a', lambda: 'new', apply)
+        release.set()
+        self.scheduler.wait(timeout=5)
+        apply.assert_called_once_with('new')
+
+    def test_cancel(self):
+        release = threading.Event()
+        apply = MagicMock()
+        self.scheduler.submit('a', lambda: release.wait(5), apply)
+        self.scheduler.cancel('a')
+        release.set()
+        self.scheduler.wait(timeout=5)
+        assert apply.call_count == 0
+
+    def test_error(self):
+        apply, error = MagicMock(), MagicMock()
+        exc = ValueError('bad')
+
+        def compute():
+            raise exc
+
+        self.scheduler.submit('a', compute, apply, error)
+        self.scheduler.submit('b', compute, apply)
+        with pytest.raises(ValueError):
+            self.scheduler.wait(timeout=5)
+        error.assert_called_once_with(exc)
+        assert apply.call_count == 0
+
+    def test_dispatch(self):
+        dispatched = []
+        scheduler = ComputeScheduler(workers=1, dispatch=dispatched.append)
+        apply = MagicMock()
+        scheduler.submit('a', lambda: 3, apply)
+        scheduler.shutdown()
+        assert apply.call_count == 0
+        assert dispatched[0]() == 1
+        apply.assert_called_once_with(3)
+
+    def test_set_scheduler(self):
+        previous = set_scheduler(self.scheduler)
+        try:
+            assert get_scheduler() is self.scheduler
+        finally:
+            assert set_scheduler(previous) is self.scheduler
+
+
+class TestAsyncLayerArtists(object):
+
+    def setup_method(self, method):
+        FIGURE.clf()
+        self.ax = FIGURE.add_subplot(111)
+        self.scheduler = ComputeScheduler(workers=2)
+        self.data = Data(x=[1, 2, 3, 4, 5], y=[2, 3, 4, 5, 6])
+        self.subset = self.data.new_subset()
+        self.subset.subset_state = self.data.id['x'] > 2
+
+    def teardown_method(self, method):
+        self.scheduler.shutdown()
+
+    def artist(self, cls, layer):
+        result = cls(layer, self.ax)
+        result.scheduler = self.scheduler
+        result.redraw = MagicMock()
+        return result
+
+    def test_scatter(self):
+        artist = self.artist(ScatterLayerArtist, self.subset)
+        artist.xatt, artist.yatt = self.data.id['x'], self.data.id['y']
+        artist.update()
+        self.scheduler.wait(timeout=5)
+        assert artist.redraw.call_count == 1
+        x, y = artist.artists[0].get_data()
+        np.testing.assert_array_equal(x, [3, 4, 5])
+        np.testing.assert_array_equal(y, [4, 5, 6])
+
+        # superseded by a new subset state before the result is applied
+        self.subset.subset_state = self.data.id['x'] > 4
+        artist.update()
+        self.subset.subset_state = self.data.id['x'] > 3
+        artist.update()
+        self.scheduler.wait(timeout=5)
+        assert artist.redraw.call_count == 2
+        np.testing.assert_array_equal(artist.artists[0].get_data()[0], [4, 5])
+
+    def test_incompatible_attribute(self):
+        artist = self.artist(ScatterLayerArtist, self.subset)
+        artist.xatt, artist.yatt = self.data.id['x'], Data(z=[1]).id['z']
+        artist.update()
+        self.scheduler.wait(timeout=5)
+        assert not artist.enabled
+        assert artist._changed
+
+    def test_histogram_matches_synchronous(self):
+        sync = HistogramLayerArtist(self.data, self.ax)
+        artist = self.artist(HistogramLayerArtist, self.data)
+        for a in [sync, artist]:
+            a.att = self.data.id['x']
+            a.lo, a.hi, a.nbins = 0, 6, 4
+            a.normed = True
+            a.update()
+        assert len(artist.artists) == 0
+        self.scheduler.wait(timeout=5)
+        np.testing.assert_array_equal(artist.x, sync.x)
+        np.testing.assert_array_equal(artist.y, sync.y)
+        assert len(artist.artists) == 4
+        assert not artist._changed
+
+    def test_subset_image(self):
+        data = Data(x=np.arange(12).reshape((3, 4)))
+        subset = data.new_subset()
+        subset.subset_state = data.id['x'] > 5
+        artist = self.artist(SubsetImageLayerArtist, subset)
+        view = (data.id['x'], slice(0, 3), slice(0, 4))
+        artist.update(view)
+        self.scheduler.wait(timeout=5)
+        image = artist.artists[0].get_array()
+        np.testing.assert_array_equal(image[..., 3] > 0, data['x'] > 5)
+
+    def test_clear_cancels(self):
+        artist = self.artist(ScatterLayerArtist, self.subset)
+        artist.xatt, artist.yatt = self.data.id['x'], self.data.id['y']
+        artist.update()
+        artist.clear()
+        self.scheduler.wait(timeout=5)
+        assert len(artist.artists) == 0
+        assert artist.redraw.call_count == 0
@@ -4,6 +4,7 @@ import numpy as np
 import pytest
 
 from ..ds9norm import *
+from ...core.percentiles import PercentileSketch
 
 
 def test_log_warp():
@@ -101,3 +102,67 @@ class TestDS9Normalize(object):
         with pytest.raises(ValueError) as exc:
             self.norm.stretch = 'invalid'
         assert exc.value.args[0].startswith("Invalid stretch")
+
+    def test_update_clip_sketch(self):
+        np.random.seed(0)
+        x = np.random.normal(size=200000)
+        x[::10] = 1e30
+        sketch = PercentileSketch(x)
+        self.norm.exact_clip = True
+        self.norm.update_clip(sketch)
+        np.testing.assert_array_equal([self.norm.vmin, self.norm.vmax],
+                                      np.percentile(x, [5, 95]))
+
+        self.norm.exact_clip = False
+        self.norm.clip_lo, self.norm.clip_hi = 1, 99
+        self.norm.update_clip(sketch)
+        lo, hi = np.percentile(x, [0.9, 1.1])
+        assert lo <= self.norm.vmin <= hi
+        assert self.norm.vmax == 1e30
+
+    def test_update_clip_empty_sketch(self):
+        self.norm.update_clip(PercentileSketch(np.array([np.nan])))
+        assert (self.norm.vmin, self.norm.vmax) == (0, 1)
+
+
+class TestLookupTable(object):
+
+    def setup_method(self, method):
+        np.random.seed(12345)
+        self.norm = DS9Normalize()
+        self.norm.vmin, self.norm.vmax = -100, 3000
+        self.norm.bias, self.norm.contrast = 0.4, 1.5
+
+    @pytest.mark.parametrize(('dtype', 'stretch'),
+                             [(d, s) for d in ['u1', 'i1', '<i2', '>i2', '<u2']
+                              for s in sorted(warpers)])
+    def test_matches_warp(self, dtype, stretch):
+        info = np.iinfo(np.dtype(dtype))
+        x = np.random.randint(info.min, info.max, (30, 40)).astype(dtype)
+        self.norm.stretch = stretch
+        expected = warpers[stretch](x, -100, 3000, 0.4, 1.5)
+        result = self.norm(x)
+        assert isinstance(result, np.ma.MaskedArray)
+        assert result.dtype == np.float32
+        np.testing.assert_allclose(result, expected, rtol=0, atol=1e-6)
+
+    def test_inverted(self):
+        x = np.arange(-5, 5, dtype=np.int8)
+        self.norm.vmin, self.norm.vmax = 3, -3
+        np.testing.assert_allclose(self.norm(x),
+                                   self.norm(x.astype(float)))
+
+    def test_cached(self):
+        x = np.arange(10, dtype=np.uint8)
+        self.norm(x)
+        lut = self.norm._lut
+        self.norm(x[::-1])
+        assert self.norm._lut is lut
+        self.norm.contrast = 2
+        self.norm(x)
+        assert self.norm._lut is not lut
+
+    def test_large_types_not_tabulated(self):
+        x = np.arange(10, dtype=np.int32)
+        self.norm(x)
+        assert self.norm._lut is None
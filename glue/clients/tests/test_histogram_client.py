@@ -3,6 +3,7 @@
 from __future__ import absolute_import, division, print_function
 
 import pytest
+import numpy as np
 
 from mock import MagicMock
 
@@ -559,6 +560,22 @@ class TestHistogramLayerArtist(object):
         self.artist.update()
         assert ct.call_count == 6
 
+    def test_retry_empty_histogram(self):
+        self.setup_subset()
+        self.artist.att = self.artist.layer.data.id['x']
+        self.artist.lo, self.artist.hi = 10, 20
+        self.artist.update()
+        assert self.artist._changed
+        assert self.artist.artists == []
+
+        self.artist._axes.hist.return_value = (np.array([1, 1]),
+                                               np.array([0, 2, 4]),
+                                               [])
+        self.artist.lo = 0
+        self.artist.update()
+        assert not self.artist._changed
+        assert self.artist._axes.hist.call_count == 1
+
     def test_rescale_on_state_changes(self):
         ct = self.setup_hist_scale_counter()
         assert ct.call_count == 0
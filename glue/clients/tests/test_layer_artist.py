@@ -1,6 +1,16 @@
+import numpy as np
+from mock import MagicMock, patch
+
 from .util import renderless_figure
-from ..layer_artist import ScatterLayerArtist
+from ..compute import ComputeScheduler
+from ..ds9norm import DS9Normalize, warpers
+from ..layer_artist import (ScatterLayerArtist, ImageLayerArtist,
+                            RGBImageLayerArtist)
+from ... import config
 from ...core import Data
+from ...core import pyramid as pyr
+from ...core.cache import index_cache
+from ...core.pyramid import image_pyramid
 
 FIGURE = renderless_figure()
 
@@ -19,3 +29,123 @@ class TestScatterArtist(object):
         s.emphasis = d.id['x'] > 1
 
         s.update()
+
+
+class TestImagePyramid(object):
+
+    def setup_method(self, method):
+        FIGURE.clf()
+        self.ax = FIGURE.add_subplot(111)
+        self.data = Data(x=np.arange(1024 ** 2.).reshape((1024, 1024)))
+        self.view = (self.data.id['x'], slice(0, 1024, 4), slice(0, 1024, 4))
+        index_cache.clear()
+        self.patches = [patch.object(pyr, 'MIN_PYRAMID_SIZE', 100),
+                        patch.object(config.enable_image_pyramid, 'state',
+                                     True)]
+        for p in self.patches:
+            p.start()
+
+    def teardown_method(self, method):
+        for p in self.patches:
+            p.stop()
+
+    def artist(self):
+        result = ImageLayerArtist(self.data, self.ax)
+        result.norm = DS9Normalize()
+        result.redraw = MagicMock()
+        return result
+
+    def test_pyramid_level_displayed(self):
+        artist = self.artist()
+        artist.update(self.view)
+        image = artist.artists[-1].get_array()
+        assert image.shape == (256, 256)
+        np.testing.assert_array_equal(image, image_pyramid(self.data,
+                                                           self.view).levels[2])
+        assert artist.artists[-1].get_extent() == [0, 1024, 0, 1024]
+
+    def test_pyramid_built_in_background(self):
+        artist = self.artist()
+        artist.scheduler = ComputeScheduler(workers=1)
+        try:
+            artist.update(self.view)
+            strided = artist.artists[-1].get_array()
+            np.testing.assert_array_equal(strided,
+                                          self.data['x'][::4, ::4])
+            artist.scheduler.wait(timeout=5)
+        finally:
+            artist.scheduler.shutdown()
+        assert artist.redraw.call_count == 1
+        assert artist.artists[-1].get_array().mean() != strided.mean()
+
+
+class TestImageClip(object):
+
+    def setup_method(self, method):
+        FIGURE.clf()
+        index_cache.clear()
+        np.random.seed(12345)
+        self.x = np.random.normal(size=(300, 400))
+        self.x[::7, ::3] = 1e30
+        self.data = Data(x=self.x)
+        self.view = (self.data.id['x'], slice(0, 300, 1), slice(0, 400, 1))
+        self.artist = ImageLayerArtist(self.data, FIGURE.add_subplot(111))
+        self.artist.norm = DS9Normalize()
+
+    def test_clip_from_sketch(self):
+        self.artist.set_norm(exact_clip=True, clip_lo=10, clip_hi=90)
+        self.artist.update(self.view)
+        norm = self.artist.norm
+        np.testing.assert_array_equal([norm.vmin, norm.vmax],
+                                      np.percentile(self.x, [10, 90]))
+
+    def test_clip_mode_change_updates(self):
+        self.artist.update(self.view)
+        vmin = self.artist.norm.vmin
+        self.artist.set_norm(exact_clip=True)
+        self.artist.update(self.view)
+        assert self.artist.norm.vmin != vmin
+        assert self.artist.norm.vmin == np.percentile(self.x, 5)
+
+
+class TestRGBImageRendering(object):
+
+    def setup_method(self, method):
+        FIGURE.clf()
+        np.random.seed(12345)
+        self.data = Data(r=np.random.random((30, 40)),
+                         g=np.random.random((30, 40)),
+                         b=np.arange(1200, dtype=np.int16).reshape((30, 40)))
+        self.view = (self.data.id['r'], slice(0, 30, 1), slice(0, 40, 1))
+        self.artist = RGBImageLayerArtist(self.data, FIGURE.add_subplot(111))
+        self.artist.r = self.data.id['r']
+        self.artist.g = self.data.id['g']
+        self.artist.b = self.data.id['b']
+        for n in ['rnorm', 'gnorm', 'bnorm']:
+            setattr(self.artist, n, DS9Normalize())
+
+    def test_render(self):
+        self.artist.layer_visible['green'] = False
+        self.artist.update(self.view)
+        image = self.artist._buffers[0]
+        assert image.dtype == np.float32
+        for i, (att, norm) in enumerate([('r', self.artist.rnorm),
+                                         ('b', self.artist.bnorm)]):
+            expected = warpers[norm.stretch](self.data[att], norm.vmin,
+                                             norm.vmax, norm.bias,
+                                             norm.contrast)
+            np.testing.assert_allclose(image[:, :, 2 * i], expected,
+                                       atol=1e-6)
+        assert (image[:, :, 1] == 0).all()
+
+    def test_buffers_reused(self):
+        self.artist.update(self.view)
+        buffers = dict(self.artist._buffers)
+        self.artist.update(self.view)
+        assert set(self.artist._buffers) == set(buffers)
+        assert all(self.artist._buffers[k] is buffers[k] for k in buffers)
+
+    def test_precision(self):
+        with patch.object(config.render_precision, 'state', 'float64'):
+            self.artist.update(self.view)
+        assert self.artist._buffers[0].dtype == np.float64
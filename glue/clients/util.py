@@ -15,7 +15,7 @@ def small_view(data, attribute):
     statistical summaries
     """
     shp = data.shape
-    view = tuple([slice(None, None, max(s / 50, 1)) for s in shp])
+    view = tuple([slice(None, None, max(s // 50, 1)) for s in shp])
     return data[attribute, view]
 
 
@@ -24,7 +24,7 @@ def small_view_array(data):
     Same as small_view, except using a numpy array as input
     """
     shp = data.shape
-    view = tuple([slice(None, None, max(s / 50, 1)) for s in shp])
+    view = tuple([slice(None, None, max(s // 50, 1)) for s in shp])
     return np.asarray(data)[view]
 
 
@@ -15,7 +15,9 @@ __all__ = ['Registry', 'SettingRegistry', 'ExporterRegistry',
            'SingleSubsetLayerActionRegistry', 'ProfileFitterRegistry',
            'qt_client', 'data_factory', 'link_function', 'link_helper',
            'colormaps', 'exporters', 'settings', 'fit_plugin',
-           'auto_refresh', 'importer']
+           'auto_refresh', 'enable_spatial_index',
+           'enable_sorted_index', 'enable_image_pyramid',
+           'enable_collapse_cache', 'render_precision', 'importer']
 
 
 class Registry(object):
@@ -433,6 +435,22 @@ class BooleanSetting(object):
 
         return self.state
 
+
+class ChoiceSetting(object):
+
+    def __init__(self, default, choices):
+        self.choices = list(choices)
+        self.state = default
+
+    def __call__(self, state=None):
+        if state is not None:
+            if state not in self.choices:
+                raise ValueError("Invalid setting: %s. Valid options are: %s"
+                                 % (state, self.choices))
+            self.state = state
+
+        return self.state
+
 qt_client = QtClientRegistry()
 tool_registry = QtToolRegistry()
 data_factory = DataFactoryRegistry()
@@ -449,6 +467,23 @@ single_subset_action = SingleSubsetLayerActionRegistry()
 auto_refresh = BooleanSetting(False)
 enable_contracts = BooleanSetting(False)
 
+# use a spatial index to speed up ROI selections on large datasets?
+enable_spatial_index = BooleanSetting(True)
+
+# use sorted indices to speed up repeated range selections on large datasets?
+enable_sorted_index = BooleanSetting(True)
+
+# display large images from downsampled (mean) pyramids, rather than by
+# striding through the full-resolution data?
+enable_image_pyramid = BooleanSetting(False)
+
+# cache cumulative sums along the collapse axis of cubes, so that sums,
+# means and moments over any range of channels are fast to compute?
+enable_collapse_cache = BooleanSetting(True)
+
+# floating-point precision of the arrays used to render images
+render_precision = ChoiceSetting('float32', ['float32', 'float64'])
+
 
 def load_configuration(search_path=None):
     ''' Find and import a config.py file
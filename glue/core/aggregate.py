@@ -1,15 +1,46 @@
+from __future__ import absolute_import, division, print_function
 """
 Classes to perform aggregations over cubes
-"""
-try:
-    from itertools import izip
-except ImportError:  # python3
-    izip = zip
 
+Aggregations are computed by streaming through the slab in chunks of
+planes along the collapse axis, so that only a few chunks are in memory at
+a time. Each chunk is reduced to a partial result (sums, counts, maxima,
+etc.) in a pool of threads, and the partial results are merged.
+
+Sums, means and moments are computed from cumulative sums along the
+collapse axis, which are built once for each plane through a cube and
+cached (see :data:`glue.config.enable_collapse_cache`). Changing the
+range of channels then only needs the difference of two cached planes.
+Cubes whose cumulative sums do not fit in the cache keep them every few
+channels, and the planes between the range and the nearest cached
+planes are read from the cube.
+"""
+import math
 from functools import wraps
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 from ..external.six.moves import range as xrange
+from ..config import enable_collapse_cache
+from .cache import index_cache, data_version
+
+#: The approximate number of bytes read from the slab at a time
+CHUNK_BYTES = 8 * 1024 ** 2
+
+#: The number of threads used to reduce chunks
+try:
+    WORKERS = min(cpu_count(), 4)
+except NotImplementedError:
+    WORKERS = 1
+
+#: Slabs larger than this (in bytes) use an approximate median, computed
+#: in a few streaming passes instead of holding the slab in memory
+MAX_MEDIAN_BYTES = 256 * 1024 ** 2
+
+#: The number of bits of the median resolved by each pass of the
+#: approximate median (which takes 32 / MEDIAN_BITS passes)
+MEDIAN_BITS = 4
 
 
 def check_empty(func):
@@ -74,27 +105,190 @@ class Aggregate(object):
         view[self.zax] = slice(*self.zlim)
         return view, ax_collapse
 
-    def _prepare_cube(self, attribute=None):
-        view, ax_collapse = self._subslice()
-        att = attribute or self.attribute
-        cube = self.data[att, view]
-        return cube, ax_collapse
+    def _chunks(self, min_planes=1, zlim=None):
+        """
+        The [lo, hi) ranges along the collapse axis read at a time,
+        covering zlim (by default, the slab)
+        """
+        ny, nx = self.shape
+        step = max(CHUNK_BYTES // (8 * ny * nx), min_planes)
+        lo, hi = zlim or self._zrange()
+        return [(z, min(z + step, hi)) for z in xrange(lo, hi, step)]
+
+    def _zrange(self):
+        """ The limits of the slab, clipped to the collapse axis """
+        n = self.data.shape[self.zax]
+        return min(self.zlim[0], n), min(self.zlim[1], n)
 
-    def _iter_slice(self, attribute=None):
-        # iterate through the uncollapsed slab one plane at a time
+    def _read(self, attribute, zlim):
         view, ax_collapse = self._subslice()
-        att = attribute or self.attribute
+        view[self.zax] = slice(*zlim)
+        return self.data[attribute, tuple(view)], ax_collapse
 
-        for z in xrange(*self.zlim):
-            view[self.zax] = z
-            plane = self.data[att, view]
-            yield np.nan_to_num(plane)
+    def _reduce(self, partial, merge, world=False, min_planes=1):
+        """
+        Reduce the slab one chunk at a time
+
+        :param partial: Function of the form partial(values, axis, start)
+                        (or partial(values, world, axis, start), if world
+                        is True) which reduces a chunk of the slab along
+                        axis. start is the index of the first plane of
+                        the chunk.
+        :param merge: Function which merges two partial results, for
+                      consecutive chunks
+        :param world: If True, pass the world coordinates along the
+                      collapse axis to partial
+        :param min_planes: The minimum number of planes in each chunk
+        :returns: The merged result
+        """
+        att = self.data.get_world_component_id(self.zax) if world else None
+
+        def work(zlim):
+            values, axis = self._read(self.attribute, zlim)
+            if world:
+                coords, _ = self._read(att, zlim)
+                return partial(values, coords, axis, zlim[0])
+            return partial(values, axis, zlim[0])
+
+        def work_group(group):
+            return _merge_all(merge, (work(c) for c in group))
+
+        chunks = self._chunks(min_planes)
+        nthreads = min(WORKERS, len(chunks))
+        if nthreads <= 1:
+            return work_group(chunks)
+
+        # each thread reduces a contiguous group of chunks, so only one
+        # chunk and one partial result per thread are held in memory
+        n = len(chunks)
+        groups = [chunks[i * n // nthreads: (i + 1) * n // nthreads]
+                  for i in xrange(nthreads)]
+        pool = ThreadPool(nthreads)
+        try:
+            return _merge_all(merge, pool.map(work_group, groups))
+        finally:
+            pool.close()
+            pool.join()
+
+    def _prefix_sums(self, kind):
+        """
+        Fetch the cumulative sums along the collapse axis for the current
+        plane through the cube, building them on first use
+
+        The sums are kept every few planes if keeping every plane would
+        take more than half of the budget of
+        :data:`glue.core.cache.index_cache`.
+
+        :param kind: 'values' for the sums and counts of finite values, or
+                     'moments' for the intensity-weighted sums of 1,
+                     coordinate and coordinate ** 2
+        :returns: A :class:`PrefixSums`, or None if the cache is disabled,
+                  two planes of sums would not fit in the cache, or the
+                  cube has infinite values
+        """
+        if not enable_collapse_cache():
+            return None
+
+        n = self.data.shape[self.zax]
+        ny, nx = self.shape
+        nsums = 2 if kind == 'values' else 3
+        max_planes = index_cache.max_bytes // 2 // (8 * nsums * ny * nx)
+        if max_planes < 2:
+            return None
+        step = max(int(math.ceil(n / (max_planes - 1))), 1)
+
+        plane = tuple(None if s in ['x', 'y'] or i == self.zax else s
+                      for i, s in enumerate(self.slc))
+        key = (PrefixSums, self.data, data_version(self.data),
+               self.attribute, self.zax, plane, kind, step)
+        result = index_cache.get(key)
+        if result is None:
+            result = self._build_prefix_sums(kind, n, step)
+            index_cache.set(key, result, owner=self.data)
+        return result if result.sums else None
+
+    def _terms(self, kind, zlim):
+        """
+        The terms summed by :meth:`_prefix_sums` for the planes [lo, hi),
+        with the collapse axis first
+        """
+        values, axis = self._read(self.attribute, zlim)
+        values = np.rollaxis(values, axis)
+        if kind == 'values':
+            return [np.where(np.isnan(values), 0, values),
+                    np.isfinite(values)]
 
-    def _iter_slice_index(self):
-        """Loop over slices of the target attribute and its world coordinate"""
         att = self.data.get_world_component_id(self.zax)
-        loop = izip(self._iter_slice(), self._iter_slice(att))
-        return loop
+        loc, _ = self._read(att, zlim)
+        loc = np.rollaxis(np.nan_to_num(_compact(loc)), axis)
+        w = np.maximum(np.nan_to_num(values), 0)
+        x = w * loc
+        return [w, x, x * loc]
+
+    def _build_prefix_sums(self, kind, n, step):
+        sums = None
+        total = None
+        for zlim in self._chunks(zlim=(0, n)):
+            terms = self._terms(kind, zlim)
+            if np.isinf(terms[0]).any():
+                # differences of cumulative sums would be nan
+                return PrefixSums([], step, n)
+
+            # accumulate in float64, so that the differences of the sums
+            # of float32 cubes are as accurate as summing the range
+            cums = [np.cumsum(t, axis=0, dtype=np.float64) for t in terms]
+            if sums is None:
+                shape = (n // step + (n % step > 0) + 1,) + cums[0].shape[1:]
+                sums = [np.zeros(shape) for _ in terms]
+                total = [np.zeros(shape[1:]) for _ in terms]
+
+            # keep the sums at every checkpoint in (lo, hi]
+            lo, hi = zlim
+            for z in xrange(lo + 1, hi + 1):
+                if z % step == 0 or z == n:
+                    j = -(-z // step)
+                    for s, t, c in zip(sums, total, cums):
+                        np.add(t, c[z - lo - 1], out=s[j])
+            for t, c in zip(total, cums):
+                t += c[-1]
+        return PrefixSums(sums, step, n)
+
+    def _sum_terms(self, kind, zlim):
+        """ The sums of :meth:`_terms` over the planes [lo, hi) """
+        result = None
+        for chunk in self._chunks(zlim=zlim):
+            sums = [t.sum(axis=0, dtype=np.float64)
+                    for t in self._terms(kind, chunk)]
+            result = sums if result is None else _add_pairs(result, sums)
+        return result
+
+    def _prefix_range(self, kind):
+        """
+        The sums of :meth:`_terms` over the slab, computed from the cached
+        cumulative sums and the planes between the slab and the nearest
+        checkpoints
+
+        :returns: A tuple of arrays, or None if the cumulative sums are
+                  not available, or the slab is no larger than the number
+                  of planes that would be read
+        """
+        prefix = self._prefix_sums(kind)
+        if prefix is None:
+            return None
+
+        lo, hi = self._zrange()
+        a, b = prefix.nearest(lo), prefix.nearest(hi)
+        if a >= b or abs(a - lo) + abs(b - hi) >= hi - lo:
+            return None
+
+        result = list(prefix.range(a, b))
+        edges = [((lo, a), 1), ((a, lo), -1), ((b, hi), 1), ((hi, b), -1)]
+        for zlim, sign in edges:
+            if zlim[0] >= zlim[1]:
+                continue
+            for r, s in zip(result, self._sum_terms(kind, zlim)):
+                r += sign * s
+        return tuple(result)
 
     def _finalize(self, cube):
         if self.slc.index('x') < self.slc.index('y'):
@@ -103,9 +297,12 @@ class Aggregate(object):
 
     def collapse_using(self, function):
         """
-        Produce a collapsed image using a numpy aggregation function
+        Produce a collapsed image using a numpy aggregation function.
+
+        This reads the whole slab into memory. The aggregation methods of
+        this class stream through the slab instead.
         """
-        cube, ax = self._prepare_cube()
+        cube, ax = self._read(self.attribute, self.zlim)
         result = function(cube, axis=ax)
         return self._finalize(result)
 
@@ -114,12 +311,23 @@ class Aggregate(object):
         y, x = np.mgrid[:idx.shape[0], :idx.shape[1]]
         for i, s in enumerate(self.slc):
             if s not in ['x', 'y']:
-                args[i] = np.ones(idx.size) * s
+                args[i] = np.ones(idx.size, dtype=int) * s
         args[self.slc.index('y')] = y.ravel()
         args[self.slc.index('x')] = x.ravel()
         args[self.zax] = idx.ravel()
         att = self.data.get_world_component_id(self.zax)
-        return self.data[att, args].reshape(idx.shape)
+        return self.data[att, tuple(args)].reshape(idx.shape)
+
+    @staticmethod
+    def incremental_operators():
+        """
+        The operators which are fast to recompute after changing the
+        range of channels, since they use cached cumulative sums
+        """
+        return (Aggregate.sum,
+                Aggregate.mean,
+                Aggregate.mom1,
+                Aggregate.mom2)
 
     @staticmethod
     def all_operators():
@@ -132,76 +340,226 @@ class Aggregate(object):
                 Aggregate.mom2,
                 Aggregate.median)
 
-    @staticmethod
-    def _mean(cube, axis):
-        s = np.nansum(cube, axis)
-        ct = np.isfinite(cube).sum(axis)
-        return 1. * s / ct
+    def _sums(self):
+        # sums and counts of the finite values
+        result = self._prefix_range('values')
+        if result is not None:
+            return result
+
+        def partial(x, axis, start):
+            return (np.nansum(x, axis, dtype=np.float64),
+                    np.isfinite(x).sum(axis))
+
+        return self._reduce(partial, _add_pairs)
 
     @check_empty
     def sum(self):
-        return self.collapse_using(np.nansum)
+        return self._finalize(self._sums()[0])
 
     @check_empty
     def mean(self):
-        return self.collapse_using(self._mean)
+        s, ct = self._sums()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self._finalize(1. * s / ct)
 
     @check_empty
     def max(self):
-        return self.collapse_using(np.nanmax)
+        result = self._reduce(lambda x, axis, start: np.fmax.reduce(x, axis),
+                              np.fmax)
+        return self._finalize(result)
 
     @check_empty
     def median(self):
-        # NOTE: nans are treated as infinity in this case
-        return self.collapse_using(np.median)
+        """
+        Median value. For slabs larger than :data:`MAX_MEDIAN_BYTES`, this
+        is approximated by the lower median of the values rounded to
+        float32, which is found in a few streaming passes.
+        """
+        ny, nx = self.shape
+        lo, hi = self._zrange()
+        depth = hi - lo
+        if 8 * depth * ny * nx <= MAX_MEDIAN_BYTES:
+            # NOTE: nans are treated as infinity in this case
+            return self.collapse_using(np.median)
+        return self._finalize(self._approximate_median(depth))
+
+    def _approximate_median(self, depth):
+        # radix selection of the lower median of each pixel: each pass
+        # counts the values whose float32 sort keys share the prefix found
+        # so far, binned by the next MEDIAN_BITS bits, and extends the
+        # prefix with the bin that holds the median. Keys of NaN sort
+        # after +inf, so NaNs are treated as infinity.
+        rank = (depth - 1) // 2
+        nbins = 2 ** MEDIAN_BITS
+        prefix = np.empty(self.shape, dtype=np.int64)
+        if self.slc.index('x') < self.slc.index('y'):
+            prefix = prefix.T
+        prefix[...] = -2 ** 31
+        offset = np.arange(prefix.size).reshape(prefix.shape)
+
+        def merge(a, b):
+            return np.add(a, b, out=a)
+
+        for shift in xrange(32 - MEDIAN_BITS, -1, -MEDIAN_BITS):
+            def partial(x, axis, start):
+                # keys below the prefix land in the first bin, and keys
+                # above it in the last
+                b = _sort_keys(np.rollaxis(x, axis)).astype(np.int64,
+                                                            order='C')
+                b -= prefix
+                b >>= shift
+                b = np.clip(b, 0, nbins - 1, out=b)
+                b *= prefix.size
+                b += offset
+                counts = np.bincount(b.ravel(), minlength=nbins * prefix.size)
+                return counts.reshape((nbins,) + prefix.shape)
+
+            # partial results are as large as nbins planes, so chunks are
+            # made at least as large to amortize the cost of merging them
+            counts = self._reduce(partial, merge, min_planes=nbins)
+            counts = np.cumsum(counts, axis=0)
+
+            # the median is in the first bin with more than rank values
+            # in or below it
+            j = np.argmax(counts > rank, axis=0)
+            prefix += j.astype(np.int64) << shift
+
+        return _from_sort_keys(prefix)
+
+    def _arg_extreme(self, argfunc, func, fill, better):
+        def partial(x, axis, start):
+            x = np.where(np.isnan(x), fill, x)
+            return argfunc(x, axis) + start, func(x, axis)
+
+        def merge(a, b):
+            # ties go to the earlier chunk
+            use_b = better(b[1], a[1])
+            return np.where(use_b, b[0], a[0]), np.where(use_b, b[1], a[1])
+
+        idx, _ = self._reduce(partial, merge)
+        idx -= self.zlim[0]
+        return self._to_world(self._finalize(idx))
 
     @check_empty
     def argmax(self):
         """
         Location of peak value, in world coords
         """
-        idx = self.collapse_using(np.nanargmax)
-        return self._to_world(idx)
+        return self._arg_extreme(np.argmax, np.max, -np.inf, np.greater)
 
     @check_empty
     def argmin(self):
         """
         Location of minimum value, in world coords
         """
-        idx = self.collapse_using(np.nanargmin)
-        return self._to_world(idx)
+        return self._arg_extreme(np.argmin, np.min, np.inf, np.less)
+
+    def _moments(self):
+        # intensity-weighted sums of 1, coordinate and coordinate ** 2
+        result = self._prefix_range('moments')
+        if result is not None:
+            return result
+
+        def partial(val, loc, axis, start):
+            val = np.nan_to_num(val)
+            val = np.maximum(val, 0, out=val)
+            loc = np.nan_to_num(_compact(loc))
+            if loc.size == loc.shape[axis]:
+                # coordinates vary along the collapse axis only, so the
+                # sums are a single matrix product
+                loc = loc.ravel()
+                weights = np.array([np.ones_like(loc), loc, loc ** 2])
+                return tuple(np.tensordot(weights, val, (1, axis)))
+            x = val * loc
+            return (val.sum(axis, dtype=np.float64),
+                    x.sum(axis, dtype=np.float64),
+                    (x * loc).sum(axis, dtype=np.float64))
+
+        return self._reduce(partial, _add_pairs, world=True)
 
     @check_empty
     def mom1(self):
         """
         Intensity-weighted coordinate. Pixel units.
         """
-        # build up slice-by-slice, to avoid big temporary cubes
-        loop = self._iter_slice_index()
-        val, loc = next(loop)
-
-        val = np.maximum(val, 0)
-        w, result = val, loc * val
-        for val, loc in loop:
-            val = np.maximum(val, 0)
-            result += val * loc
-            w += val
-        return self._finalize(result / w)
+        w, x, _ = self._moments()
+        return self._finalize(x / w)
 
     @check_empty
     def mom2(self):
         """
         Intensity-weighted coordinate dispersion. Pixel units.
         """
-        loop = self._iter_slice_index()
-        val, loc = next(loop)
+        w, x, x2 = self._moments()
+        # rounding can leave the variance of narrow ranges slightly negative
+        return self._finalize(np.sqrt(np.maximum(x2 / w - (x / w) ** 2, 0)))
+
+
+class PrefixSums(object):
+
+    """
+    Cumulative sums of planes along the collapse axis of a cube, kept
+    every ``step`` planes
+
+    :param sums: A list of arrays. Element j of each holds the sum of the
+                 first ``j * step`` planes, and the last element holds
+                 the sum of all planes.
+    :param step: The number of planes between checkpoints
+    :param size: The length of the collapse axis
+    """
+
+    def __init__(self, sums, step=1, size=None):
+        self.sums = sums
+        self.step = step
+        self.size = size
+
+    @property
+    def nbytes(self):
+        return sum(s.nbytes for s in self.sums)
+
+    def nearest(self, z):
+        """ The checkpoint closest to plane z """
+        return min(int(round(z / self.step)) * self.step, self.size)
+
+    def range(self, lo, hi):
+        """ The sums over planes [lo, hi), which must be checkpoints """
+        jlo, jhi = -(-lo // self.step), -(-hi // self.step)
+        return tuple(s[jhi] - s[jlo] for s in self.sums)
+
+
+def _sort_keys(x):
+    """
+    Map values (rounded to float32) to 32-bit integers with the same sort
+    order, by flipping the magnitude bits of negative numbers
+    """
+    bits = np.asarray(x, dtype=np.float32).view(np.int32)
+    return bits ^ ((bits >> 31) & 0x7fffffff)
+
+
+def _from_sort_keys(keys):
+    """ The inverse of :func:`_sort_keys` """
+    bits = np.asarray(keys, dtype=np.int32)
+    bits = bits ^ ((bits >> 31) & 0x7fffffff)
+    return bits.view(np.float32).astype(float)
+
+
+def _compact(x):
+    """
+    Drop the repeated values along the broadcast (zero-stride) axes of
+    an array. The result broadcasts back to the original shape.
+    """
+    x = np.asarray(x)
+    view = [slice(0, 1) if stride == 0 else slice(None)
+            for stride in x.strides]
+    return x[tuple(view)]
+
+
+def _add_pairs(a, b):
+    return tuple(x + y for x, y in zip(a, b))
 
-        val = np.maximum(val, 0)
-        w, x, x2 = val, val * loc, val * loc * loc
-        for val, loc in loop:
-            val = np.maximum(val, 0)
-            w += val
-            x += loc * val
-            x2 += loc ** 2 * val
 
-        return self._finalize(np.sqrt(x2 / w - (x / w) ** 2))
+def _merge_all(merge, results):
+    result = None
+    for r in results:
+        result = r if result is None else merge(result, r)
+    return result
@@ -0,0 +1,125 @@
+from __future__ import absolute_import, division, print_function
+"""
+Spectra of cubes averaged over apertures in the image plane.
+
+An aperture is a 2D array over the plane through a cube: a boolean mask,
+or an array of weights (pixels with zero weight are outside the
+aperture). The pixels inside any of the apertures are gathered once, as
+an (n_pix, n_channel) block, by reading the bounding box of the apertures
+a few channels at a time. This keeps memory bounded for large or lazily
+loaded cubes, and lets several apertures share each read.
+"""
+
+import numpy as np
+
+from ..external.six.moves import range as xrange
+
+__all__ = ['aperture_spectra', 'rectangle_aperture']
+
+#: The approximate number of bytes read from the cube at a time
+CHUNK_BYTES = 8 * 1024 ** 2
+
+
+def _plane_axes(slc):
+    return tuple(sorted([slc.index('x'), slc.index('y')]))
+
+
+def rectangle_aperture(shape, slc, xlim, ylim):
+    """
+    A boolean aperture covering a rectangle of pixels
+
+    :param shape: The shape of the cube
+    :param slc: A tuple describing the slice, containing 'x' and 'y'
+    :param xlim: The (start, stop) pixel range along the 'x' axis
+    :param ylim: The (start, stop) pixel range along the 'y' axis
+    """
+    axes = _plane_axes(slc)
+    result = np.zeros([shape[a] for a in axes], dtype=bool)
+    view = [None, None]
+    view[axes.index(slc.index('x'))] = slice(*xlim)
+    view[axes.index(slc.index('y'))] = slice(*ylim)
+    result[tuple(view)] = True
+    return result
+
+
+def _channels(data, slc, zaxis, box, chunk_planes):
+    """
+    Yield the range of each chunk of channels, and the view that reads the
+    bounding box of the apertures over those channels
+    """
+    nz = data.shape[zaxis]
+    for start in xrange(0, nz, chunk_planes):
+        stop = min(start + chunk_planes, nz)
+        view = [s if s not in ['x', 'y'] else None for s in slc]
+        for a, b in zip(_plane_axes(slc), box):
+            view[a] = b
+        view[zaxis] = slice(start, stop, 1)
+        yield start, stop, tuple(view)
+
+
+def aperture_spectra(data, attribute, apertures, slc, zaxis):
+    """
+    Average a cube over one or more apertures, for every channel along
+    ``zaxis``. Non-finite values are ignored.
+
+    :param data: The :class:`~glue.core.data.Data` holding the cube
+    :param attribute: The :class:`~glue.core.data.ComponentID` to extract
+    :param apertures: A list of 2D arrays (boolean masks or weights) over
+                      the plane through the cube, with their axes in the
+                      same order as in the data
+    :param slc: A tuple describing the slice. Entries other than 'x', 'y'
+                and ``zaxis`` give the position along the remaining axes
+    :param zaxis: The spectral axis
+    :returns: An array of shape (len(apertures), data.shape[zaxis]). The
+              spectra of empty apertures, and channels without finite
+              values, are NaN.
+    """
+    nz = data.shape[zaxis]
+    result = np.zeros((len(apertures), nz)) * np.nan
+
+    apertures = [np.asarray(a) for a in apertures]
+    union = np.zeros(apertures[0].shape, dtype=bool) if apertures else None
+    for a in apertures:
+        union |= a != 0
+    if union is None or not union.any():
+        return result
+
+    # gather indices of the pixels inside any aperture, relative to their
+    # bounding box, and each aperture's weights for those pixels
+    pix = np.nonzero(union)
+    box = tuple(slice(p.min(), p.max() + 1, 1) for p in pix)
+    local = tuple(p - b.start for p, b in zip(pix, box))
+    members = []
+    for a in apertures:
+        w = a[pix]
+        inside = np.nonzero(w)[0]
+        weights = None if w.dtype == bool else w[inside, np.newaxis]
+        members.append((inside, weights))
+
+    axes = _plane_axes(slc)
+    box_size = (box[0].stop - box[0].start) * (box[1].stop - box[1].start)
+    chunk_planes = max(CHUNK_BYTES // (8 * box_size), 1)
+
+    for start, stop, view in _channels(data, slc, zaxis, box, chunk_planes):
+        values = data[attribute, view]
+
+        # remaining axes are the plane and spectral axes, in data order
+        order = sorted(axes + (zaxis,))
+        values = values.transpose([order.index(a) for a in axes + (zaxis,)])
+        block = values[local]
+
+        for i, (inside, weights) in enumerate(members):
+            if inside.size == 0:
+                continue
+            val = block[inside]
+            finite = np.isfinite(val)
+            if weights is None:
+                total = np.nansum(val, axis=0)
+                norm = finite.sum(axis=0)
+            else:
+                total = np.nansum(val * weights, axis=0)
+                norm = (finite * weights).sum(axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result[i, start:stop] = total / norm
+
+    return result
@@ -0,0 +1,248 @@
+from __future__ import absolute_import, division, print_function
+"""
+Bounded caches for numerical results derived from Data objects.
+
+Results such as subset masks are keyed on the objects that produced them,
+the version of the :class:`~glue.core.data.Data` they were computed from, and
+the view into the data. Caches have a byte budget, and the least recently
+used entries are evicted once the budget is exceeded.
+"""
+
+import numbers
+import threading
+from functools import wraps
+
+import numpy as np
+
+from ..compat.collections import OrderedDict
+
+__all__ = ['ArrayCache', 'view_key', 'data_version', 'cached_mask',
+           'get_cached_mask', 'cached_view', 'mask_cache', 'component_cache',
+           'index_cache']
+
+
+def view_key(view):
+    """Convert a view into a hashable key
+
+    :param view: A view into an array (None, integer, slice, or a tuple
+                 of these)
+
+    :raises: TypeError, if the view cannot be hashed (e.g. fancy indexing
+             with arrays or lists)
+    """
+    if view is None or view is Ellipsis:
+        return view
+    if isinstance(view, tuple):
+        return tuple(view_key(v) for v in view)
+    if isinstance(view, slice):
+        return ('slice', view_key(view.start), view_key(view.stop),
+                view_key(view.step))
+    if isinstance(view, numbers.Integral):
+        return int(view)
+    raise TypeError("Cannot build a cache key for view %r" % (view,))
+
+
+def data_version(data):
+    """
+    The version number of a dataset. This is incremented whenever
+    the numerical values of the data change.
+    """
+    return getattr(data, '_version', 0)
+
+
+class ArrayCache(object):
+
+    """
+    A least-recently-used cache of numpy arrays, bounded by memory usage.
+    Caches can be shared between threads.
+
+    Each entry belongs to an *owner* (usually a
+    :class:`~glue.core.data.Data` instance), so that all of the entries
+    derived from a dataset can be invalidated at once.
+
+    :param max_bytes: The memory budget of the cache, in bytes
+    """
+
+    def __init__(self, max_bytes=2 ** 29):
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._nbytes = 0
+        self._max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_bytes(self):
+        """ The memory budget of the cache, in bytes """
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value):
+        with self._lock:
+            self._max_bytes = int(value)
+            self._evict()
+
+    @property
+    def nbytes(self):
+        """ The number of bytes currently held by the cache """
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """
+        Fetch a cached value, marking it as recently used
+
+        Updates the hit and miss counters
+        """
+        with self._lock:
+            try:
+                owner, value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries[key] = (owner, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, owner=None):
+        """
+        Add a value to the cache
+
+        :param key: Hashable key for the entry
+        :param value: The array to store
+        :param owner: Optional object that the entry derives from.
+                      See :meth:`invalidate`
+        """
+        size = _nbytes(value)
+        with self._lock:
+            self._discard(key)
+            if size > self._max_bytes:
+                return
+            self._entries[key] = (owner, value)
+            self._nbytes += size
+            self._evict()
+
+    def invalidate(self, owner):
+        """
+        Remove every entry that belongs to an owner
+        """
+        with self._lock:
+            stale = [k for k, (o, _) in self._entries.items() if o is owner]
+            for k in stale:
+                self._discard(k)
+
+    def clear(self):
+        """ Remove all entries and reset the hit and miss counters """
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def _discard(self, key):
+        if key in self._entries:
+            _, value = self._entries.pop(key)
+            self._nbytes -= _nbytes(value)
+
+    def _evict(self):
+        while self._nbytes > self._max_bytes and self._entries:
+            _, (_, value) = self._entries.popitem(last=False)
+            self._nbytes -= _nbytes(value)
+
+
+def _nbytes(value):
+    return getattr(value, 'nbytes', 0)
+
+
+#: The cache shared by all SubsetState.to_mask results
+mask_cache = ArrayCache()
+
+#: The cache for values computed on the fly by Components
+component_cache = ArrayCache()
+
+#: The cache for search structures built over components (e.g. spatial
+#: indices). Entries must define an ``nbytes`` attribute
+index_cache = ArrayCache()
+
+
+def cached_mask(func):
+    """
+    Cache the result of a SubsetState.to_mask(data, view) method in
+    :data:`mask_cache`.
+
+    Results are keyed on the subset state, the data and its version, and
+    the view. Views that cannot be hashed (e.g. boolean or integer index
+    arrays) are not cached. Copies of a subset state that set a
+    ``_mask_origin`` attribute share the cached masks of the original.
+    """
+
+    @wraps(func)
+    def wrapper(self, data, view=None):
+        try:
+            key = _mask_key(self, data, view)
+            result = mask_cache.get(key)
+        except TypeError:  # unhashable input
+            return func(self, data, view)
+
+        if result is None:
+            result = func(self, data, view)
+            mask_cache.set(key, result, owner=data)
+        return result
+
+    return wrapper
+
+
+def get_cached_mask(state, data, view=None):
+    """
+    Return the mask of a subset state if it is cached, or None
+    """
+    try:
+        key = _mask_key(state, data, view)
+    except TypeError:  # unhashable input
+        return None
+    if key not in mask_cache:
+        return None
+    return mask_cache.get(key)
+
+
+def _mask_key(state, data, view):
+    state = getattr(state, '_mask_origin', state)
+    return (state, data, data_version(data), view_key(view))
+
+
+def cached_view(cache, key, data, view, func):
+    """
+    Evaluate ``func(view)`` for a view into a dataset, caching the result
+
+    If the result for the full dataset (``view=None``) is already cached,
+    other views are extracted from it instead of calling ``func``.
+
+    :param cache: The :class:`ArrayCache` to use
+    :param key: Hashable key identifying ``func``
+    :param data: The :class:`~glue.core.data.Data` the result derives from
+    :param view: The view to evaluate
+    :param func: Function that computes the result for a view
+    """
+    key = (key, data, data_version(data))
+
+    full = key + (None,)
+    if view is not None and full in cache:
+        return cache.get(full)[view]
+
+    try:
+        key = key + (view_key(view),)
+    except TypeError:  # unhashable input
+        return func(view)
+
+    result = cache.get(key)
+    if result is None:
+        result = func(view)
+        if isinstance(result, np.ndarray):
+            result.setflags(write=False)
+            cache.set(key, result, owner=data)
+    return result
@@ -21,6 +21,154 @@ OPSYM = {operator.add: '+', operator.sub: '-',
          operator.truediv: '/', operator.mul: '*',
          operator.pow: '**'}
 
+# numpy ufuncs equivalent to the binary operators used by
+# BinaryComponentLink and InequalitySubsetState
+_UFUNCS = {operator.add: np.add, operator.sub: np.subtract,
+           operator.mul: np.multiply, operator.truediv: np.true_divide,
+           operator.pow: np.power,
+           operator.gt: np.greater, operator.ge: np.greater_equal,
+           operator.lt: np.less, operator.le: np.less_equal,
+           operator.eq: np.equal, operator.ne: np.not_equal}
+if hasattr(operator, 'div'):
+    _UFUNCS[operator.div] = np.divide
+
+#: The number of elements evaluated at a time by fused link arithmetic
+CHUNK_SIZE = 2 ** 16
+
+
+class _FusedKernel(object):
+
+    """
+    A tree of binary operations on ComponentIDs, flattened into a list of
+    ufunc calls.
+
+    Each input (a ComponentID, or a ComponentLink other than a
+    BinaryComponentLink with a known operator) is read once, constants are
+    folded, and identical subexpressions are computed once. Large inputs
+    are evaluated a block of rows at a time, with the intermediate results
+    of every block written into the same buffers, so the only full-size
+    array allocated is the result.
+
+    :param left: The left operand of the root operation
+    :param right: The right operand of the root operation
+    :param op: The root operation, which must be in ``_UFUNCS``
+    """
+
+    def __init__(self, left, right, op):
+        self._inputs = []
+        self._code = []
+        self._keys = {}
+        self._output = self._add(left, right, op)
+
+    def _operand(self, value):
+        """
+        The operand for a node in the tree: ('const', value), ('input', i)
+        or ('tmp', j)
+        """
+        if isinstance(value, numbers.Number):
+            return 'const', value
+        if isinstance(value, BinaryComponentLink) and value._op in _UFUNCS:
+            return self._add(value._left, value._right, value._op)
+        key = ('input', id(value))
+        if key not in self._keys:
+            self._keys[key] = ('input', len(self._inputs))
+            self._inputs.append(value)
+        return self._keys[key]
+
+    def _add(self, left, right, op):
+        left = self._operand(left)
+        right = self._operand(right)
+        if left[0] == right[0] == 'const':
+            return 'const', op(left[1], right[1])
+
+        # constants of different types give results of different types
+        key = tuple(o + (type(o[1]),) if o[0] == 'const' else o
+                    for o in (left, right)) + (op,)
+        if key not in self._keys:
+            self._keys[key] = ('tmp', len(self._code))
+            self._code.append((_UFUNCS[op], left, right))
+        return self._keys[key]
+
+    def _last_uses(self):
+        """ The index of the last instruction using each temporary """
+        result = {}
+        for i, (_, left, right) in enumerate(self._code):
+            for kind, j in (left, right):
+                if kind == 'tmp':
+                    result[j] = i
+        return result
+
+    def _run(self, inputs, out=None, buffers=None):
+        """
+        Evaluate the code on a set of input values
+
+        :param out: Array to store the output in
+        :param buffers: Arrays to store each temporary in, or None to
+                        allocate them
+        :returns: The value of every temporary
+        """
+        values = []
+        last = len(self._code) - 1
+        for i, (ufunc, left, right) in enumerate(self._code):
+            args = [inputs[j] if kind == 'input' else
+                    values[j] if kind == 'tmp' else j
+                    for kind, j in (left, right)]
+            target = out if i == last else \
+                buffers[i] if buffers is not None else None
+            if target is None:
+                values.append(ufunc(*args))
+            else:
+                values.append(ufunc(*args, out=target))
+        return values
+
+    def _buffers(self, temporaries, rows):
+        """
+        Allocate buffers for the temporaries of a block of rows, sharing
+        them between temporaries that are not needed at the same time
+        """
+        last_uses = self._last_uses()
+        free = {}
+        result = []
+        for i, tmp in enumerate(temporaries[:-1]):
+            pool = free.setdefault(tmp.dtype, [])
+            result.append(pool.pop() if pool else
+                          np.empty((rows,) + tmp.shape[1:], dtype=tmp.dtype))
+            for j, k in last_uses.items():
+                if k == i:
+                    free[temporaries[j].dtype].append(result[j])
+        return result + [None]
+
+    def compute(self, data, view=None):
+        """ Evaluate the expression on a dataset """
+        if self._output[0] == 'const':
+            return self._output[1]
+        if self._output[0] == 'input':
+            return data[self._inputs[self._output[1]], view]
+
+        inputs = [data[i, view] for i in self._inputs]
+        if not all(isinstance(i, np.ndarray) for i in inputs):
+            return self._run(inputs)[-1]
+        shape = inputs[0].shape
+        size = inputs[0].size
+        if size <= CHUNK_SIZE or any(i.shape != shape for i in inputs):
+            return self._run(inputs)[-1]
+
+        rows = max(CHUNK_SIZE * shape[0] // size, 1)
+        first = self._run([i[:rows] for i in inputs])
+        if first[-1].shape != (rows,) + shape[1:]:
+            return self._run(inputs)[-1]
+
+        result = np.empty(shape, dtype=first[-1].dtype)
+        result[:rows] = first[-1]
+        buffers = self._buffers(first, rows)
+        for start in range(rows, shape[0], rows):
+            chunk = [i[start: start + rows] for i in inputs]
+            n = chunk[0].shape[0]
+            self._run(chunk, out=result[start: start + n],
+                      buffers=[b if b is None else b[:n] for b in buffers])
+        return result
+
+
 
 @add_metaclass(ContractsMeta)
 class ComponentLink(object):
@@ -346,6 +494,9 @@ class BinaryComponentLink(ComponentLink):
             self._right.replace_ids(old, new)
 
     def compute(self, data, view=None):
+        if self._op in _UFUNCS:
+            return _FusedKernel(self._left, self._right,
+                                self._op).compute(data, view)
         l = self._left
         r = self._right
         if not isinstance(self._left, numbers.Number):
@@ -2,6 +2,7 @@ from __future__ import absolute_import, division, print_function
 
 import operator
 import logging
+import numbers
 
 import numpy as np
 import pandas as pd
@@ -17,7 +18,8 @@ from .subset import Subset, InequalitySubsetState, SubsetState
 from .hub import Hub
 from .util import split_component_view, row_lookup
 from ..utils import unique, shape_to_string, view_shape, coerce_numeric, check_sorted
-from .decorators import clear_cache
+from .cache import (mask_cache, component_cache, index_cache, cached_view,
+                    view_key)
 from .message import (DataUpdateMessage,
                       DataAddComponentMessage, NumericalDataChangedMessage,
                       SubsetCreateMessage, ComponentsChangedMessage,
@@ -27,7 +29,8 @@ from ..compat.collections import OrderedDict
 from ..external import six
 
 __all__ = ['Data', 'ComponentID', 'Component', 'DerivedComponent',
-           'CategoricalComponent', 'CoordinateComponent']
+           'CategoricalComponent', 'CoordinateComponent', 'LazyComponent',
+           'KeyJoinIndex']
 
 # access to ComponentIDs via .item[name]
 
@@ -291,7 +294,7 @@ class DerivedComponent(Component):
     @property
     def data(self):
         """ Return the numerical data as a numpy array """
-        return self._link.compute(self._data)
+        return self._compute(None)
 
     @property
     def link(self):
@@ -299,7 +302,20 @@ class DerivedComponent(Component):
         return self._link
 
     def __getitem__(self, key):
-        return self._link.compute(self._data, key)
+        return self._compute(key)
+
+    def _compute(self, view):
+        # Results are cached per (link, data version, view). Upstream
+        # DerivedComponents are evaluated through Data.__getitem__ with
+        # the same view, so each step of a link chain only computes
+        # (and caches) the requested slice.
+        return cached_view(component_cache, self._link, self._data, view,
+                           self._compute_uncached)
+
+    def _compute_uncached(self, view):
+        if view is None:
+            return self._link.compute(self._data)
+        return self._link.compute(self._data, view)
 
 
 class CoordinateComponent(Component):
@@ -321,10 +337,24 @@ class CoordinateComponent(Component):
         return self._calculate()
 
     def _calculate(self, view=None):
+        index = _basic_index(self.shape, view)
+        if index is None:
+            # fancy indexing -- evaluate on the full grid
+            return self._calculate_full(view)
+
+        if self.world:
+            axes = self._dependent_axes()
+            values = self._world_values(index, axes)
+        else:
+            axes = (self.axis,)
+            values = _index_grids(index, axes)[0]
+
+        return _broadcast_view(values, index, axes)
+
+    def _calculate_full(self, view):
         slices = [slice(0, s, 1) for s in self.shape]
         grids = np.broadcast_arrays(*np.ogrid[slices])
-        if view is not None:
-            grids = [g[view] for g in grids]
+        grids = [g[view] for g in grids]
 
         if self.world:
             world = self._data.coords.pixel2world(*grids[::-1])[::-1]
@@ -332,6 +362,39 @@ class CoordinateComponent(Component):
         else:
             return grids[self.axis]
 
+    def _dependent_axes(self):
+        """
+        The pixel axes that this world coordinate depends on
+        """
+        try:
+            axes = self._data.coords.dependent_axes(self.axis)
+        except AttributeError:
+            axes = range(self.ndim)
+        return tuple(sorted(set(axes) | set([self.axis])))
+
+    def _world_values(self, index, axes):
+        """
+        Compute world coordinates on the grid spanned by the dependent
+        pixel axes only. Results are cached per dataset, since they are
+        typically much smaller than the full view.
+        """
+        try:
+            key = (self, view_key(tuple(index[a] for a in axes)))
+        except TypeError:  # unhashable input
+            key = None
+
+        def compute(view):
+            grids = _index_grids(index, axes)
+            args = [np.zeros(grids[0].shape)] * self.ndim
+            for a, g in zip(axes, grids):
+                args[a] = g
+            world = self._data.coords.pixel2world(*args[::-1])[::-1]
+            return np.asarray(world[self.axis])
+
+        if key is None:
+            return compute(None)
+        return cached_view(component_cache, key, self._data, None, compute)
+
     @property
     def shape(self):
         """ Tuple of array dimensions. """
@@ -358,6 +421,64 @@ class CoordinateComponent(Component):
         return cls(None, rec['axis'], rec['world'])
 
 
+class LazyComponent(Component):
+
+    """
+    A component whose values are read on demand from an array-like source
+
+    The source is any object with ``shape`` and ``dtype`` attributes that
+    supports numpy-style slicing, such as an h5py Dataset or a memory-mapped
+    FITS array. Indexing the component with a view reads only the requested
+    slice from the source. Views which the source cannot handle (such as
+    fancy indexing of an h5py Dataset) fall back to reading the full array.
+    """
+
+    def __init__(self, source, units=None, handle=None):
+        """
+        :param source: The array-like object to read from
+        :param units: Optional unit label
+        :type units: str
+        :param handle: Optional open file that the source reads from, such
+                       as a :class:`~glue.core.io.SharedFile`. The
+                       component keeps the file open, and closes it in
+                       :meth:`close`
+        """
+        super(LazyComponent, self).__init__(None, units=units)
+        self._data = source
+        self._handle = handle
+
+    @property
+    def data(self):
+        """ The full array, read from the source """
+        return self._read(Ellipsis)
+
+    @property
+    def numeric(self):
+        return self._data.dtype.kind in 'biufc'
+
+    def __getitem__(self, key):
+        logging.debug("Using %s to read from source of shape %s",
+                      key, self.shape)
+        try:
+            return self._read(key)
+        except (TypeError, ValueError):
+            # view not supported by the source (e.g. h5py fancy indexing)
+            return self.data[key]
+
+    def _read(self, key):
+        result = np.asarray(self._data[key])
+        result.setflags(write=False)  # data is read-only
+        return result
+
+    def close(self):
+        """
+        Close the file that the source reads from, if any. The component
+        can no longer be read from afterwards
+        """
+        if self._handle is not None:
+            self._handle.close()
+
+
 class CategoricalComponent(Component):
 
     """
@@ -461,6 +582,54 @@ class CategoricalComponent(Component):
                          dtype=np.object, **kwargs)
 
 
+class KeyJoinIndex(object):
+
+    """
+    Maps the elements of one dataset onto the elements of another, via
+    shared key values.
+
+    The keys of both datasets are factorized into integer codes once, so
+    that a selection on the other dataset can be translated into a mask
+    with a single gather. NaN keys never match.
+
+    :param keys: Array of key values for this dataset
+    :param other_keys: Array of key values for the other dataset
+    """
+
+    def __init__(self, keys, other_keys):
+        keys = np.asarray(keys)
+        other_keys = np.asarray(other_keys).ravel()
+
+        values, codes = np.unique(np.concatenate([keys.ravel(), other_keys]),
+                                  return_inverse=True)
+        itype = np.int32 if values.size < 2 ** 31 else np.int64
+        codes = codes.astype(itype)
+        self._codes = codes[:keys.size].reshape(keys.shape)
+        self._other_codes = codes[keys.size:]
+        self._nkeys = values.size
+
+        self._nan = None
+        if values.dtype.kind in 'fc' and values.size and np.isnan(values[-1]):
+            self._nan = values.size - 1
+
+    def to_mask(self, other_indices, view=None):
+        """
+        Select the elements whose key matches the key of any of a set of
+        elements in the other dataset
+
+        :param other_indices: Flat indices (or a boolean mask) of the
+                              selected elements in the other dataset
+        :param view: Optional view into this dataset
+        """
+        selected = np.zeros(self._nkeys, dtype=bool)
+        selected[self._other_codes[np.ravel(other_indices)]] = True
+        if self._nan is not None:
+            selected[self._nan] = False
+
+        codes = self._codes if view is None else self._codes[view]
+        return selected[codes]
+
+
 class Data(object):
 
     """The basic data container in Glue.
@@ -502,11 +671,22 @@ class Data(object):
         self.coords = Coordinates()
         self._shape = ()
 
+        # Incremented whenever the numerical values change
+        self._version = 0
+
+        # Element mappings to other datasets (see join_on_key), and
+        # the corresponding KeyJoinIndex objects
+        self._key_joins = {}
+        self._join_indices = {}
+
         # Components
         self._components = OrderedDict()
         self._pixel_component_ids = []
         self._world_component_ids = []
 
+        # ComponentID -> IDs of the DerivedComponents whose links use it
+        self._dependents = {}
+
         self.id = ComponentIDDict(self)
 
         # Subsets of the data
@@ -527,8 +707,6 @@ class Data(object):
         for lbl, data in sorted(kwargs.items()):
             self.add_component(data, lbl)
 
-        self._key_joins = {}
-
     @property
     def subsets(self):
         """
@@ -595,7 +773,40 @@ class Data(object):
         :type component_id: :class:`~glue.core.data.ComponentID`
         """
         if component_id in self._components:
-            self._components.pop(component_id)
+            component = self._components.pop(component_id)
+            self._index_dependencies(component_id, component, add=False)
+            self._invalidate_cache()
+
+    def _index_dependencies(self, component_id, component, add=True):
+        """ Add (or remove) a component to the reverse-dependency index """
+        if not isinstance(component, DerivedComponent):
+            return
+        for cid in component.link.get_from_ids():
+            if add:
+                self._dependents.setdefault(cid, set()).add(component_id)
+                continue
+            users = self._dependents.get(cid)
+            if users is not None:
+                users.discard(component_id)
+                if not users:
+                    del self._dependents[cid]
+
+    def dependents(self, component_ids):
+        """ Find the DerivedComponents that depend, directly or through
+        other DerivedComponents, on a collection of ComponentIDs
+
+        :param component_ids: Iterable of ComponentIDs
+        :rtype: set
+        :returns: The ComponentIDs of the dependent DerivedComponents
+        """
+        result = set()
+        todo = list(component_ids)
+        while todo:
+            for cid in self._dependents.get(todo.pop(), ()):
+                if cid not in result:
+                    result.add(cid)
+                    todo.append(cid)
+        return result
 
     @contract(other='isinstance(Data)',
               cid='cid_like',
@@ -644,6 +855,22 @@ class Data(object):
 
         self._key_joins[other] = (cid, cid_other)
         other._key_joins[self] = (cid_other, cid)
+        self._join_indices.pop(other, None)
+        other._join_indices.pop(self, None)
+
+    def _join_index(self, other):
+        """
+        The :class:`KeyJoinIndex` that maps the elements of this dataset
+        onto the keys of another dataset it is joined with (see
+        :meth:`join_on_key`). It is built on first use, and discarded when
+        the values of either dataset change.
+        """
+        index = self._join_indices.get(other)
+        if index is None:
+            cid, cid_other = self._key_joins[other]
+            index = KeyJoinIndex(self[cid], other[cid_other])
+            self._join_indices[other] = index
+        return index
 
     @contract(component='component_like', label='cid_like')
     def add_component(self, component, label, hidden=False):
@@ -691,7 +918,14 @@ class Data(object):
             component_id = ComponentID(label, hidden=hidden)
 
         is_present = component_id in self._components
+        if is_present:
+            self._index_dependencies(component_id,
+                                     self._components[component_id],
+                                     add=False)
         self._components[component_id] = component
+        self._index_dependencies(component_id, component)
+        if is_present:
+            self._invalidate_cache()
 
         first_component = len(self._components) == 1
         if first_component:
@@ -976,6 +1210,7 @@ class Data(object):
         changed = False
         if old in self._components:
             self._components[new] = self._components[old]
+            self._index_dependencies(new, self._components[old])
             changed = True
         try:
             index = self._pixel_component_ids.index(old)
@@ -990,13 +1225,23 @@ class Data(object):
         except ValueError:
             pass
 
+        if changed:
+            self._invalidate_cache()
+
+            # links that used the old ID are updated to use the new one
+            # (see LinkManager)
+            users = self._dependents.pop(old, None)
+            if users is not None:
+                self._dependents.setdefault(new, set()).update(users)
+
         if changed and self.hub is not None:
             # promote hidden status
             new._hidden = new.hidden and old.hidden
 
             # remove old component and broadcast the change
             # see #508 for discussion of this
-            self._components.pop(old)
+            self._index_dependencies(old, self._components.pop(old),
+                                     add=False)
             msg = ComponentReplacedMessage(self, old, new)
             self.hub.broadcast(msg)
 
@@ -1019,6 +1264,10 @@ class Data(object):
                                  "to a different hub")
         object.__setattr__(self, name, value)
 
+        # world coordinates are cached
+        if name == "coords" and hasattr(self, '_version'):
+            self._invalidate_cache()
+
     def __getitem__(self, key):
         """ Shortcut syntax to access the numerical data in a component.
         Equivalent to:
@@ -1080,18 +1329,48 @@ class Data(object):
         except KeyError:
             raise IncompatibleAttribute(component_id)
 
-    def to_dataframe(self, index=None):
+    def close(self):
+        """
+        Close the files that components of this dataset read from (see
+        :class:`LazyComponent`). Those components can no longer be read
+        from afterwards.
+
+        Files are also closed once the components reading from them are
+        released, but this method closes them immediately.
+        """
+        for comp in self._components.values():
+            if isinstance(comp, LazyComponent):
+                comp.close()
+
+    def to_dataframe(self, index=None, copy=True):
         """ Convert the Data object into a pandas.DataFrame object
 
         :param index: Any 'index-like' object that can be passed to the pandas.Series constructor
+        :param copy: If False, the columns of the frame share memory with
+                     the components where possible, and are read-only
+                     (writing to them raises a ValueError)
 
         :return: pandas.DataFrame
         """
 
+        # passing the column order separately would make pandas copy
         h = lambda comp: self.get_component(comp).to_series(index=index)
-        df = pd.DataFrame(dict((comp.label, h(comp)) for comp in self.components))
-        order = [comp.label for comp in self.components]
-        return df[order]
+        return pd.DataFrame(OrderedDict((comp.label, h(comp)) for comp in self.components),
+                            copy=copy)
+
+    def _invalidate_cache(self):
+        """
+        Increment the data version, and discard cached results (masks,
+        computed component values, indices and joins) derived from the
+        old values
+        """
+        self._version += 1
+        mask_cache.invalidate(self)
+        component_cache.invalidate(self)
+        index_cache.invalidate(self)
+        self._join_indices.clear()
+        for other in self._key_joins:
+            other._join_indices.pop(self, None)
 
     @contract(mapping="dict(inst($Component, $ComponentID):array_like)")
     def update_components(self, mapping):
@@ -1117,13 +1396,80 @@ class Data(object):
 
             comp._data = data
 
+        self._invalidate_cache()
+
         # alert hub of the change
         if self.hub is not None:
             msg = NumericalDataChangedMessage(self)
             self.hub.broadcast(msg)
 
-        for subset in self.subsets:
-            clear_cache(subset.subset_state.to_mask)
+
+def _basic_index(shape, view):
+    """
+    Normalize a view into an array of the given shape, as a list with one
+    non-negative integer or slice per dimension.
+
+    Returns None if the view uses fancy indexing
+    """
+    if view is None:
+        view = ()
+    if not isinstance(view, tuple):
+        view = (view,)
+    ellipsis = [i for i, v in enumerate(view) if v is Ellipsis]
+    if ellipsis:
+        i = ellipsis[0]
+        fill = (slice(None),) * (len(shape) - len(view) + 1)
+        view = view[:i] + fill + view[i + 1:]
+    if len(view) > len(shape):
+        return None
+    view = view + (slice(None),) * (len(shape) - len(view))
+
+    result = []
+    for v, n in zip(view, shape):
+        if isinstance(v, slice):
+            result.append(slice(*v.indices(n)))
+        elif isinstance(v, numbers.Integral) and not isinstance(v, bool):
+            if not -n <= v < n:
+                raise IndexError("index %i is out of bounds for axis "
+                                 "with size %i" % (v, n))
+            result.append(int(v) % n)
+        else:
+            return None
+    return result
+
+
+def _index_grids(index, axes):
+    """
+    Pixel coordinates along several axes of a view, broadcast
+    against each other. The grid only spans the sliced axes in `axes`.
+
+    :param index: Normalized view, from :func:`_basic_index`
+    :param axes: The axes to compute coordinates for
+    """
+    kept = [a for a in axes if isinstance(index[a], slice)]
+    grids = []
+    for a in axes:
+        if isinstance(index[a], slice):
+            shp = [1] * len(kept)
+            shp[kept.index(a)] = -1
+            s = index[a]
+            grids.append(np.arange(s.start, s.stop, s.step).reshape(shp))
+        else:
+            grids.append(np.array(index[a]))
+    return np.broadcast_arrays(*grids)
+
+
+def _broadcast_view(values, index, axes):
+    """
+    Broadcast values computed on the grid of :func:`_index_grids`
+    to the full shape of the view, without copying.
+    """
+    out = [a for a, v in enumerate(index) if isinstance(v, slice)]
+    shape = [len(range(index[a].start, index[a].stop, index[a].step))
+             for a in out]
+    values = values.reshape([n if a in axes else 1
+                             for a, n in zip(out, shape)])
+    return np.broadcast_to(values, shape)
 
 
 @contract(i=int, ndim=int)
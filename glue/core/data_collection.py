@@ -1,7 +1,7 @@
 from __future__ import absolute_import, division, print_function
 
 from .hub import Hub, HubListener
-from .data import Data
+from .data import Data, DerivedComponent
 from .link_manager import LinkManager
 from .registry import Registry
 from .visual import COLORS
@@ -76,9 +76,15 @@ class DataCollection(HubListener):
 
         See :meth:`append` for more information
 
+        Messages are delivered once all the datasets have been added.
+
         :param data: List of data objects to add
         """
-        [self.append(d) for d in data]
+        if self.hub is None:
+            [self.append(d) for d in data]
+            return
+        with self.hub.delay_callbacks():
+            [self.append(d) for d in data]
 
     def remove(self, data):
         """ Remove a data set from the collection
@@ -108,8 +114,23 @@ class DataCollection(HubListener):
             for link in d.coordinate_links:
                 self._link_manager.add_link(link)
 
+        self._update_data_components()
+
+    def _update_data_components(self):
+        # only the data sets affected by changes to the links (or to
+        # their own components) need to be updated
         for d in self._data:
-            self._link_manager.update_data_components(d)
+            if self._link_manager.needs_update(d):
+                self._link_manager.update_data_components(d)
+
+    def _on_add_component(self, msg):
+        # derived components added by the link manager don't change the
+        # web of links
+        component = msg.sender.get_component(msg.component_id)
+        if isinstance(component, DerivedComponent) and \
+                component.link in self._link_manager:
+            return
+        self._sync_link_manager()
 
     @property
     def links(self):
@@ -129,8 +150,7 @@ class DataCollection(HubListener):
            instances, or a :class:`~glue.core.link_helpers.LinkCollection`
         """
         self._link_manager.add_link(links)
-        for d in self._data:
-            self._link_manager.update_data_components(d)
+        self._update_data_components()
 
     def _merge_link(self, link):
         pass
@@ -146,8 +166,7 @@ class DataCollection(HubListener):
         for link in links:
             self._link_manager.add_link(link)
 
-        for d in self._data:
-            self._link_manager.update_data_components(d)
+        self._update_data_components()
 
     def register_to_hub(self, hub):
         """ Register managed data objects to a hub.
@@ -172,7 +191,7 @@ class DataCollection(HubListener):
                 s.register()
 
         hub.subscribe(self, DataAddComponentMessage,
-                      lambda msg: self._sync_link_manager(),
+                      self._on_add_component,
                       filter=lambda x: x.sender in self._data)
 
     def new_subset_group(self, label=None, subset_state=None):
@@ -37,9 +37,9 @@ import warnings
 
 import numpy as np
 
-from .data import Component, Data, CategoricalComponent
-from .io import extract_data_fits, extract_data_hdf5
-from ..utils import as_list, file_format
+from .data import Component, Data, CategoricalComponent, LazyComponent
+from .io import extract_data_fits, extract_data_hdf5, SharedFile
+from ..utils import as_list, file_format, readonly_view
 from .coordinates import coordinates_from_header, coordinates_from_wcs
 from ..backends import get_backend
 from ..config import auto_refresh
@@ -172,7 +172,7 @@ class LoadLog(object):
             mapping = dict((c, log.component(self.id(c)).data)
                            for c in dold._components.values()
                            if c in self.components
-                           and type(c) == Component)
+                           and type(c) in (Component, LazyComponent))
             dold.coords = dnew.coords
             dold.update_components(mapping)
 
@@ -358,6 +358,7 @@ def gridded_data(filename, format='auto', **kwargs):
         format = file_format(filename)
 
     # Read in the data
+    handle = None
     if is_fits(filename):
         from ..external.astro import fits
         arrays = extract_data_fits(filename, **kwargs)
@@ -365,11 +366,18 @@ def gridded_data(filename, format='auto', **kwargs):
         result.coords = coordinates_from_header(header)
     elif is_hdf5(filename):
         arrays = extract_data_hdf5(filename, **kwargs)
+        # the file stays open while components read from it
+        handle = SharedFile(next(iter(arrays.values())).file)
     else:
         raise Exception("Unkonwn format: %s" % format)
 
     for component_name in arrays:
-        comp = Component.autotyped(arrays[component_name])
+        array = arrays[component_name]
+        if array.dtype.kind in 'biufc':
+            # read values from disk on demand
+            comp = LazyComponent(array, handle=handle)
+        else:
+            comp = Component.autotyped(array[...])
         result.add_component(comp, component_name)
     return result
 
@@ -601,7 +609,7 @@ def panda_process(indf):
                 # play well with np.unique
                 c = CategoricalComponent(column.fillna(''))
         else:
-            c = Component(column.values)
+            c = Component(readonly_view(column.values))
 
         # strip off leading #
         name = name.strip()
@@ -14,6 +14,7 @@ import logging
 from .decorators import singleton
 from .data import Data
 from .data_collection import DataCollection
+from .subset import RoiSubsetState
 from ..utils import as_list
 from .contracts import contract
 
@@ -90,7 +91,10 @@ class EditSubsetMode(object):
 def ReplaceMode(edit_subset, new_state):
     """ Replaces edit_subset.subset_state with new_state """
     logging.getLogger(__name__).debug("Replace %s", edit_subset)
-    edit_subset.subset_state = new_state.copy()
+    state = new_state.copy()
+    if isinstance(state, RoiSubsetState):
+        state.set_previous_state(edit_subset.subset_state)
+    edit_subset.subset_state = state
 
 
 def AndMode(edit_subset, new_state):
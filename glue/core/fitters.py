@@ -6,6 +6,8 @@ See the guide on :ref:`writing custom fit plugins <fit_plugins>` for
 help with using custom fitting utilities in Glue.
 """
 
+from multiprocessing import Pool
+
 import numpy as np
 
 from .simpleforms import IntOption, Option
@@ -15,7 +17,12 @@ __all__ = ['BaseFitter1D',
            'PolynomialFitter',
            'AstropyFitter1D',
            'SimpleAstropyGaussianFitter',
-           'BasicGaussianFitter']
+           'BasicGaussianFitter',
+           'fit_cube']
+
+#: Seeded fits whose mean squared residual exceeds that of the previous
+#: fit by more than this factor are repeated without seeding
+SEED_TOLERANCE = 2
 
 
 class BaseFitter1D(object):
@@ -136,6 +143,127 @@ class BaseFitter1D(object):
                         constraints=self.constraints,
                         **self.options)
 
+    def build_and_fit_many(self, x, y, dy=None, workers=1):
+        """
+        Fit many spectra sampled at the same locations.
+
+        Non-finite values are ignored. Spectra are fit in order, and each
+        fit starts from the result of the previous one (see
+        :meth:`seed_constraints`), so similar spectra (such as neighbouring
+        pixels of a cube) should be adjacent. A fit that fails from this
+        starting point, or that fits its spectrum worse than the previous
+        fit did (see :data:`SEED_TOLERANCE`), is repeated from the usual
+        initial guesses, and the better of the two fits is kept.
+
+        :param x: The x values, shared by all spectra
+        :param y: Array of shape (N, len(x))
+        :param dy: 1 sigma uncertainties (optional), of shape (len(x),)
+                   or (N, len(x))
+        :param workers: If greater than 1, the spectra are split into this
+                        many contiguous blocks, fit in a pool of processes
+
+        :returns: A list of N fit results, with None for spectra that
+                  have no finite values or whose fit failed
+        """
+        x = np.asarray(x).ravel()
+        y = np.atleast_2d(y)
+        if dy is not None:
+            dy = np.asarray(dy)
+
+        if workers <= 1 or y.shape[0] < 2:
+            return self._fit_sequence(x, y, dy)
+
+        blocks = np.array_split(np.arange(y.shape[0]), workers)
+        args = [(self, x, y[b], dy if dy is None or dy.ndim == 1 else dy[b])
+                for b in blocks if b.size > 0]
+        pool = Pool(len(args))
+        try:
+            results = pool.map(_fit_block, args)
+        finally:
+            pool.close()
+            pool.join()
+        return [r for block in results for r in block]
+
+    def _fit_sequence(self, x, y, dy):
+        constraints = self.constraints
+        options = self.options
+        results = []
+        previous, previous_residual = None, np.inf
+
+        for i, yi in enumerate(y):
+            dyi = dy if dy is None or dy.ndim == 1 else dy[i]
+            good = np.isfinite(yi)
+            if dyi is not None:
+                good &= np.isfinite(dyi)
+                dyi = dyi[good]
+            if not good.any():
+                results.append(None)
+                continue
+
+            args = (x[good], yi[good], dyi)
+            result, residual = None, np.inf
+            if previous is not None:
+                seeded = self.seed_constraints(constraints, previous)
+                result, residual = self._try_fit(args, seeded, options)
+
+            # the seed may have led to a poor local minimum
+            if result is None or \
+                    residual > SEED_TOLERANCE * previous_residual:
+                unseeded, unseeded_residual = self._try_fit(args, constraints,
+                                                            options)
+                if unseeded_residual < residual:
+                    result, residual = unseeded, unseeded_residual
+
+            results.append(result)
+            if result is not None:
+                previous, previous_residual = result, residual
+        return results
+
+    def _try_fit(self, args, constraints, options):
+        """
+        Fit a spectrum, returning the fit result and its mean squared
+        (weighted) residual, or (None, inf) if the fit failed
+        """
+        x, y, dy = args
+        try:
+            result = self.fit(x, y, dy=dy, constraints=constraints, **options)
+            values = list(self.parameters(result).values())
+            resid = self.predict(result, x) - y
+        except Exception:  # a failed fit shouldn't stop the others
+            return None, np.inf
+        if dy is not None:
+            resid = resid / dy
+        residual = np.mean(resid ** 2)
+        if not np.isfinite(values).all() or not np.isfinite(residual):
+            return None, np.inf
+        return result, residual
+
+    def seed_constraints(self, constraints, fit_result):
+        """
+        Constraints for fitting a spectrum similar to one that has already
+        been fit, used by :meth:`build_and_fit_many`.
+
+        The base implementation returns the constraints unchanged.
+        Iterative fitters should start from the parameters of
+        ``fit_result``.
+
+        :param constraints: The current value of :attr:`constraints`
+        :param fit_result: The result of a previous fit
+        """
+        return constraints
+
+    def parameters(self, fit_result):
+        """
+        The fitted value of each model parameter.
+
+        **This must be overridden in a subclass to use**
+        :func:`fit_cube`
+
+        :param fit_result: The result from the fit method
+        :returns: A dict mapping ``{parameter_name: value}``
+        """
+        raise NotImplementedError()
+
     def fit(self, x, y, dy, constraints, **options):
         """
         Fit the model to data.
@@ -202,6 +330,19 @@ class AstropyFitter1D(BaseFitter1D):
         model, _ = fit_result
         return model(x)
 
+    def parameters(self, fit_result):
+        model, _ = fit_result
+        return dict((p, getattr(model, p).value) for p in model.param_names)
+
+    def seed_constraints(self, constraints, fit_result):
+        values = self.parameters(fit_result)
+        result = {}
+        for k, v in constraints.items():
+            result[k] = dict(v)
+            if not v['fixed']:
+                result[k]['value'] = values[k]
+        return result
+
     def summarize(self, fit_result, x, y, dy=None):
         model, fitter = fit_result
         result = [_report_fitter(fitter), ""]
@@ -303,6 +444,9 @@ class BasicGaussianFitter(BaseFitter1D):
     def fit(self, x, y, dy, constraints):
         from scipy import optimize
         init_values = _gaussian_parameter_estimates(x, y, dy)
+        for p, c in constraints.items():
+            if c['value'] is not None:
+                init_values[p] = c['value']
         init_values = [init_values[p] for p in ['amplitude', 'mean', 'stddev']]
         farg = (x, y, dy)
         dfunc = None
@@ -314,6 +458,15 @@ class BasicGaussianFitter(BaseFitter1D):
     def predict(self, fit_result, x):
         return self.eval(x, *fit_result)
 
+    def parameters(self, fit_result):
+        return dict(zip(['amplitude', 'mean', 'stddev'], fit_result))
+
+    def seed_constraints(self, constraints, fit_result):
+        result = dict((k, dict(v)) for k, v in constraints.items())
+        for k, v in self.parameters(fit_result).items():
+            result[k] = dict(value=v, fixed=False, limits=None)
+        return result
+
     def summarize(self, fit_result, x, y, dy=None):
         return ("amplitude = %e\n"
                 "mean      = %e\n"
@@ -365,14 +518,117 @@ class PolynomialFitter(BaseFitter1D):
 
         return np.polyfit(x, y, degree, w=w)
 
+    def build_and_fit_many(self, x, y, dy=None, workers=1):
+        """
+        Fit many spectra sampled at the same locations.
+
+        Spectra without missing values that share the same uncertainties
+        are fit together, with a single least-squares solve. See
+        :meth:`BaseFitter1D.build_and_fit_many`.
+        """
+        x = np.asarray(x).ravel()
+        y = np.atleast_2d(y)
+        if dy is not None:
+            dy = np.asarray(dy)
+        if dy is not None and dy.ndim > 1:
+            return super(PolynomialFitter, self).build_and_fit_many(
+                x, y, dy=dy, workers=workers)
+
+        good = np.isfinite(y).all(axis=1)
+        if dy is not None:
+            good &= np.isfinite(dy).all()
+
+        results = [None] * y.shape[0]
+        if good.any():
+            coeffs = self.fit(x, y[good].T, dy, self.constraints,
+                              **self.options)
+            for i, c in zip(np.nonzero(good)[0], coeffs.T):
+                results[i] = c
+        if not good.all():
+            rest = np.nonzero(~good)[0]
+            fits = super(PolynomialFitter, self).build_and_fit_many(
+                x, y[rest], dy=dy, workers=workers)
+            for i, f in zip(rest, fits):
+                results[i] = f
+        return results
+
     def predict(self, fit_result, x):
         return np.polyval(fit_result, x)
 
+    def parameters(self, fit_result):
+        # c0 is the constant term
+        return dict(('c%i' % i, c) for i, c in enumerate(fit_result[::-1]))
+
     def summarize(self, fit_result, x, y, dy=None):
         return "Coefficients:\n" + "\n".join("%e" % coeff
                                              for coeff in fit_result.tolist())
 
 
+def _fit_block(args):
+    fitter, x, y, dy = args
+    return fitter._fit_sequence(x, y, dy)
+
+
+def fit_cube(fitter, data, attribute, zaxis, subset=None, workers=1,
+             prefix=None):
+    """
+    Fit the spectrum of every pixel of a cube, and store maps of the
+    fitted parameters as new components of the data.
+
+    Each map is constant along ``zaxis``, and NaN for pixels that were
+    not fit.
+
+    :param fitter: A :class:`BaseFitter1D` instance
+    :param data: The :class:`~glue.core.data.Data` holding the cube
+    :param attribute: The :class:`~glue.core.data.ComponentID` to fit
+    :param zaxis: The spectral axis. Spectra are fit as a function of
+                  the world coordinate along this axis
+    :param subset: If provided, only fit the pixels where the subset
+                   includes any channel
+    :param workers: The number of processes to use (see
+                    :meth:`BaseFitter1D.build_and_fit_many`)
+    :param prefix: The prefix of the new component labels. Defaults to
+                   the label of ``attribute``
+
+    :returns: A list of the new ComponentIDs, one per parameter
+    """
+    view = [0] * data.ndim
+    view[zaxis] = slice(None)
+    x = data[data.get_world_component_id(zaxis), tuple(view)]
+
+    # a view with the spectral axis last
+    cube = np.rollaxis(data[attribute], zaxis, data.ndim)
+    plane = cube.shape[:-1]
+    npix = int(np.prod(plane))
+
+    # spectra in raster order, so that neighbouring pixels are adjacent
+    if subset is None:
+        pix = np.arange(npix)
+    else:
+        pix = np.nonzero(subset.to_mask().any(axis=zaxis).ravel())[0]
+
+    # only copy the spectra of the selected pixels
+    spectra = cube[np.unravel_index(pix, plane)]
+    results = fitter.build_and_fit_many(x, spectra, workers=workers)
+
+    maps = {}
+    for i, r in zip(pix, results):
+        if r is None:
+            continue
+        for name, value in fitter.parameters(r).items():
+            if name not in maps:
+                maps[name] = np.zeros(npix) * np.nan
+            maps[name][i] = value
+
+    prefix = prefix or attribute.label
+    result = []
+    for name in sorted(maps):
+        values = np.expand_dims(maps[name].reshape(plane), zaxis)
+        values = np.broadcast_to(values, data.shape)
+        result.append(data.add_component(values, '%s_%s' % (prefix, name)))
+    return result
+
+
 def _report_fitter(fitter):
     if "nfev" in fitter.fit_info:
         return "Converged in %i iterations" % fitter.fit_info['nfev']
@@ -2,13 +2,18 @@ from __future__ import absolute_import, division, print_function
 
 import logging
 from inspect import getmro
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
 
 from .message import Message
 from .exceptions import InvalidSubscriber, InvalidMessage
+from ..external.six import string_types
+from ..utils import defer_draw
 
 __all__ = ['Hub', 'HubListener']
 
+logger = logging.getLogger(__name__)
+
 
 class Hub(object):
 
@@ -38,6 +43,14 @@ class Hub(object):
         # Dictionary of subscriptions
         self._subscriptions = defaultdict(dict)
 
+        # Cache of message type => [(subscriber, subscribed message type)]
+        # Rebuilt lazily whenever subscriptions change
+        self._dispatch = {}
+
+        # Messages held back by delay_callbacks, keyed by _message_key
+        self._delay_count = 0
+        self._queue = OrderedDict()
+
         from .data import Data
         from .subset import Subset
         from .data_collection import DataCollection
@@ -100,13 +113,13 @@ class Hub(object):
                 not issubclass(message_class, Message):
             raise InvalidMessage("message class must be a subclass of "
                                  "glue.Message: %s" % type(message_class))
-        logging.getLogger(__name__).info("Subscribing %s to %s",
-                                         subscriber, message_class.__name__)
+        logger.info("Subscribing %s to %s", subscriber, message_class.__name__)
 
         if not handler:
             handler = subscriber.notify
 
         self._subscriptions[subscriber][message_class] = (filter, handler)
+        self._dispatch.clear()
 
     def is_subscribed(self, subscriber, message):
         """
@@ -139,6 +152,7 @@ class Hub(object):
             return
         if message in self._subscriptions[subscriber]:
             self._subscriptions[subscriber].pop(message)
+            self._dispatch.clear()
 
     def unsubscribe_all(self, subscriber):
         """
@@ -146,26 +160,48 @@ class Hub(object):
         """
         if subscriber in self._subscriptions:
             self._subscriptions.pop(subscriber)
+            self._dispatch.clear()
 
-    def _find_handlers(self, message):
-        """Yields all (subscriber, handler) pairs that should receive a message
+    def _dispatch_table(self, message_class):
+        """
+        The (subscriber, subscribed message class) pairs for a type
+        of message. For each subscriber, the subscription to the
+        most-subclassed superclass of message_class is chosen.
         """
+        try:
+            return self._dispatch[message_class]
+        except KeyError:
+            pass
+
         # self._subscriptions:
         # subscriber => { message type => (filter, handler)}
-
-        # loop over subscribed objects
-        for subscriber, subscriptions in list(self._subscriptions.items()):
+        result = []
+        for subscriber, subscriptions in self._subscriptions.items():
 
             # subscriptions to message or its superclasses
             messages = [msg for msg in subscriptions.keys() if
-                        issubclass(type(message), msg)]
+                        issubclass(message_class, msg)]
             if len(messages) == 0:
                 continue
 
             # narrow to the most-specific message
-            candidate = max(messages, key=_mro_count)
+            result.append((subscriber, max(messages, key=_mro_count)))
+
+        self._dispatch[message_class] = result
+        return result
+
+    def _find_handlers(self, message):
+        """Yields all (subscriber, handler) pairs that should receive a message
+        """
+        for subscriber, candidate in self._dispatch_table(type(message)):
+
+            # subscriptions can change while a message is being handled
+            try:
+                test, handler = self._subscriptions.get(subscriber,
+                                                        {})[candidate]
+            except KeyError:
+                continue
 
-            test, handler = subscriptions[candidate]
             if test(message):
                 yield subscriber, handler
 
@@ -175,10 +211,46 @@ class Hub(object):
         :param message: The message to broadcast
         :type message: :class:`~glue.core.message.Message`
         """
-        logging.getLogger(__name__).info("Broadcasting %s", message)
+        if self._delay_count > 0:
+            self._queue.setdefault(_message_key(message), message)
+            return
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Broadcasting %s", message)
         for subscriber, handler in self._find_handlers(message):
             handler(message)
 
+    @contextmanager
+    def delay_callbacks(self):
+        """
+        Hold back messages until the end of a block of code.
+
+        Messages broadcast inside the block are queued, and duplicates
+        (messages of the same type, from the same sender, and carrying
+        the same attribute and payload) are merged. When the outermost
+        block exits, each remaining message is delivered once, and
+        matplotlib redraws are deferred until all messages have been
+        handled. This avoids repeated redraws during bulk edits::
+
+            with hub.delay_callbacks():
+                for state in states:
+                    data_collection.new_subset_group(subset_state=state)
+        """
+        self._delay_count += 1
+        try:
+            yield
+        finally:
+            self._delay_count -= 1
+            if self._delay_count == 0:
+                self._flush()
+
+    def _flush(self):
+        """ Deliver the messages queued by :meth:`delay_callbacks` """
+        messages = list(self._queue.values())
+        self._queue.clear()
+        if messages:
+            defer_draw(lambda: [self.broadcast(m) for m in messages])()
+
     def __getstate__(self):
         """ Return a picklable representation of the hub
 
@@ -188,6 +260,9 @@ class Hub(object):
         """
         result = self.__dict__.copy()
         result['_subscriptions'] = self._subscriptions.copy()
+        result['_dispatch'] = {}
+        result['_delay_count'] = 0
+        result['_queue'] = OrderedDict()
         for s in self._subscriptions:
             try:
                 module = s.__module__
@@ -220,3 +295,13 @@ class HubListener(object):
 
 def _mro_count(obj):
     return len(getmro(obj))
+
+
+def _message_key(message):
+    """
+    A key that is shared by duplicate messages: those of the same type,
+    whose attributes (apart from the tag) are the same objects
+    """
+    payload = ((k, v if isinstance(v, string_types) else id(v))
+               for k, v in message.__dict__.items() if k != 'tag')
+    return (type(message),) + tuple(sorted(payload))
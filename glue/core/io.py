@@ -43,6 +43,9 @@ def extract_data_fits(filename, use_hdu='all'):
     by `use_hdu` are extracted (`use_hdu` should then contain a list of
     integers). If the requested HDUs do not have the same dimensions, an
     Exception is raised.
+
+    Where possible (e.g. unscaled data), the file is memory-mapped, so the
+    returned arrays are only read from disk as they are accessed.
     '''
     from ..external.astro import fits
 
@@ -58,22 +61,55 @@ def extract_data_fits(filename, use_hdu='all'):
     return arrays
 
 
+class SharedFile(object):
+
+    """
+    An open file shared by the components that read from it.
+
+    The file is closed by :meth:`close`, or once nothing refers to this
+    object any more (e.g. when every component reading from the file has
+    been removed).
+
+    :param handle: The open file (any object with a ``close`` method,
+                   such as an h5py File)
+    """
+
+    def __init__(self, handle):
+        self._handle = handle
+
+    @property
+    def closed(self):
+        return self._handle is None
+
+    def close(self):
+        """ Close the file. This can safely be called more than once """
+        handle, self._handle = self._handle, None
+        if handle is not None:
+            handle.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:  # e.g. the interpreter is shutting down
+            pass
+
+
 def extract_hdf5_datasets(handle):
     '''
     Recursive function that returns a dictionary with all the datasets
     found in an HDF5 file or group. `handle` should be an instance of
-    h5py.highlevel.File or h5py.highlevel.Group.
+    h5py.File or h5py.Group.
     '''
 
     import h5py
 
     datasets = {}
     for group in handle:
-        if isinstance(handle[group], h5py.highlevel.Group):
+        if isinstance(handle[group], h5py.Group):
             sub_datasets = extract_hdf5_datasets(handle[group])
             for key in sub_datasets:
                 datasets[key] = sub_datasets[key]
-        elif isinstance(handle[group], h5py.highlevel.Dataset):
+        elif isinstance(handle[group], h5py.Dataset):
             datasets[handle[group].name] = handle[group]
     return datasets
 
@@ -85,14 +121,26 @@ def extract_data_hdf5(filename, use_datasets='all'):
     ones specified by `use_datasets` are extracted (`use_datasets` should
     then contain a list of paths). If the requested datasets do not have
     the same dimensions, an Exception is raised.
+
+    The returned values are the h5py Datasets themselves, so that values
+    are only read from disk as they are accessed. The file is therefore
+    kept open, and the caller is responsible for closing it (the h5py
+    File is available as the ``file`` attribute of each Dataset, see
+    :class:`SharedFile`).
     '''
 
     import h5py
 
     # Open file
     file_handle = h5py.File(filename, 'r')
+    try:
+        return _extract_image_datasets(file_handle)
+    except Exception:
+        file_handle.close()
+        raise
+
 
-    # Define function to read
+def _extract_image_datasets(file_handle):
 
     # Read in all datasets
     datasets = extract_hdf5_datasets(file_handle)
@@ -106,17 +154,9 @@ def extract_data_hdf5(filename, use_datasets='all'):
         datasets.pop(key)
 
     # Check that dimensions of all datasets are the same
-    reference_shape = datasets[list(datasets.keys())[0]].value.shape
+    reference_shape = datasets[list(datasets.keys())[0]].shape
     for key in datasets:
-        if datasets[key].value.shape != reference_shape:
+        if datasets[key].shape != reference_shape:
             raise Exception("Datasets are not all the same dimensions")
 
-    # Extract data
-    arrays = {}
-    for key in datasets:
-        arrays[key] = datasets[key].value
-
-    # Close HDF5 file
-    file_handle.close()
-
-    return arrays
+    return datasets
@@ -14,12 +14,20 @@ Link:        <---x2y---><--y2z-->
 
 The LinkManager autocreates a link from D1.id['x'] to D3.id['z']
 by chaining x2y and y2z.
+
+Links are stored as a graph from ComponentIDs to the links that use them,
+and the components a dataset can derive are found with a breadth-first
+search of this graph, so each is derived through the shortest chain of
+links.
 """
 import logging
+from collections import defaultdict
+from weakref import WeakKeyDictionary
 
 from .data import DerivedComponent, Data, ComponentID
 from .component_link import ComponentLink
 from .link_helpers import LinkCollection
+from .exceptions import IncompatibleAttribute
 from ..external import six
 from .contracts import contract
 
@@ -40,6 +48,64 @@ def accessible_links(cids, links):
             set(l.get_from_ids()) <= cids]
 
 
+def _index_links(links):
+    """ Build a dict mapping each ComponentID to the links that use it
+    as an input """
+    result = defaultdict(set)
+    for link in links:
+        for cid in link.get_from_ids():
+            result[cid].add(link)
+    return result
+
+
+def _shortest_derivations(cids, links_from, sources=()):
+    """ Breadth-first search of the link graph, starting from a
+    collection of ComponentIDs.
+
+    A link can be evaluated once all of its inputs are reached, and
+    its output is then one step further than its furthest input.
+    Searching level by level reaches each ComponentID by its shortest
+    chain of links.
+
+    :param cids: The starting ComponentIDs
+    :param links_from: dict mapping each ComponentID to the links that
+                       use it as an input
+    :param sources: Links with no inputs
+
+    :rtype: tuple
+    A dict of componentID -> componentLink, and a dict of the number of
+    links needed to reach each ComponentID
+    """
+    depth = dict((cid, 0) for cid in cids)
+    result = {}
+    missing = {}  # link -> number of inputs not yet reached
+
+    frontier = list(depth)
+    ready = list(sources)
+    level = 0
+    while frontier or ready:
+        level += 1
+        for cid in frontier:
+            for link in links_from.get(cid, ()):
+                if link not in missing:
+                    missing[link] = len(set(link.get_from_ids()))
+                missing[link] -= 1
+                if missing[link] == 0:
+                    ready.append(link)
+
+        frontier = []
+        for link in ready:
+            to_ = link.get_to_id()
+            if to_ in depth:
+                continue
+            depth[to_] = level
+            result[to_] = link
+            frontier.append(to_)
+        ready = []
+
+    return result, depth
+
+
 def discover_links(data, links):
     """ Discover all links to components that can be derived
     based on the current components known to a dataset, and a set
@@ -52,31 +118,9 @@ def discover_links(data, links):
     A dict of componentID -> componentLink
     The ComponentLink that data can use to generate the componentID.
     """
-
-    # TODO: try to add shortest paths first -- should
-    # prevent lots of repeated checking
-
-    cids = set(data.primary_components)
-    cid_links = {}
-    depth = {}
-    for cid in cids:
-        depth[cid] = 0
-
-    while True:
-        for link in accessible_links(cids, links):
-            from_ = set(link.get_from_ids())
-            to_ = link.get_to_id()
-            cost = max([depth[f] for f in from_]) + 1
-            if to_ in cids and cost >= depth[to_]:
-                continue
-            depth[to_] = cost
-            cids.add(to_)
-            cid_links[to_] = link
-            break
-        else:
-            # no more links to add
-            break
-    return cid_links
+    sources = [l for l in links if not l.get_from_ids()]
+    return _shortest_derivations(data.primary_components,
+                                 _index_links(links), sources)[0]
 
 
 def find_dependents(data, link):
@@ -91,36 +135,49 @@ def find_dependents(data, link):
     A `set` of `DerivedComponent` IDs that cannot be
     calculated without the input `Link`
     """
-    dependents = set()
-    visited = set()
-    while True:
-        for derived in data.derived_components:
-            derived = data.get_component(derived)
-            if derived in visited:
-                continue
-            to_, from_ = derived.link.get_to_id(), derived.link.get_from_ids()
-            if derived.link is link:
-                dependents.add(to_)
-                visited.add(derived)
-                break
-            if any(f in dependents for f in from_):
-                dependents.add(to_)
-                visited.add(derived)
-                break
-        else:
-            break  # nothing more to remove
-    return dependents
+    return _find_dependents(data, set([link]))
+
+
+def _find_dependents(data, links):
+    # the components computed by the links, and everything downstream
+    direct = set(cid for cid in data.derived_components
+                 if data.get_component(cid).link in links)
+    return direct | data.dependents(direct)
+
+
+def _shortens(link, depth):
+    """ Whether a link gives a new, or shorter, way to reach its output
+    from a set of ComponentIDs with known depths """
+    try:
+        cost = max([depth[f] for f in link.get_from_ids()] or [0]) + 1
+    except KeyError:
+        return False
+    return depth.get(link.get_to_id(), cost + 1) > cost
 
 
 class LinkManager(object):
 
     """A helper class to generate and store ComponentLinks,
     and compute which components are accesible from which data sets
+
+    The links are stored as a graph, indexed by the ComponentIDs they
+    use. The manager remembers which ComponentIDs each data set could
+    reach the last time it was updated, so adding or removing a link
+    only marks the data sets it can affect as needing an update (see
+    :meth:`needs_update`). Links should not be modified after they are
+    added.
     """
 
     def __init__(self):
         self._links = set()
-        self._duplicated_ids = []
+        self._merged = {}                 # duplicate ID -> merged ID
+        self._links_from = defaultdict(set)   # ID -> links using it
+        self._links_to = defaultdict(set)     # ID -> links deriving it
+        self._sources = set()             # links without inputs
+
+        # data -> (primary IDs, derivations, depth of each reachable ID)
+        # at the last update, for data that does not need another one
+        self._state = WeakKeyDictionary()
 
     def add_link(self, link):
         """
@@ -134,39 +191,107 @@ class LinkManager(object):
         if isinstance(link, (LinkCollection, list)):
             for l in link:
                 self.add_link(l)
-        else:
-            self._links.add(link)
-            if link.identity:
-                self._add_duplicated_id(link)
-        self._reassign_mergers()
+            return
+
+        if link in self._links:
+            return
+
+        for cid in set(link.get_from_ids() + [link.get_to_id()]):
+            merged = self._resolve(cid)
+            if merged is not cid:
+                link.replace_ids(cid, merged)
+
+        self._links.add(link)
+        self._index(link)
+        if link.identity:
+            self._add_duplicated_id(link)
+        self._invalidate(links=[link])
+
+    def _index(self, link):
+        frm = link.get_from_ids()
+        if not frm:
+            self._sources.add(link)
+        for cid in frm:
+            self._links_from[cid].add(link)
+        self._links_to[link.get_to_id()].add(link)
+
+    def _unindex(self, link):
+        self._sources.discard(link)
+        for cid in link.get_from_ids():
+            self._links_from[cid].discard(link)
+        self._links_to[link.get_to_id()].discard(link)
+
+    def _invalidate(self, links=(), ids=(), removed=None):
+        """ Forget the state of data that could be affected by a change
+
+        :param links: New or modified links. Data is affected if one of
+                      them is a new, or shorter, way to derive a component
+        :param ids: Data that can reach any of these IDs is affected
+        :param removed: A removed link. Data using it is affected.
+        """
+        for data, (_, derivations, depth) in list(self._state.items()):
+            if any(cid in depth for cid in ids) or \
+                    any(_shortens(link, depth) for link in links) or \
+                    (removed is not None and
+                     removed in derivations.values()):
+                del self._state[data]
+
+    def _resolve(self, cid):
+        """ The ComponentID that a (possibly duplicated) ID was merged
+        into """
+        result = cid
+        while result in self._merged:
+            result = self._merged[result]
+        if result is not cid:
+            self._merged[cid] = result
+        return result
 
     def _add_duplicated_id(self, link):
         frm = link.get_from_ids()
         assert len(frm) == 1
-        frm = frm[0]
-        to = link.get_to_id()
-        if (frm, to) in self._duplicated_ids:
+        orig = self._resolve(frm[0])
+        dup = self._resolve(link.get_to_id())
+        if orig is dup:
             return
-        if (to, frm) in self._duplicated_ids:
-            return
-        self._duplicated_ids.append((frm, to))
+        self._merged[dup] = orig
+        changed = self._reassign_mergers(dup, orig)
+        self._invalidate(links=changed, ids=[dup])
 
-    def _reassign_mergers(self):
-        """Update all links such that any reference to a duplicate
-        componentID is replaced with the original"""
-        for l in self._links:
-            for o, d in self._duplicated_ids:
-                l.replace_ids(d, o)
+    def _reassign_mergers(self, dup, orig):
+        """Update all links that refer to a duplicate componentID
+        to refer to the original instead
+
+        :returns: The modified links
+        """
+        links = self._links_from.pop(dup, set()) | \
+            self._links_to.pop(dup, set())
+        for l in links:
+            self._unindex(l)
+            l.replace_ids(dup, orig)
+            self._index(l)
+        return links
 
     def _merge_duplicate_ids(self, data):
-        for o, d in self._duplicated_ids:
-            if d in data.components:
-                data.update_id(d, o)
+        for cid in data.components:
+            merged = self._resolve(cid)
+            if merged is not cid:
+                data.update_id(cid, merged)
 
     @contract(link=ComponentLink)
     def remove_link(self, link):
         logging.getLogger(__name__).debug('removing link %s', link)
         self._links.remove(link)
+        self._unindex(link)
+        self._invalidate(removed=link)
+
+    def needs_update(self, data):
+        """Whether the DerivedComponents of a data object may be out of
+        date, because of links added or removed since the last call to
+        :meth:`update_data_components`, or because the primary
+        components of the data changed.
+        """
+        state = self._state.get(data)
+        return state is None or state[0] != set(data.primary_components)
 
     @contract(data=Data)
     def update_data_components(self, data):
@@ -189,7 +314,9 @@ class LinkManager(object):
         """
         self._merge_duplicate_ids(data)
         self._remove_underiveable_components(data)
-        self._add_deriveable_components(data)
+        derivations, depth = self._add_deriveable_components(data)
+        self._state[data] = (set(data.primary_components), derivations,
+                             depth)
 
     def _remove_underiveable_components(self, data):
         """ Find and remove any DerivedComponent in the data
@@ -198,11 +325,10 @@ class LinkManager(object):
         data_links = set(data.get_component(dc).link
                          for dc in data.derived_components)
         missing_links = data_links - self._links
-        to_remove = []
-        for m in missing_links:
-            to_remove.extend(find_dependents(data, m))
+        if not missing_links:
+            return
 
-        for r in to_remove:
+        for r in _find_dependents(data, missing_links):
             data.remove_component(r)
 
     def _add_deriveable_components(self, data):
@@ -211,10 +337,19 @@ class LinkManager(object):
         LinkManager
 
         """
-        links = discover_links(data, self._links)
+        links, depth = _shortest_derivations(data.primary_components,
+                                             self._links_from, self._sources)
         for cid, link in six.iteritems(links):
+            try:
+                current = data.get_component(cid)
+            except IncompatibleAttribute:
+                current = None
+            if isinstance(current, DerivedComponent) and \
+                    current.link is link:
+                continue
             d = DerivedComponent(data, link)
             data.add_component(d, cid)
+        return links, depth
 
     @property
     def links(self):
@@ -222,6 +357,10 @@ class LinkManager(object):
 
     def clear(self):
         self._links.clear()
+        self._links_from.clear()
+        self._links_to.clear()
+        self._sources.clear()
+        self._state.clear()
 
     def __contains__(self, item):
         return item in self._links
@@ -0,0 +1,439 @@
+from __future__ import absolute_import, division, print_function
+"""
+Compact representations of boolean masks.
+
+Subsets of large datasets often select only a small fraction of the
+elements, or a few contiguous blocks. Storing such subsets as dense
+boolean arrays wastes memory, so subset states can also produce masks in
+the following formats:
+
+* ``'dense'``: a boolean array (:class:`DenseMask`)
+* ``'indices'``: a sorted list of flat indices (:class:`IndexMask`)
+* ``'runs'``: a run-length encoding of the flat mask (:class:`RunLengthMask`)
+* ``'bits'``: a packed bitset, using one bit per element (:class:`BitMask`)
+
+Masks can be converted between formats, and combined with the ``&``,
+``|``, ``^`` and ``~`` operators without expanding them to dense arrays.
+"""
+
+import operator
+
+import numpy as np
+
+__all__ = ['Mask', 'DenseMask', 'IndexMask', 'RunLengthMask', 'BitMask',
+           'MASK_FORMATS', 'as_mask']
+
+
+class Mask(object):
+
+    """
+    Base class for boolean masks over an array of a given shape
+
+    Subclasses define :meth:`to_dense`, :meth:`to_indices`,
+    :meth:`from_dense`, :meth:`from_indices`, and :meth:`_combine`
+    """
+
+    #: The name of the format
+    format = None
+
+    #: Whether the memory usage scales with the number of selected
+    #: elements (rather than the size of the array)
+    sparse = False
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+
+    @property
+    def size(self):
+        """ The number of elements in the masked array """
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        """ Memory used by the mask, in bytes """
+        raise NotImplementedError()
+
+    def count(self):
+        """ The number of selected elements """
+        return self.to_indices().size
+
+    def any(self):
+        """ Whether any element is selected """
+        return self.count() > 0
+
+    def to_dense(self, view=None):
+        """
+        Convert to a boolean array
+
+        :param view: Optional view into the array
+        """
+        raise NotImplementedError()
+
+    def to_indices(self):
+        """ Return the sorted flat indices of the selected elements """
+        raise NotImplementedError()
+
+    @classmethod
+    def from_dense(cls, mask):
+        """ Build a mask from a boolean array """
+        raise NotImplementedError()
+
+    @classmethod
+    def from_indices(cls, shape, indices):
+        """
+        Build a mask from sorted, unique flat indices into an array
+        """
+        raise NotImplementedError()
+
+    def convert(self, format):
+        """
+        Convert to another format
+
+        :param format: One of 'dense', 'indices', 'runs' or 'bits'
+        """
+        try:
+            cls = MASK_FORMATS[format]
+        except KeyError:
+            raise ValueError("Unknown mask format: %s. Use one of %s" %
+                             (format, ', '.join(sorted(MASK_FORMATS))))
+        if isinstance(self, cls):
+            return self
+        if self.sparse or cls.sparse:
+            return cls.from_indices(self.shape, self.to_indices())
+        return cls.from_dense(self.to_dense())
+
+    def _binary(self, other, op):
+        other = as_mask(other)
+        if other.shape != self.shape:
+            raise ValueError("Cannot combine masks with shapes %s and %s" %
+                             (self.shape, other.shape))
+        return self._combine(other.convert(self.format), op)
+
+    def __and__(self, other):
+        return self._binary(other, operator.and_)
+
+    def __or__(self, other):
+        return self._binary(other, operator.or_)
+
+    def __xor__(self, other):
+        return self._binary(other, operator.xor)
+
+    def __invert__(self):
+        return self.from_dense(~self.to_dense())
+
+    def __repr__(self):
+        return "<%s: %i of %i selected>" % (type(self).__name__,
+                                           self.count(), self.size)
+
+
+class DenseMask(Mask):
+
+    """
+    A mask stored as a boolean array
+    """
+
+    format = 'dense'
+
+    def __init__(self, mask):
+        mask = np.asarray(mask, dtype=bool)
+        super(DenseMask, self).__init__(mask.shape)
+        self.mask = mask
+
+    @property
+    def nbytes(self):
+        return self.mask.nbytes
+
+    def count(self):
+        return int(np.count_nonzero(self.mask))
+
+    def to_dense(self, view=None):
+        if view is None:
+            return self.mask
+        return self.mask[view]
+
+    def to_indices(self):
+        return np.flatnonzero(self.mask)
+
+    @classmethod
+    def from_dense(cls, mask):
+        return cls(mask)
+
+    @classmethod
+    def from_indices(cls, shape, indices):
+        mask = np.zeros(shape, dtype=bool)
+        mask.flat[indices] = True
+        return cls(mask)
+
+    def _combine(self, other, op):
+        return DenseMask(op(self.mask, other.mask))
+
+    def __invert__(self):
+        return DenseMask(~self.mask)
+
+
+class IndexMask(Mask):
+
+    """
+    A mask stored as a sorted array of flat indices
+
+    :param shape: The shape of the masked array
+    :param indices: Flat indices of the selected elements, in any order.
+                    Negative indices count from the end of the array
+    """
+
+    format = 'indices'
+    sparse = True
+
+    def __init__(self, shape, indices=None):
+        super(IndexMask, self).__init__(shape)
+        if indices is None:
+            indices = []
+        indices = np.asarray(indices, dtype=np.intp).ravel()
+        if indices.size and (indices.min() < -self.size or
+                             indices.max() >= self.size):
+            raise IndexError("Indices out of bounds for an array of "
+                             "size %i" % self.size)
+        indices = np.where(indices < 0, indices + self.size, indices)
+        self.indices = np.unique(indices)
+
+    @property
+    def nbytes(self):
+        return self.indices.nbytes
+
+    def count(self):
+        return self.indices.size
+
+    def to_dense(self, view=None):
+        if view is not None:
+            from .data import _basic_index
+            index = _basic_index(self.shape, view)
+            if index is not None:
+                return self._dense_view(index)
+
+        mask = np.zeros(self.shape, dtype=bool)
+        mask.flat[self.indices] = True
+        if view is not None:
+            mask = mask[view]
+        return mask
+
+    def _dense_view(self, index):
+        """
+        Build the dense mask for a view directly from the indices, without
+        allocating a mask for the full array
+
+        :param index: Normalized view, from :func:`glue.core.data._basic_index`
+        """
+        coords = np.unravel_index(self.indices, self.shape)
+        keep = np.ones(self.indices.size, dtype=bool)
+        position, shape = [], []
+        for c, v, n in zip(coords, index, self.shape):
+            if isinstance(v, slice):
+                # map from positions along this axis to positions in the view
+                selected = np.arange(v.start, v.stop, v.step)
+                lookup = np.zeros(n, dtype=np.intp) - 1
+                lookup[selected] = np.arange(selected.size)
+                position.append(lookup[c])
+                shape.append(selected.size)
+                keep &= position[-1] >= 0
+            else:
+                keep &= c == v
+
+        result = np.zeros(shape, dtype=bool)
+        if position:
+            result[tuple(p[keep] for p in position)] = True
+        else:
+            result[()] = keep.any()
+        return result
+
+    def to_indices(self):
+        return self.indices
+
+    @classmethod
+    def from_dense(cls, mask):
+        mask = np.asarray(mask, dtype=bool)
+        return cls.from_indices(mask.shape, np.flatnonzero(mask))
+
+    @classmethod
+    def from_indices(cls, shape, indices):
+        result = cls(shape)
+        result.indices = np.asarray(indices, dtype=np.intp)
+        return result
+
+    def _combine(self, other, op):
+        a, b = self.indices, other.indices
+        if op is operator.and_:
+            result = np.intersect1d(a, b, assume_unique=True)
+        elif op is operator.or_:
+            result = np.union1d(a, b)
+        else:
+            result = np.setxor1d(a, b, assume_unique=True)
+        return IndexMask.from_indices(self.shape, result)
+
+    def __invert__(self):
+        # the complement of a sparse selection is dense, but has few runs
+        return ~self.convert('runs')
+
+
+class RunLengthMask(Mask):
+
+    """
+    A mask stored as runs of selected elements in the flattened array
+
+    :param shape: The shape of the masked array
+    :param starts: The (sorted) flat index of the start of each run
+    :param stops: The flat index after the end of each run
+    """
+
+    format = 'runs'
+    sparse = True
+
+    def __init__(self, shape, starts=None, stops=None):
+        super(RunLengthMask, self).__init__(shape)
+        self.starts = np.asarray([] if starts is None else starts,
+                                 dtype=np.intp)
+        self.stops = np.asarray([] if stops is None else stops,
+                                dtype=np.intp)
+        if self.starts.shape != self.stops.shape:
+            raise ValueError("starts and stops must have the same length")
+
+    @property
+    def nbytes(self):
+        return self.starts.nbytes + self.stops.nbytes
+
+    def count(self):
+        return int((self.stops - self.starts).sum())
+
+    def to_dense(self, view=None):
+        # +1 at the start of each run, -1 at the end
+        edges = np.zeros(self.size + 1, dtype=np.int8)
+        edges[self.starts] = 1
+        edges[self.stops] -= 1
+        mask = np.cumsum(edges[:-1], dtype=np.int8).astype(bool)
+        mask = mask.reshape(self.shape)
+        if view is not None:
+            mask = mask[view]
+        return mask
+
+    def to_indices(self):
+        counts = self.stops - self.starts
+        total = counts.sum()
+        offsets = np.repeat(self.starts - np.cumsum(counts) + counts, counts)
+        return np.arange(total, dtype=np.intp) + offsets
+
+    @classmethod
+    def from_dense(cls, mask):
+        mask = np.asarray(mask, dtype=bool)
+        edges = np.diff(np.r_[0, mask.ravel().view(np.int8), 0])
+        return cls(mask.shape, np.flatnonzero(edges == 1),
+                   np.flatnonzero(edges == -1))
+
+    @classmethod
+    def from_indices(cls, shape, indices):
+        indices = np.asarray(indices, dtype=np.intp)
+        if indices.size == 0:
+            return cls(shape)
+        breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+        starts = indices[np.r_[0, breaks]]
+        stops = indices[np.r_[breaks - 1, indices.size - 1]] + 1
+        return cls(shape, starts, stops)
+
+    def _contains(self, points):
+        """ Whether each of a sorted array of flat indices is selected """
+        if self.starts.size == 0:
+            return np.zeros(points.size, dtype=bool)
+        run = np.searchsorted(self.starts, points, side='right') - 1
+        return (run >= 0) & (points < self.stops[run.clip(0)])
+
+    def _combine(self, other, op):
+        # split the array into segments over which neither mask changes
+        edges = np.unique(np.r_[0, self.size, self.starts, self.stops,
+                                other.starts, other.stops])
+        lo, hi = edges[:-1], edges[1:]
+        keep = op(self._contains(lo), other._contains(lo))
+        lo, hi = lo[keep], hi[keep]
+        if lo.size == 0:
+            return RunLengthMask(self.shape)
+
+        # merge adjacent segments
+        new = np.r_[True, lo[1:] != hi[:-1]]
+        end = np.r_[new[1:], True]
+        return RunLengthMask(self.shape, lo[new], hi[end])
+
+    def __invert__(self):
+        starts = np.r_[0, self.stops]
+        stops = np.r_[self.starts, self.size]
+        keep = stops > starts
+        return RunLengthMask(self.shape, starts[keep], stops[keep])
+
+
+class BitMask(Mask):
+
+    """
+    A mask stored as a packed bitset, with one bit per element
+
+    :param shape: The shape of the masked array
+    :param bits: The packed bits (see :func:`numpy.packbits`)
+    """
+
+    format = 'bits'
+
+    def __init__(self, shape, bits=None):
+        super(BitMask, self).__init__(shape)
+        if bits is None:
+            bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        self.bits = np.asarray(bits, dtype=np.uint8)
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def count(self):
+        return int(np.count_nonzero(np.unpackbits(self.bits)))
+
+    def to_dense(self, view=None):
+        mask = np.unpackbits(self.bits)[:self.size].view(bool)
+        mask = mask.reshape(self.shape)
+        if view is not None:
+            mask = mask[view]
+        return mask
+
+    def to_indices(self):
+        return np.flatnonzero(np.unpackbits(self.bits)[:self.size])
+
+    @classmethod
+    def from_dense(cls, mask):
+        mask = np.asarray(mask, dtype=bool)
+        return cls(mask.shape, np.packbits(mask.ravel()))
+
+    @classmethod
+    def from_indices(cls, shape, indices):
+        result = cls(shape)
+        indices = np.asarray(indices, dtype=np.intp)
+        bit = (128 >> (indices & 7)).astype(np.uint8)
+        np.bitwise_or.at(result.bits, indices >> 3, bit)
+        return result
+
+    def _combine(self, other, op):
+        return BitMask(self.shape, op(self.bits, other.bits))
+
+    def __invert__(self):
+        bits = ~self.bits
+        if self.size % 8:  # clear the padding bits
+            bits[-1] &= (0xFF << (8 - self.size % 8)) & 0xFF
+        return BitMask(self.shape, bits)
+
+
+MASK_FORMATS = {'dense': DenseMask,
+                'indices': IndexMask,
+                'runs': RunLengthMask,
+                'bits': BitMask}
+
+
+def as_mask(value):
+    """
+    Wrap a boolean array as a :class:`DenseMask`. :class:`Mask` instances
+    are returned unchanged.
+    """
+    if isinstance(value, Mask):
+        return value
+    return DenseMask(value)
@@ -1,15 +1,25 @@
 from __future__ import absolute_import, division, print_function
 
+import ast
 import re
+import numbers
+
+import numpy as np
 
 from .data import ComponentID
 from .subset import Subset, SubsetState
 from .component_link import ComponentLink
+from ..external.six.moves import builtins
 
 TAG_RE = re.compile('\{\s*(?P<tag>\S+)\s*\}')
 
 __all__ = ['ParsedCommand', 'ParsedSubsetState']
 
+#: Elementwise commands over arrays with more elements than this are
+#: evaluated a block of about this many elements at a time, so that the
+#: intermediate arrays stay small
+CHUNK_SIZE = 2 ** 16
+
 
 def _ensure_only_component_references(cmd, references):
     """ Search through tag references in a command, ensure that
@@ -63,41 +73,6 @@ def _reference_list(cmd, references):
         raise KeyError("Tags from command not in reference mapping")
 
 
-def _dereference(cmd, references):
-    """ Dereference references in the template command, to refer
-    to objects in the reference mapping
-
-    Parameters
-    ----------
-    cmd : Command string
-    references : mapping from template tags to objects
-
-    Returns
-    -------
-    A new command, where all the tags have been subsituted as follows:
-      "{tag}" -> 'data[references["tag"], __view]', if references[tag] is a ComponentID
-      "{tag}" -> 'references["tag"].to_mask(__view)' if references[tag] is a Subset
-
-    __view is a placeholder variable referencing the view
-    passed to data.__getitem__ and subset.to_mask
-
-    Raises
-    ------
-    TypeError, if a tag in the command maps to something other than
-    a ComponentID or Subset object
-    """
-    def sub_func(match):
-        tag = match.group('tag')
-        if isinstance(references[tag], ComponentID):
-            return 'data[references["%s"], __view]' % tag
-        elif isinstance(references[tag], Subset):
-            return 'references["%s"].to_mask(__view)' % tag
-        else:
-            raise TypeError("Tag %s maps to unrecognized type: %s" %
-                            (tag, type(references[tag])))
-    return TAG_RE.sub(sub_func, cmd)
-
-
 def _validate(cmd, references):
     """ Make sure all references in the command are in the reference mapping
 
@@ -112,6 +87,111 @@ def _validate(cmd, references):
                             (tag, sorted(references.keys())))
 
 
+# AST nodes that operate elementwise on arrays
+_ELEMENTWISE_NODES = tuple(getattr(ast, n) for n in
+                           ['Expression', 'BinOp', 'UnaryOp', 'Compare',
+                            'Num', 'Constant', 'NameConstant',
+                            'operator', 'unaryop', 'cmpop', 'expr_context']
+                           if hasattr(ast, n))
+
+
+def _resolve(node, scope):
+    """ The object named by a Name or Attribute node, looked up in
+    scope, or None """
+    if isinstance(node, ast.Attribute):
+        return getattr(_resolve(node.value, scope), node.attr, None)
+    if isinstance(node, ast.Name):
+        if node.id in scope:
+            return scope[node.id]
+        return getattr(builtins, node.id, None)
+    return None
+
+
+def _is_elementwise(node, variables, scope):
+    """ Whether an expression computes each element of its result from
+    the same element of its variables, so that it can be evaluated on
+    any view of them.
+
+    :param node: The parsed expression
+    :param variables: The names of the (array) variables
+    :param scope: The namespace in which other names are looked up
+    """
+    if isinstance(node, ast.Call):
+        if node.keywords or getattr(node, 'starargs', None) or \
+                getattr(node, 'kwargs', None):
+            return False
+        if not isinstance(_resolve(node.func, scope), np.ufunc):
+            return False
+        return all(_is_elementwise(a, variables, scope) for a in node.args)
+
+    if isinstance(node, (ast.Name, ast.Attribute)):
+        if isinstance(node, ast.Name) and node.id in variables:
+            return True
+        value = _resolve(node, scope)
+        return isinstance(value, (numbers.Number, np.generic))
+
+    if getattr(ast, 'MatMult', None) and isinstance(node, ast.MatMult):
+        return False
+    if isinstance(node, ast.Compare) and len(node.ops) > 1:
+        return False  # chained comparisons use 'and'
+    if not isinstance(node, _ELEMENTWISE_NODES):
+        return False
+    return all(_is_elementwise(n, variables, scope)
+               for n in ast.iter_child_nodes(node))
+
+
+class _CompiledCommand(object):
+
+    """ A template command compiled into a code object, with each tag
+    replaced by a variable """
+
+    def __init__(self, cmd, scope):
+        tags = {}
+
+        def sub_func(match):
+            tag = match.group('tag')
+            if tag not in tags:
+                tags[tag] = '__ref%i' % len(tags)
+            return tags[tag]
+
+        source = TAG_RE.sub(sub_func, cmd).strip()
+        self.code = compile(source, '<glue expression>', 'eval')
+
+        #: variable name -> tag
+        self.variables = dict((v, k) for k, v in tags.items())
+
+        #: Whether the command can be evaluated on a view of the data
+        self.elementwise = _is_elementwise(ast.parse(source, mode='eval'),
+                                           self.variables, scope)
+
+
+def _evaluate_chunked(code, scope, values):
+    """ Evaluate an elementwise command a block of rows at a time
+
+    :returns: The result, or None if the values don't allow it
+    """
+    arrays = list(values.values())
+    if not arrays or not all(isinstance(a, np.ndarray) for a in arrays):
+        return None
+    shape = arrays[0].shape
+    size = arrays[0].size
+    if size <= CHUNK_SIZE or any(a.shape != shape for a in arrays):
+        return None
+
+    rows = max(CHUNK_SIZE * shape[0] // size, 1)
+    result = None
+    for start in range(0, shape[0], rows):
+        chunk = dict((k, v[start: start + rows]) for k, v in values.items())
+        out = eval(code, scope, chunk)
+        if result is None:
+            if not isinstance(out, np.ndarray) or \
+                    out.shape[1:] != shape[1:]:
+                return None
+            result = np.empty(shape, dtype=out.dtype)
+        result[start: start + rows] = out
+    return result
+
+
 class ParsedCommand(object):
 
     """ Class to manage commands that define new components and subsets """
@@ -127,6 +207,7 @@ class ParsedCommand(object):
         _validate(cmd, references)
         self._cmd = cmd
         self._references = references
+        self._compiled = None
 
     def ensure_only_component_references(self):
         _ensure_only_component_references(self._cmd, self._references)
@@ -135,14 +216,39 @@ class ParsedCommand(object):
     def reference_list(self):
         return _reference_list(self._cmd, self._references)
 
+    def _compile(self):
+        from .. import env
+        if self._compiled is None:
+            self._compiled = _CompiledCommand(self._cmd, vars(env))
+        return self._compiled
+
     def evaluate(self, data, view=None):
+        """ Evaluate the command on the requested view of each reference
+
+        The command is compiled the first time it is evaluated.
+        Elementwise commands over large arrays are evaluated in chunks.
+        """
         from .. import env
-        # pylint: disable=W0613, W0612
-        references = self._references
-        cmd = _dereference(self._cmd, self._references)
+        compiled = self._compile()
+
+        values = {}
+        for var, tag in compiled.variables.items():
+            ref = self._references[tag]
+            if isinstance(ref, ComponentID):
+                values[var] = data[ref, view]
+            elif isinstance(ref, Subset):
+                values[var] = ref.to_mask(view)
+            else:
+                raise TypeError("Tag %s maps to unrecognized type: %s" %
+                                (tag, type(ref)))
+
         scope = vars(env)
-        scope['__view'] = view
-        return eval(cmd, vars(env), locals())  # careful!
+        if compiled.elementwise:
+            result = _evaluate_chunked(compiled.code, scope, values)
+            if result is not None:
+                return result
+        values['data'] = data
+        return eval(compiled.code, scope, values)  # careful!
 
     def __gluestate__(self, context):
         return dict(cmd=self._cmd,
@@ -202,8 +308,12 @@ class ParsedSubsetState(SubsetState):
         self._parsed = parsed
 
     def to_mask(self, data, view=None):
-        """ Calculate the new mask by evaluating the dereferenced command """
-        result = self._parsed.evaluate(data)
-        if view is not None:
-            result = result[view]
-        return result
+        """ Calculate the new mask by evaluating the command
+
+        Commands that are not elementwise (for example, comparisons with
+        ``{x}.mean()``) define the mask of the whole dataset, so they are
+        evaluated on all the data before the view is extracted.
+        """
+        if view is None or self._parsed._compile().elementwise:
+            return self._parsed.evaluate(data, view)
+        return self._parsed.evaluate(data)[view]
@@ -0,0 +1,272 @@
+from __future__ import absolute_import, division, print_function
+"""
+Percentiles of large arrays, computed in a few streaming passes.
+
+A :class:`PercentileSketch` summarizes the finite values of an array with a
+fixed-bin histogram, computed chunk by chunk. Percentiles are located in
+the histogram, and bins that hold too many values to give an accurate
+answer are refined with a histogram of their own. Refinements are kept,
+so later queries are usually answered without touching the data.
+"""
+
+import numpy as np
+
+from .cache import index_cache, data_version
+from .data import LazyComponent
+
+__all__ = ['PercentileSketch', 'percentile_sketch']
+
+
+class _Node(object):
+
+    """
+    A histogram over the values of an array in the interval [vmin, vmax]
+
+    Bin i holds the values for which floor((x - lo) * scale) == i (clipped
+    to the valid range of bins). Since this is monotonic in x, each bin
+    holds an interval of values.
+    """
+
+    def __init__(self, vmin, vmax, lo, scale, counts):
+        self.vmin = vmin
+        self.vmax = vmax
+        self.lo = lo
+        self.scale = scale
+        self.counts = counts
+        self.cumulative = np.cumsum(counts)
+        self.children = {}
+
+    @property
+    def constant(self):
+        return self.vmin == self.vmax
+
+    def bin_index(self, x):
+        nbins = self.counts.size
+        return np.clip(((x - self.lo) * self.scale).astype(np.intp),
+                       0, nbins - 1)
+
+    def select(self, chunk):
+        """ The elements of chunk that belong to this node """
+        return chunk[(chunk >= self.vmin) & (chunk <= self.vmax)]
+
+    def bin_range(self, i):
+        """ The interval spanned by the values in bin i """
+        lo = max(self.lo + i / self.scale, self.vmin)
+        hi = min(self.lo + (i + 1) / self.scale, self.vmax)
+        return lo, max(lo, hi)
+
+    def locate(self, rank):
+        """
+        Find the bin containing a (0-based, possibly fractional) rank
+
+        :returns: The bin index, and the number of values in earlier bins
+        """
+        i = np.searchsorted(self.cumulative, rank, side='right')
+        i = min(i, self.counts.size - 1)
+        before = self.cumulative[i - 1] if i > 0 else 0
+        return i, before
+
+
+class PercentileSketch(object):
+
+    """
+    Answer percentile queries about the finite values of an array.
+
+    :param values: The array to summarize. This can be any object with a
+                   ``shape`` that can be sliced along its first axis, so
+                   that values are only read a slab at a time
+    :param nbins: The number of bins in each histogram
+    :param chunk_size: The approximate number of elements read at a time
+    """
+
+    #: Bins with at most this many values are sorted for exact percentiles
+    max_collect = 2 ** 16
+
+    def __init__(self, values, nbins=4096, chunk_size=2 ** 20):
+        if not hasattr(values, 'shape'):
+            values = np.asarray(values)
+        if len(values.shape) == 0:
+            values = np.reshape(values, 1)
+        self._values = values
+        self.nbins = nbins
+        self.chunk_size = chunk_size
+        self._exact = {}
+
+        count, vmin, vmax = 0, np.inf, -np.inf
+        for chunk in self._chunks():
+            chunk = chunk[np.isfinite(chunk)]
+            if chunk.size == 0:
+                continue
+            count += chunk.size
+            vmin = min(vmin, chunk.min())
+            vmax = max(vmax, chunk.max())
+
+        #: The number of finite values
+        self.count = count
+
+        # approximate answers are accurate to within this many ranks
+        self._resolution = max(2 * count // nbins, 1)
+
+        if count == 0:
+            self._root = None
+        elif vmin == vmax:
+            self._root = _Node(vmin, vmax, vmin, 1., None)
+        else:
+            self._root = self._histogram(None, None, vmin,
+                                         nbins / (vmax - vmin))
+
+    @property
+    def nbytes(self):
+        """ Memory used by the histograms, in bytes """
+        nodes = [self._root] if self._root is not None else []
+        result = 0
+        while nodes:
+            node = nodes.pop()
+            if node.counts is not None:
+                result += node.counts.nbytes + node.cumulative.nbytes
+            nodes.extend(node.children.values())
+        return result
+
+    def _chunks(self):
+        """ Yield the values in slabs along the first axis, flattened """
+        shape = self._values.shape
+        size = int(np.prod(shape))
+        if size == 0:
+            return
+        rows = max(self.chunk_size * shape[0] // size, 1)
+        for start in range(0, shape[0], rows):
+            yield np.ravel(self._values[start: start + rows])
+
+    def _members(self, parent, i):
+        """ Yield the values in bin i of a node, one chunk at a time """
+        for chunk in self._chunks():
+            if parent is None:
+                yield chunk[np.isfinite(chunk)]
+                continue
+            chunk = parent.select(chunk)
+            yield chunk[parent.bin_index(chunk) == i]
+
+    def _histogram(self, parent, i, lo, scale):
+        """
+        Build the histogram of the values in bin i of parent (or of all
+        finite values, if parent is None)
+        """
+        counts = np.zeros(self.nbins, dtype=np.int64)
+        vmin, vmax = np.inf, -np.inf
+        node = _Node(vmin, vmax, lo, scale, counts)
+        for chunk in self._members(parent, i):
+            if chunk.size == 0:
+                continue
+            vmin = min(vmin, chunk.min())
+            vmax = max(vmax, chunk.max())
+            counts += np.bincount(node.bin_index(chunk),
+                                  minlength=self.nbins)
+        return _Node(vmin, vmax, lo, scale, counts)
+
+    def _child(self, node, i):
+        if i not in node.children:
+            lo = node.lo + i / node.scale
+            node.children[i] = self._histogram(node, i, lo,
+                                               node.scale * self.nbins)
+        return node.children[i]
+
+    def _value_at(self, rank, exact):
+        """
+        The value with a given (0-based) rank in the sorted finite values.
+        Ranks must be integers if exact is True.
+        """
+        node = self._root
+        while True:
+            if node.constant:
+                return node.vmin
+
+            i, before = node.locate(rank)
+            count = node.counts[i]
+            rank -= before
+
+            if not exact and count <= self._resolution:
+                lo, hi = node.bin_range(i)
+                return lo + (hi - lo) * min(rank / count, 1)
+
+            if exact and count <= self.max_collect:
+                values = np.concatenate(list(self._members(node, i)))
+                return np.sort(values)[int(rank)]
+
+            node = self._child(node, i)
+
+    def percentile(self, percentile, exact=False):
+        """
+        A percentile of the finite values, computed like :func:`numpy.percentile`
+
+        :param percentile: The percentile, between 0 and 100
+        :param exact: If True, return the exact percentile. Otherwise,
+                      the result is accurate to within a fraction of about
+                      2 / nbins of the values.
+        :returns: The percentile, or NaN if there are no finite values
+        """
+        if self._root is None:
+            return np.nan
+
+        rank = min(max(percentile, 0), 100) / 100. * (self.count - 1)
+        if rank == 0:
+            return float(self._root.vmin)
+        if rank == self.count - 1:
+            return float(self._root.vmax)
+
+        # small arrays are cheap to answer exactly
+        exact = exact or self.count <= self.max_collect
+        if not exact:
+            return float(self._value_at(rank, exact=False))
+        if percentile in self._exact:
+            return self._exact[percentile]
+
+        k = int(np.floor(rank))
+        result = self._value_at(k, exact=True)
+        frac = rank - k
+        if frac > 0:
+            upper = self._value_at(k + 1, exact=True)
+            result = result + (upper - result) * frac
+
+        result = float(result)
+        self._exact[percentile] = result
+        return result
+
+
+class _ComponentSlabs(object):
+
+    """ The values of a component, read a slab along the first axis at a
+    time (so that derived components only compute each slab) """
+
+    def __init__(self, data, att):
+        self._data = data
+        self._att = att
+        self.shape = data.shape
+
+    def __getitem__(self, rows):
+        view = (rows,) + (slice(None),) * (len(self.shape) - 1)
+        return self._data[self._att, view]
+
+
+def percentile_sketch(data, att):
+    """
+    Fetch the :class:`PercentileSketch` of a component in a dataset.
+
+    The sketch is built on first use, reading the component a slab at a
+    time, and cached until the numerical values of the data change.
+
+    :returns: The sketch, or None if the component is not numerical, or is
+              a :class:`~glue.core.data.LazyComponent` (building the
+              sketch would read all of it from disk)
+    """
+    if isinstance(data.get_component(att), LazyComponent):
+        return None
+
+    key = (PercentileSketch, data, data_version(data), att)
+    result = index_cache.get(key)
+    if result is None:
+        values = _ComponentSlabs(data, att)
+        if values[0:1].dtype.kind not in 'biuf':
+            return None
+        result = PercentileSketch(values)
+        index_cache.set(key, result, owner=data)
+    return result
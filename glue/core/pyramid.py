@@ -0,0 +1,253 @@
+from __future__ import absolute_import, division, print_function
+"""
+Multi-resolution pyramids for displaying large images.
+
+An :class:`ImagePyramid` holds successively downsampled copies of a 2D
+image, each half the size of the previous one along both axes. Displaying
+a strided view of a large image then only needs to read from the level
+whose resolution matches the stride, rather than touching memory across
+the whole full-resolution array.
+
+Pyramids of datasets refer to the full-resolution image through the data,
+so that (for example) images backed by a file on disk are only read in
+blocks while the pyramid is built, and are never held in memory in full.
+"""
+
+import tempfile
+
+import numpy as np
+
+from .cache import index_cache, data_version
+from ..config import enable_image_pyramid
+
+__all__ = ['ImagePyramid', 'image_pyramid', 'get_image_pyramid']
+
+#: Images with fewer pixels than this are displayed without a pyramid
+MIN_PYRAMID_SIZE = 4096 * 1024
+
+#: Directory for pyramid levels that are too large to keep in memory.
+#: Defaults to the system temporary directory
+CACHE_DIR = None
+
+#: The number of rows of the output level computed at a time
+_CHUNK_ROWS = 256
+
+
+def _downsample(image, method, out):
+    """
+    Reduce 2x2 blocks of an image, ignoring non-finite values. The last
+    row and column of odd-sized images are reduced on their own.
+    """
+    ny, nx = image.shape
+    for start in range(0, out.shape[0], _CHUNK_ROWS):
+        rows = np.array(image[2 * start: 2 * (start + _CHUNK_ROWS)],
+                        dtype=out.dtype)
+        pad = ((0, rows.shape[0] % 2), (0, nx % 2))
+        if pad != ((0, 0), (0, 0)):
+            rows = np.pad(rows, pad, mode='constant',
+                          constant_values=np.nan)
+        blocks = rows.reshape(rows.shape[0] // 2, 2, rows.shape[1] // 2, 2)
+        finite = np.isfinite(blocks)
+        count = finite.sum(axis=(1, 3))
+
+        if method == 'mean':
+            result = np.where(finite, blocks, 0).sum(axis=(1, 3))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result = result / count
+        else:
+            result = np.where(finite, blocks, -np.inf).max(axis=(1, 3))
+            result[count == 0] = np.nan
+
+        out[start: start + result.shape[0]] = result
+    return out
+
+
+class _DataPlane(object):
+
+    """
+    A 2D slice through a component of a dataset, which behaves like a
+    read-only array but only reads from the data when indexed
+
+    :param data: The :class:`~glue.core.data.Data`
+    :param cid: The ComponentID
+    :param plane: A tuple with an entry for each axis of the data:
+                  ``slice(None)`` for the two image axes, and an integer
+                  for every other axis
+    """
+
+    def __init__(self, data, cid, plane):
+        self.data = data
+        self.cid = cid
+        self.plane = plane
+        self.shape = tuple(n for n, p in zip(data.shape, plane)
+                           if isinstance(p, slice))
+        self.ndim = len(self.shape)
+        self.dtype = self[:1].dtype
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = iter(key)
+        view = tuple(next(key, slice(None)) if isinstance(p, slice) else p
+                     for p in self.plane)
+        return self.data[(self.cid,) + view]
+
+    def __array__(self, dtype=None):
+        return np.asarray(self[:], dtype=dtype)
+
+
+class ImagePyramid(object):
+
+    """
+    Successively downsampled copies of a 2D image.
+
+    Level 0 is the original image, and level ``k`` is downsampled by a
+    factor of ``2 ** k`` along each axis. Levels are built until neither
+    dimension is larger than ``min_size``.
+
+    :param image: The 2D image. This can be any array-like object with
+                  ``shape`` and ``dtype`` attributes that supports
+                  slicing, and is read in blocks of rows
+    :param method: How blocks of pixels are combined: 'mean' or 'max'.
+                   Non-finite values are ignored
+    :param min_size: The size of the smallest level
+    :param cache_dir: If not None, downsampled levels are stored in
+                      temporary memory-mapped files in this directory,
+                      rather than in memory
+    """
+
+    def __init__(self, image, method='mean', min_size=256, cache_dir=None):
+        if method not in ('mean', 'max'):
+            raise ValueError("Unknown downsampling method: %s" % method)
+        if not hasattr(image, 'shape'):
+            image = np.asarray(image)
+        if len(image.shape) != 2:
+            raise ValueError("Image pyramids require 2D images")
+
+        self.method = method
+        self.on_disk = cache_dir is not None
+        self.levels = [image]
+        dtype = np.result_type(image.dtype, np.float32)
+
+        while max(self.levels[-1].shape) > min_size:
+            prev = self.levels[-1]
+            shape = ((prev.shape[0] + 1) // 2, (prev.shape[1] + 1) // 2)
+            if self.on_disk:
+                out = np.memmap(tempfile.TemporaryFile(dir=cache_dir),
+                                dtype=dtype, mode='w+', shape=shape)
+            else:
+                out = np.empty(shape, dtype=dtype)
+            self.levels.append(_downsample(prev, method, out))
+
+    @property
+    def shape(self):
+        """ The shape of the full-resolution image """
+        return self.levels[0].shape
+
+    @property
+    def nbytes(self):
+        """
+        The memory used by the arrays held by the pyramid, in bytes.
+        Levels stored on disk and references to data (rather than arrays)
+        do not count.
+        """
+        return sum(getattr(level, 'nbytes', 0) for level in self.levels
+                   if not isinstance(level, np.memmap))
+
+    def level_for_step(self, step):
+        """
+        The coarsest level whose pixels are no larger than step
+        full-resolution pixels
+        """
+        level = int(np.floor(np.log2(max(step, 1))))
+        return min(level, len(self.levels) - 1)
+
+    def extract(self, view):
+        """
+        Extract a strided view from the level that best matches its stride
+
+        :param view: A view into the full-resolution data, with two
+                     slices for the image axes. Other entries (such as
+                     the ComponentID and the index along other axes of
+                     a cube) are passed through unchanged
+        :returns: A tuple of the image, and the equivalent view into the
+                  full-resolution data (used to compute the extent)
+        """
+        axes = [i for i, v in enumerate(view) if isinstance(v, slice)]
+        slices = [view[i].indices(n) for i, n in zip(axes, self.shape)]
+        level = self.level_for_step(min(s[2] for s in slices))
+        scale = 2 ** level
+        image = self.levels[level]
+
+        result = list(view)
+        lslices = []
+        for i, n, nlevel, (start, stop, step) in zip(axes, self.shape,
+                                                     image.shape, slices):
+            start = start // scale
+            stop = min(-(-stop // scale), nlevel)
+            step = max(step // scale, 1)
+            lslices.append(slice(start, stop, step))
+            result[i] = slice(start * scale, min(stop * scale, n),
+                              step * scale)
+
+        return image[tuple(lslices)], tuple(result)
+
+
+def _pyramid_key(data, view, method):
+    plane = tuple(None if isinstance(v, slice) else v for v in view[1:])
+    return (ImagePyramid, data, data_version(data), view[0], plane, method)
+
+
+def get_image_pyramid(data, view, method='mean'):
+    """
+    Fetch the cached :class:`ImagePyramid` for a 2D slice through a
+    dataset, without building it
+
+    :param view: A view into the data, whose first element is a
+                 ComponentID and which contains two slices
+    :returns: The pyramid, or None if it hasn't been built
+    """
+    return index_cache.get(_pyramid_key(data, view, method))
+
+
+def image_pyramid(data, view, method='mean'):
+    """
+    Fetch the :class:`ImagePyramid` for a 2D slice through a dataset.
+
+    Pyramids are built on first use, and cached until the numerical values
+    of the data change. The full-resolution level refers back to the data.
+    Downsampled levels that would take more than half of the memory
+    budget of :data:`glue.core.cache.index_cache` are stored in temporary
+    files in :data:`CACHE_DIR` instead.
+
+    :param view: A view into the data, whose first element is a
+                 ComponentID and which contains two slices
+    :returns: The pyramid, or None if pyramids are disabled
+              (see :data:`glue.config.enable_image_pyramid`), the image
+              is too small to benefit from one, or it is not numerical.
+    """
+    if not enable_image_pyramid() or data.size < MIN_PYRAMID_SIZE:
+        return None
+
+    key = _pyramid_key(data, view, method)
+    result = index_cache.get(key)
+    if result is None:
+        plane = tuple(slice(None) if isinstance(v, slice) else v
+                      for v in view[1:])
+        image = _DataPlane(data, view[0], plane)
+        if image.dtype.kind not in 'biuf' or image.size < MIN_PYRAMID_SIZE:
+            return None
+
+        # the downsampled levels use about a third of the memory of the
+        # full-resolution image
+        itemsize = np.result_type(image.dtype, np.float32).itemsize
+        cache_dir = None
+        if image.size * itemsize // 3 > index_cache.max_bytes // 2:
+            cache_dir = CACHE_DIR or tempfile.gettempdir()
+        result = ImagePyramid(image, method=method, cache_dir=cache_dir)
+        index_cache.set(key, result, owner=data)
+    return result
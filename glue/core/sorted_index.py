@@ -0,0 +1,191 @@
+from __future__ import absolute_import, division, print_function
+"""
+Sorted indices over single components, to speed up range and inequality
+selections.
+
+A :class:`SortedIndex` stores the values of a component in sorted order,
+along with the positions they came from. The elements that lie within an
+interval can then be found with two binary searches, and only the
+selected elements are touched when building a mask or index list.
+
+Building an index costs a full sort, so components are only indexed once
+they have been queried several times, and selections that cover a large
+fraction of the data are still evaluated with a scan.
+"""
+
+import numbers
+import operator
+from weakref import WeakKeyDictionary
+
+import numpy as np
+
+from .cache import index_cache, data_version
+from ..config import enable_sorted_index
+
+__all__ = ['SortedIndex', 'sorted_index', 'inequality_bounds']
+
+#: Datasets with fewer elements than this are not indexed
+MIN_INDEX_SIZE = 100000
+
+#: Components are indexed on the first query after they have been
+#: queried this many times
+MIN_QUERIES = 2
+
+#: Selections of more than this fraction of the elements are faster to
+#: evaluate with a scan than through the index
+MAX_SELECTED_FRACTION = 0.1
+
+# data -> (data version, {component id: number of queries})
+_queries = WeakKeyDictionary()
+
+
+class SortedIndex(object):
+
+    """
+    An index of the values of a numerical array, in sorted order.
+
+    :param values: The array to index
+    """
+
+    def __init__(self, values):
+        values = np.asarray(values)
+        self.shape = values.shape
+        values = values.ravel()
+
+        itype = np.int32 if values.size < 2 ** 31 else np.int64
+        self._order = np.argsort(values, kind='mergesort').astype(itype)
+        self._values = values[self._order]
+
+    @property
+    def size(self):
+        """ The number of indexed elements """
+        return self._values.size
+
+    @property
+    def nbytes(self):
+        """ Memory used by the index, in bytes """
+        return self._order.nbytes + self._values.nbytes
+
+    def _bounds(self, lo, hi, lo_inclusive, hi_inclusive):
+        """
+        The range of sorted positions whose values lie between lo and hi
+        """
+        if np.isnan(lo) or np.isnan(hi):
+            return 0, 0
+        start = np.searchsorted(self._values, lo,
+                                side='left' if lo_inclusive else 'right')
+        stop = np.searchsorted(self._values, hi,
+                               side='right' if hi_inclusive else 'left')
+        return start, max(start, stop)
+
+    def count(self, lo=-np.inf, hi=np.inf,
+              lo_inclusive=True, hi_inclusive=True):
+        """
+        The number of elements between lo and hi
+        """
+        start, stop = self._bounds(lo, hi, lo_inclusive, hi_inclusive)
+        return stop - start
+
+    def selective(self, lo=-np.inf, hi=np.inf,
+                  lo_inclusive=True, hi_inclusive=True):
+        """
+        Whether few enough elements lie between lo and hi for the index to
+        be faster than a scan (see :data:`MAX_SELECTED_FRACTION`)
+        """
+        count = self.count(lo, hi, lo_inclusive, hi_inclusive)
+        return count <= MAX_SELECTED_FRACTION * self.size
+
+    def indices(self, lo=-np.inf, hi=np.inf,
+                lo_inclusive=True, hi_inclusive=True):
+        """
+        The (sorted) flat indices of the elements between lo and hi
+
+        :param lo: The lower bound
+        :param hi: The upper bound
+        :param lo_inclusive: Whether the lower bound is inclusive
+        :param hi_inclusive: Whether the upper bound is inclusive
+        """
+        start, stop = self._bounds(lo, hi, lo_inclusive, hi_inclusive)
+        return np.sort(self._order[start:stop])
+
+    def mask(self, lo=-np.inf, hi=np.inf,
+             lo_inclusive=True, hi_inclusive=True):
+        """
+        A boolean mask of the elements between lo and hi, with the same
+        shape as the indexed array. See :meth:`indices`
+        """
+        start, stop = self._bounds(lo, hi, lo_inclusive, hi_inclusive)
+        result = np.zeros(self.size, dtype=bool)
+        result[self._order[start:stop]] = True
+        return result.reshape(self.shape)
+
+
+def sorted_index(data, att, build=True):
+    """
+    Fetch the :class:`SortedIndex` for a component in a dataset.
+
+    Each call with ``build=True`` counts as a query of the component. The
+    index is built once the component has been queried more than
+    :data:`MIN_QUERIES` times, and cached until the numerical values of
+    the data change.
+
+    :param build: If False, only return an index that is already cached
+
+    :returns: The index, or None if sorted indexing is disabled
+              (see :data:`glue.config.enable_sorted_index`), the dataset
+              is too small to benefit from it, the component has not been
+              queried often enough, the component is not numerical, or
+              the index would not fit in :data:`glue.core.cache.index_cache`.
+    """
+    if not enable_sorted_index() or data.size < MIN_INDEX_SIZE:
+        return None
+
+    version = data_version(data)
+    key = (SortedIndex, data, version, att)
+    result = index_cache.get(key)
+    if result is not None or not build:
+        return result
+
+    seen = _queries.get(data)
+    if seen is None or seen[0] != version:
+        seen = _queries[data] = (version, {})
+    nquery = seen[1][att] = seen[1].get(att, 0) + 1
+    if nquery <= MIN_QUERIES:
+        return None
+
+    values = data[att]
+    if values.dtype.kind not in 'biuf':
+        return None
+
+    # the sorted values, plus their positions
+    itemsize = 4 if values.size < 2 ** 31 else 8
+    if values.size * (values.itemsize + itemsize) > index_cache.max_bytes:
+        return None
+
+    result = SortedIndex(values)
+    index_cache.set(key, result, owner=data)
+    return result
+
+
+def inequality_bounds(left, right, op):
+    """
+    Express an inequality between a component and a number as an interval
+
+    :returns: A (lo, hi, lo_inclusive, hi_inclusive) tuple, or None if the
+              inequality does not compare a component with a real number
+    """
+    if isinstance(left, numbers.Real) == isinstance(right, numbers.Real):
+        return None
+
+    if isinstance(left, numbers.Real):  # put the component on the left
+        op = {operator.gt: operator.lt, operator.ge: operator.le,
+              operator.lt: operator.gt, operator.le: operator.ge,
+              operator.eq: operator.eq}.get(op)
+        right = left
+
+    inf = np.inf
+    return {operator.gt: (right, inf, False, True),
+            operator.ge: (right, inf, True, True),
+            operator.lt: (-inf, right, True, False),
+            operator.le: (-inf, right, True, True),
+            operator.eq: (right, right, True, True)}.get(op)
@@ -0,0 +1,349 @@
+from __future__ import absolute_import, division, print_function
+"""
+Spatial indexing of 2D point data, to speed up ROI selections on large
+datasets.
+
+A :class:`GridIndex` bins the points of a pair of components into a
+uniform grid of cells. When testing which points lie inside a region of
+interest, each (non-empty) cell is classified as being entirely inside,
+entirely outside, or on the boundary of the ROI. Points in interior
+cells are accepted in bulk, and only points in boundary cells are passed
+to :meth:`~glue.core.roi.Roi.contains`.
+"""
+
+import numpy as np
+
+from .cache import index_cache, data_version
+from .roi import RectangularROI, CircularROI, PolygonalROI
+from ..config import enable_spatial_index
+
+__all__ = ['GridIndex', 'spatial_index', 'INDEXED_ROIS']
+
+#: Datasets with fewer elements than this are not indexed
+MIN_INDEX_SIZE = 100000
+
+#: ROI types whose selections use the index. Rectangles and circles are
+#: tested with a few vectorized comparisons, which is faster than
+#: gathering the points of the candidate cells
+INDEXED_ROIS = (PolygonalROI,)
+
+
+class GridIndex(object):
+
+    """
+    A uniform grid index over a set of 2D points.
+
+    Non-finite points are not indexed, and never lie inside an ROI.
+
+    :param x: Array of x values
+    :param y: Array of y values (same shape as x)
+    :param points_per_cell: Target average number of points per cell
+    :param max_cells: Maximum number of cells along each axis
+    """
+
+    def __init__(self, x, y, points_per_cell=64, max_cells=1024):
+        x = np.asarray(x)
+        y = np.asarray(y)
+        if x.shape != y.shape:
+            raise ValueError("x and y must have the same shape")
+
+        self.shape = x.shape
+        x, y = x.ravel(), y.ravel()
+
+        finite = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+        xf, yf = x[finite], y[finite]
+
+        nbin = int(np.sqrt(finite.size / points_per_cell))
+        self.nbin = nbin = min(max(nbin, 1), max_cells)
+
+        if finite.size > 0:
+            self.xlo, self.ylo = xf.min(), yf.min()
+            self.dx = (xf.max() - self.xlo) / nbin or 1.
+            self.dy = (yf.max() - self.ylo) / nbin or 1.
+        else:
+            self.xlo = self.ylo = 0.
+            self.dx = self.dy = 1.
+
+        ix = self._bin(xf, self.xlo, self.dx).clip(0, nbin - 1)
+        iy = self._bin(yf, self.ylo, self.dy).clip(0, nbin - 1)
+        cell = iy * nbin + ix
+
+        itype = np.int32 if x.size < 2 ** 31 else np.int64
+        srt = np.argsort(cell, kind='mergesort')
+        self._order = finite[srt].astype(itype)
+        cell = cell[srt]
+
+        # boundaries of each non-empty cell in the sorted point list
+        starts = np.flatnonzero(np.r_[True, cell[1:] != cell[:-1]]) \
+            if cell.size else np.zeros(0, dtype=int)
+        self._starts = np.r_[starts, cell.size].astype(itype)
+        cell = cell[starts]
+        self._ix, self._iy = cell % nbin, cell // nbin
+
+        # bounding boxes of the points in each cell
+        xs, ys = x[self._order], y[self._order]
+        if starts.size:
+            self._xmin = np.minimum.reduceat(xs, starts)
+            self._xmax = np.maximum.reduceat(xs, starts)
+            self._ymin = np.minimum.reduceat(ys, starts)
+            self._ymax = np.maximum.reduceat(ys, starts)
+        else:
+            self._xmin = self._xmax = self._ymin = self._ymax = xs
+
+    @staticmethod
+    def _bin(values, lo, step):
+        return np.floor((values - lo) / step).astype(np.int64)
+
+    @property
+    def ncells(self):
+        """ The number of non-empty cells """
+        return self._ix.size
+
+    @property
+    def nbytes(self):
+        """ Memory used by the index, in bytes """
+        return sum(a.nbytes for a in (self._order, self._starts,
+                                      self._ix, self._iy,
+                                      self._xmin, self._xmax,
+                                      self._ymin, self._ymax))
+
+    def contains(self, roi, x, y):
+        """
+        Equivalent to ``roi.contains(x, y)``, for the x and y values
+        that were used to build the index.
+
+        Returns None if the ROI type is not supported by the index.
+        """
+        status = self._classify(roi, x, y)
+        if status is None:
+            return None
+
+        x, y = np.asarray(x).ravel(), np.asarray(y).ravel()
+        result = np.zeros(x.size, dtype=bool)
+        result[self._points(status == 1)] = True
+
+        candidates = self._points(status == -1)
+        if candidates.size > 0:
+            result[candidates] = roi.contains(x[candidates], y[candidates])
+
+        return result.reshape(self.shape)
+
+    def update(self, mask, old_roi, roi, x, y):
+        """
+        Equivalent to ``roi.contains(x, y)``, given the result ``mask`` of
+        ``old_roi.contains(x, y)``.
+
+        Only points in cells where the two ROIs might disagree are
+        re-tested, so small edits to an ROI (moving a rectangle, or adding
+        a vertex to a polygon) are cheap to re-evaluate.
+
+        Returns None if the ROI types are not supported by the index.
+        """
+        x, y = np.asarray(x).ravel(), np.asarray(y).ravel()
+        old_edges, new_edges = _edges(old_roi), _edges(roi)
+
+        if old_edges is not None and new_edges is not None:
+            # Containment follows the even-odd rule, so the containment of
+            # a point changes if a ray from it crosses the edges that are
+            # not shared an odd number of times. This parity is the same
+            # for all points in a cell not crossed by those edges, so
+            # the membership of every point in such a cell either stays
+            # the same or is inverted. (For self-intersecting polygons,
+            # the points in a cell need not all have the same membership.)
+            retest = self._edge_cells(old_edges ^ new_edges)
+            keep = ~retest
+            first = self._order[self._starts[:-1][keep]]
+            flip = np.zeros(self.ncells, dtype=bool)
+            flip[keep] = (roi.contains(x[first], y[first]) !=
+                          old_roi.contains(x[first], y[first]))
+
+            result = np.array(mask, dtype=bool).ravel()
+            points = self._points(flip)
+            result[points] = ~result[points]
+        else:
+            old_status = self._classify(old_roi, x, y)
+            status = self._classify(roi, x, y)
+            if old_status is None or status is None:
+                return None
+            retest = status == -1
+            add = (status == 1) & (old_status != 1)
+            remove = (status == 0) & (old_status != 0)
+
+            result = np.array(mask, dtype=bool).ravel()
+            result[self._points(add)] = True
+            result[self._points(remove)] = False
+
+        candidates = self._points(retest)
+        if candidates.size > 0:
+            result[candidates] = roi.contains(x[candidates], y[candidates])
+
+        return result.reshape(self.shape)
+
+    def _points(self, cells):
+        """
+        The indices of the points in a subset of the non-empty cells
+
+        :param cells: Boolean array, with one element per non-empty cell
+        """
+        starts = self._starts[:-1][cells]
+        counts = np.diff(self._starts)[cells]
+        total = counts.sum()
+        if total == 0:
+            return self._order[:0]
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        return self._order[np.arange(total) + offsets]
+
+    def _classify(self, roi, x, y):
+        """
+        For each non-empty cell, return 1 if all points are inside the ROI,
+        0 if all points are outside, and -1 otherwise
+        """
+        if not roi.defined():
+            return None
+
+        if isinstance(roi, RectangularROI):
+            inside = ((self._xmin > roi.xmin) & (self._xmax < roi.xmax) &
+                      (self._ymin > roi.ymin) & (self._ymax < roi.ymax))
+            outside = ((self._xmax <= roi.xmin) | (self._xmin >= roi.xmax) |
+                       (self._ymax <= roi.ymin) | (self._ymin >= roi.ymax))
+        elif isinstance(roi, CircularROI):
+            r2 = roi.radius ** 2
+            far_x = np.maximum(abs(self._xmin - roi.xc),
+                               abs(self._xmax - roi.xc))
+            far_y = np.maximum(abs(self._ymin - roi.yc),
+                               abs(self._ymax - roi.yc))
+            near_x = np.maximum(np.maximum(self._xmin - roi.xc,
+                                           roi.xc - self._xmax), 0)
+            near_y = np.maximum(np.maximum(self._ymin - roi.yc,
+                                           roi.yc - self._ymax), 0)
+            inside = far_x ** 2 + far_y ** 2 < r2
+            outside = near_x ** 2 + near_y ** 2 >= r2
+        elif _edges(roi) is not None:
+            boundary = self._edge_cells(_edges(roi))
+            # cells not crossed by the outline are entirely inside or
+            # outside, so testing a single point is sufficient
+            first = self._order[self._starts[:-1]]
+            x, y = np.asarray(x).ravel(), np.asarray(y).ravel()
+            inside = roi.contains(x[first], y[first]) & ~boundary
+            outside = ~inside & ~boundary
+        else:
+            return None
+
+        status = np.zeros(self.ncells, dtype=np.int8) - 1
+        status[inside] = 1
+        status[outside] = 0
+        return status
+
+    def _edge_cells(self, edges):
+        """
+        Flag the non-empty cells that a set of line segments could pass
+        through.
+
+        Each segment is clipped to the grid (with a margin of one cell),
+        then sampled at intervals of half a cell, and the cells around each
+        sample are flagged, so that no crossed cell is missed. The number
+        of samples is bounded by the size of the grid, however long the
+        segments are.
+
+        :param edges: Iterable of ((x0, y0), (x1, y1)) segments
+        """
+        nbin = self.nbin
+        su, sv = [np.zeros(0)], [np.zeros(0)]
+        for (x0, y0), (x1, y1) in edges:
+            # work in units of cells
+            segment = _clip_segment((x0 - self.xlo) / self.dx,
+                                    (y0 - self.ylo) / self.dy,
+                                    (x1 - self.xlo) / self.dx,
+                                    (y1 - self.ylo) / self.dy,
+                                    -1, nbin + 1)
+            if segment is None:
+                continue
+            u0, v0, u1, v1 = segment
+            n = int(np.ceil(np.hypot(u1 - u0, v1 - v0) * 2)) + 1
+            su.append(np.linspace(u0, u1, n))
+            sv.append(np.linspace(v0, v1, n))
+        su, sv = np.hstack(su), np.hstack(sv)
+
+        # grid with a margin of 1 cell on each side
+        ix = np.floor(su).astype(np.int64).clip(-1, nbin) + 1
+        iy = np.floor(sv).astype(np.int64).clip(-1, nbin) + 1
+        grid = np.zeros((nbin + 3, nbin + 3), dtype=bool)
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                grid[(iy + di).clip(0), (ix + dj).clip(0)] = True
+
+        return grid[self._iy + 1, self._ix + 1]
+
+
+def _clip_segment(x0, y0, x1, y1, lo, hi):
+    """
+    Clip the segment from (x0, y0) to (x1, y1) to the square
+    [lo, hi] x [lo, hi] (Liang-Barsky algorithm)
+
+    :returns: The clipped segment as (x0, y0, x1, y1), or None if the
+              segment lies outside the square
+    """
+    dx, dy = x1 - x0, y1 - y0
+    t0, t1 = 0., 1.
+    for p, q in ((-dx, x0 - lo), (dx, hi - x0),
+                 (-dy, y0 - lo), (dy, hi - y0)):
+        if not np.isfinite(p) or not np.isfinite(q):
+            return None
+        if p == 0:
+            if q < 0:
+                return None
+            continue
+        t = q / p
+        if p < 0:
+            t0 = max(t0, t)
+        else:
+            t1 = min(t1, t)
+        if t0 > t1:
+            return None
+    return x0 + t0 * dx, y0 + t0 * dy, x0 + t1 * dx, y0 + t1 * dy
+
+
+def _edges(roi):
+    """
+    The edges of a rectangular or polygonal ROI, as a set of
+    ((x0, y0), (x1, y1)) segments. Returns None for other ROIs.
+
+    Edges that occur an even number of times are left out, since they
+    don't change which points are inside (containment follows the
+    even-odd rule).
+    """
+    if isinstance(roi, RectangularROI) and roi.defined():
+        vx = [roi.xmin, roi.xmax, roi.xmax, roi.xmin]
+        vy = [roi.ymin, roi.ymin, roi.ymax, roi.ymax]
+    elif isinstance(roi, PolygonalROI) and len(roi.vx) > 2:
+        vx, vy = roi.vx, roi.vy
+    else:
+        return None
+
+    points = [(float(px), float(py)) for px, py in zip(vx, vy)]
+    result = set()
+    for edge in zip(points, points[1:] + points[:1]):
+        result ^= set([tuple(sorted(edge))])
+    return result
+
+
+def spatial_index(data, xatt, yatt):
+    """
+    Fetch the :class:`GridIndex` for a pair of components in a dataset.
+
+    The index is built on first use, and cached until the numerical
+    values of the data change.
+
+    :returns: The index, or None if spatial indexing is disabled
+              (see :data:`glue.config.enable_spatial_index`) or the
+              dataset is too small to benefit from it.
+    """
+    if not enable_spatial_index() or data.size < MIN_INDEX_SIZE:
+        return None
+
+    key = (GridIndex, data, data_version(data), xatt, yatt)
+    result = index_cache.get(key)
+    if result is None:
+        result = GridIndex(data[xatt], data[yatt])
+        index_cache.set(key, result, owner=data)
+    return result
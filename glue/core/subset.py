@@ -6,7 +6,10 @@ import numbers
 import numpy as np
 
 from .visual import VisualAttributes, RED
-from .decorators import memoize
+from .cache import cached_mask, get_cached_mask
+from .spatial_index import spatial_index, INDEXED_ROIS
+from .sorted_index import sorted_index, inequality_bounds
+from .mask import DenseMask, IndexMask
 from .message import SubsetDeleteMessage, SubsetUpdateMessage
 from .exceptions import IncompatibleAttribute
 from .registry import Registry
@@ -26,6 +29,11 @@ OPSYM = {operator.ge: '>=', operator.gt: '>',
          operator.ne: '!='}
 SYMOP = dict((v, k) for k, v in OPSYM.items())
 
+#: States that select less than this fraction of a dataset, and can
+#: find the selected elements without a dense mask, produce index lists
+#: and compressed masks through sparse set operations
+SPARSE_FRACTION = 0.01
+
 
 class Subset(object):
 
@@ -161,6 +169,25 @@ class Subset(object):
     def _to_index_list_join(self):
         return np.where(self._to_mask_join(None).flat)[0]
 
+    def to_compressed_mask(self, format='indices'):
+        """
+        Convert the current subset to a mask in a compact format.
+
+        :param format: One of 'dense', 'indices', 'runs' or 'bits'.
+                       See :mod:`glue.core.mask`
+
+        Returns:
+           A :class:`~glue.core.mask.Mask` instance, for the entire
+           dataset.
+        """
+        try:
+            return self.subset_state.to_compressed_mask(self.data, format)
+        except IncompatibleAttribute as exc:
+            try:
+                return DenseMask(self._to_mask_join(None)).convert(format)
+            except IncompatibleAttribute:
+                raise exc
+
     def _to_mask_join(self, view):
         """Conver the subset to a mask through an entity join
            to another dataset. """
@@ -172,17 +199,13 @@ class Subset(object):
                 self.data._recursing = True
                 s2 = Subset(other)
                 s2.subset_state = self.subset_state
-                key_right = s2.to_mask()
+                key_right = s2.to_index_list()
             except IncompatibleAttribute:
                 continue
             finally:
                 self.data._recursing = False
 
-            key_left = self.data[cid1, view]
-            result = np.in1d(key_left.ravel(),
-                             other[cid2, key_right])
-
-            return result.reshape(key_left.shape)
+            return self.data._join_index(other).to_mask(key_right, view)
 
         raise IncompatibleAttribute
 
@@ -307,6 +330,8 @@ class Subset(object):
         :param view: View of the data. See data.__getitem__ for detils
         """
         c, v = split_component_view(view)
+        if v is None:  # avoid building a mask for the full dataset
+            return np.ravel(self.data[c])[self.to_index_list()]
         ma = self.to_mask(v)
         return self.data[view][ma]
 
@@ -386,13 +411,41 @@ class SubsetState(object):
 
     @contract(data='isinstance(Data)')
     def to_index_list(self, data):
-        return np.where(self.to_mask(data).flat)[0]
+        mask = self._sparse_mask(data)
+        if mask is not None:
+            return mask.to_indices()
+        return np.flatnonzero(self.to_mask(data))
 
     @contract(data='isinstance(Data)', view='array_view')
     def to_mask(self, data, view=None):
         shp = view_shape(data.shape, view)
         return np.zeros(shp, dtype=bool)
 
+    @contract(data='isinstance(Data)')
+    def to_compressed_mask(self, data, format='indices'):
+        """
+        Compute the mask of this state over a dataset, in a compact format
+
+        :param data: The dataset
+        :param format: One of 'dense', 'indices', 'runs' or 'bits'.
+                       See :mod:`glue.core.mask`
+        """
+        mask = self._sparse_mask(data)
+        if mask is None:
+            mask = DenseMask(self.to_mask(data))
+        return mask.convert(format)
+
+    def _sparse_mask(self, data):
+        """
+        Return the selection as a sparse :class:`~glue.core.mask.Mask`, if
+        it can be found without evaluating a dense mask and is selective
+        (see :data:`SPARSE_FRACTION`). Otherwise, return None.
+
+        Subclasses that hold or can cheaply compute sparse selections
+        should override this method.
+        """
+        return None
+
     @contract(returns='isinstance(SubsetState)')
     def copy(self):
         return SubsetState()
@@ -424,17 +477,49 @@ class RoiSubsetState(SubsetState):
         self.xatt = xatt
         self.yatt = yatt
         self.roi = roi
+        self._previous = None
 
     @property
     def attributes(self):
         return (self.xatt, self.yatt)
 
-    @memoize
+    def set_previous_state(self, state):
+        """
+        Record that this state replaces another one, e.g. after the ROI
+        is moved or reshaped.
+
+        If the previous state selects on the same attributes and its
+        mask is cached, :meth:`to_mask` only re-tests the points where
+        the two ROIs might disagree.
+        """
+        if (not isinstance(state, RoiSubsetState) or
+                state.attributes != self.attributes):
+            state = None
+        if state is not None:
+            state._previous = None
+        self._previous = state
+
+    @cached_mask
     @contract(data='isinstance(Data)', view='array_view')
     def to_mask(self, data, view=None):
         x = data[self.xatt, view]
         y = data[self.yatt, view]
-        result = self.roi.contains(x, y)
+
+        result = None
+        if view is None and isinstance(self.roi, INDEXED_ROIS):
+            index = spatial_index(data, self.xatt, self.yatt)
+            if index is not None:
+                previous = self._previous
+                if previous is not None:
+                    mask = get_cached_mask(previous, data)
+                    if mask is not None:
+                        result = index.update(mask, previous.roi, self.roi,
+                                              x, y)
+                if result is None:
+                    result = index.contains(self.roi, x, y)
+        if result is None:
+            result = self.roi.contains(x, y)
+
         assert x.shape == result.shape
         return result
 
@@ -443,6 +528,7 @@ class RoiSubsetState(SubsetState):
         result.xatt = self.xatt
         result.yatt = self.yatt
         result.roi = self.roi
+        result._previous = self._previous
         return result
 
 
@@ -460,10 +546,28 @@ class RangeSubsetState(SubsetState):
 
     @contract(data='isinstance(Data)', view='array_view')
     def to_mask(self, data, view=None):
+        index = self._sorted_index(data) if view is None else None
+        if index is not None and index.selective(self.lo, self.hi):
+            return index.mask(self.lo, self.hi)
+
         x = data[self.att, view]
         result = (x >= self.lo) & (x <= self.hi)
         return result
 
+    def _sparse_mask(self, data):
+        index = self._sorted_index(data, build=False)
+        if index is None or \
+                index.count(self.lo, self.hi) > SPARSE_FRACTION * index.size:
+            return None
+        return IndexMask.from_indices(data.shape,
+                                      index.indices(self.lo, self.hi))
+
+    def _sorted_index(self, data, build=True):
+        if not (isinstance(self.lo, numbers.Real) and
+                isinstance(self.hi, numbers.Real)):
+            return None
+        return sorted_index(data, self.att, build=build)
+
     def copy(self):
         return RangeSubsetState(self.lo, self.hi, self.att)
 
@@ -473,9 +577,9 @@ class CompositeSubsetState(SubsetState):
 
     def __init__(self, state1, state2=None):
         super(CompositeSubsetState, self).__init__()
-        self.state1 = state1.copy()
+        self.state1 = _copy_state(state1)
         if state2:
-            state2 = state2.copy()
+            state2 = _copy_state(state2)
         self.state2 = state2
 
     def copy(self):
@@ -488,12 +592,23 @@ class CompositeSubsetState(SubsetState):
             att += self.state2.attributes
         return tuple(sorted(set(att)))
 
-    @memoize
+    @cached_mask
     @contract(data='isinstance(Data)', view='array_view')
     def to_mask(self, data, view=None):
         return self.op(self.state1.to_mask(data, view),
                        self.state2.to_mask(data, view))
 
+    def _sparse_mask(self, data):
+        # set operations on sparse masks only beat the cached dense mask
+        # when both sides are already sparse
+        mask1 = self.state1._sparse_mask(data)
+        if mask1 is None:
+            return None
+        mask2 = self.state2._sparse_mask(data)
+        if mask2 is None:
+            return None
+        return self.op(mask1, mask2)
+
     def __str__(self):
         sym = OPSYM.get(self.op, self.op)
         return "(%s %s %s)" % (self.state1, sym, self.state2)
@@ -513,11 +628,15 @@ class XorState(CompositeSubsetState):
 
 class InvertState(CompositeSubsetState):
 
-    @memoize
+    @cached_mask
     @contract(data='isinstance(Data)', view='array_view')
     def to_mask(self, data, view=None):
         return ~self.state1.to_mask(data, view)
 
+    def _sparse_mask(self, data):
+        # the complement of a selective mask is not selective
+        return None
+
     def __str__(self):
         return "(~%s)" % self.state1
 
@@ -569,7 +688,7 @@ class CategorySubsetState(SubsetState):
         self._attribute = attribute
         self._values = np.asarray(values).ravel()
 
-    @memoize
+    @cached_mask
     def to_mask(self, data, view=None):
         vals = data[self._attribute, view]
         result = np.in1d(vals.ravel(), self._values)
@@ -594,15 +713,12 @@ class ElementSubsetState(SubsetState):
         super(ElementSubsetState, self).__init__()
         self._indices = indices
 
-    @memoize
+    @cached_mask
     def to_mask(self, data, view=None):
-        # XXX this is inefficient for views
-        result = np.zeros(data.shape, dtype=bool)
-        if self._indices is not None:
-            result.flat[self._indices] = True
-        if view is not None:
-            result = result[view]
-        return result
+        return IndexMask(data.shape, self._indices).to_dense(view)
+
+    def _sparse_mask(self, data):
+        return IndexMask(data.shape, self._indices)
 
     def copy(self):
         return ElementSubsetState(self._indices)
@@ -646,9 +762,20 @@ class InequalitySubsetState(SubsetState):
     def operator(self):
         return self._operator
 
-    @memoize
+    @cached_mask
     def to_mask(self, data, view=None):
-        from .data import ComponentID
+        if view is None:
+            index, bounds = self._sorted_index(data)
+            if index is not None and index.selective(*bounds):
+                return index.mask(*bounds)
+
+        # evaluate arithmetic on both sides and the comparison together
+        from .component_link import ComponentLink, _FusedKernel
+        if isinstance(self._left, ComponentLink) or \
+                isinstance(self._right, ComponentLink):
+            return _FusedKernel(self._left, self._right,
+                                self._operator).compute(data, view)
+
         left = self._left
         if not isinstance(self._left, numbers.Number):
             left = data[self._left, view]
@@ -659,6 +786,36 @@ class InequalitySubsetState(SubsetState):
 
         return self._operator(left, right)
 
+    def _sparse_mask(self, data):
+        index, bounds = self._sorted_index(data, build=False)
+        if index is None or \
+                index.count(*bounds) > SPARSE_FRACTION * index.size:
+            return None
+        return IndexMask.from_indices(data.shape, index.indices(*bounds))
+
+    def _sorted_index(self, data, build=True):
+        """
+        If this state compares a component with a number, return the
+        sorted index of the component and the selected interval.
+        Otherwise, return (None, None)
+
+        :param build: Whether to count this as a query of the component,
+                      building the index if needed. See
+                      :func:`~glue.core.sorted_index.sorted_index`
+        """
+        from .data import ComponentID
+
+        bounds = inequality_bounds(self._left, self._right, self._operator)
+        att = self._right if isinstance(self._left, numbers.Real) \
+            else self._left
+        if bounds is None or not isinstance(att, ComponentID):
+            return None, None
+
+        index = sorted_index(data, att, build=build)
+        if index is None:
+            return None, None
+        return index, bounds
+
     def copy(self):
         return InequalitySubsetState(self._left, self._right, self._operator)
 
@@ -676,3 +833,14 @@ def _combine(subsets, operator):
     result = Subset(None)
     result.subset_state = state
     return result
+
+
+def _copy_state(state):
+    """
+    Copy a subset state. The copy shares cached masks with the original,
+    so that combining an existing state with a new one does not
+    re-evaluate the existing state.
+    """
+    result = state.copy()
+    result._mask_origin = getattr(state, '_mask_origin', state)
+    return result
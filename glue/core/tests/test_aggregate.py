@@ -2,8 +2,12 @@ import numpy as np
 from numpy.testing import assert_allclose
 
 import pytest
+from mock import patch
 
+from ... import config
+from .. import aggregate
 from ..aggregate import Aggregate
+from ..cache import index_cache
 from .. import Data
 
 
@@ -139,3 +143,182 @@ def test_reverse_limits():
     a = Aggregate(d, 'a', 0, (0, 'y', 'x'), (3, 0))
     b = Aggregate(d, 'a', 0, (0, 'y', 'x'), (0, 3))
     assert_allclose(a.sum(), b.sum())
+
+
+class TestChunked(object):
+
+    """Chunked reductions in a thread pool match reductions in memory"""
+
+    def setup_method(self, method):
+        np.random.seed(12345)
+        a = np.random.normal(size=(3, 17, 4, 5))
+        a[1, 3, 2, 2] = np.nan
+        self.data = Data(a=a)
+        self.patches = [patch.object(aggregate, 'CHUNK_BYTES', 8 * 20 * 3),
+                        patch.object(aggregate, 'WORKERS', 2),
+                        patch.object(config.enable_collapse_cache, 'state',
+                                     False)]
+
+    def aggregate(self):
+        return Aggregate(self.data, 'a', 1, (1, 0, 'x', 'y'), (2, 16))
+
+    def test_chunks(self):
+        with self.patches[0]:
+            chunks = self.aggregate()._chunks()
+        assert chunks == [(2, 5), (5, 8), (8, 11), (11, 14), (14, 16)]
+
+    @pytest.mark.parametrize('func', [Aggregate.sum, Aggregate.mean,
+                                      Aggregate.max, Aggregate.argmax,
+                                      Aggregate.argmin, Aggregate.mom1,
+                                      Aggregate.mom2])
+    def test_matches_unchunked(self, func):
+        with self.patches[2]:
+            expected = func(self.aggregate())
+        for p in self.patches:
+            p.start()
+        try:
+            actual = func(self.aggregate())
+        finally:
+            for p in self.patches:
+                p.stop()
+        assert_allclose(actual, expected, rtol=1e-12)
+
+    @pytest.mark.parametrize('depth', [13, 14])
+    def test_approximate_median(self, depth):
+        a = self.data['a'][1, 2: 2 + depth].copy()
+        a[:, 2, 2] = np.nan
+        a[:5, 3, 3] = np.nan
+        a[:, 0, 0] = -3.5
+        a[0, 1, 1] = 1e30
+        data = Data(a=a)
+        with patch.object(aggregate, 'MAX_MEDIAN_BYTES', 0):
+            for p in self.patches:
+                p.start()
+            try:
+                actual = Aggregate(data, 'a', 0, (0, 'y', 'x'),
+                                   (0, depth)).median()
+            finally:
+                for p in self.patches:
+                    p.stop()
+
+        # lower median of the float32 values, with nans sorted last
+        srt = np.sort(a.astype(np.float32), axis=0)
+        expected = srt[(depth - 1) // 2]
+        assert_allclose(actual, expected, rtol=0)
+        assert np.isnan(actual[2, 2])
+        assert actual[0, 0] == -3.5
+
+    def test_zlim_clipped(self):
+        a = Aggregate(self.data, 'a', 1, (1, 0, 'y', 'x'), (5, 100))
+        assert_allclose(a.sum(), np.nansum(self.data['a'][1, 5:], axis=0))
+
+
+class TestPrefixSums(object):
+
+    def setup_method(self, method):
+        index_cache.clear()
+        np.random.seed(12345)
+        a = np.random.normal(size=(4, 30, 5, 6))
+        a[1, 3, 2, 2] = np.nan
+        self.data = Data(a=a)
+
+    def aggregate(self, zlim, slc=(1, 0, 'y', 'x')):
+        return Aggregate(self.data, 'a', 1, slc, zlim)
+
+    def expected(self, func, zlim, slc=(1, 0, 'y', 'x')):
+        with patch.object(config.enable_collapse_cache, 'state', False):
+            return func(self.aggregate(zlim, slc))
+
+    @pytest.mark.parametrize('func', Aggregate.incremental_operators())
+    def test_ranges(self, func):
+        # differences of cumulative sums are accurate to rounding of the
+        # totals, which the square root in mom2 amplifies near zero
+        for zlim in [(0, 30), (3, 4), (7, 21), (29, 30)]:
+            assert_allclose(func(self.aggregate(zlim)),
+                            self.expected(func, zlim), rtol=1e-10,
+                            atol=1e-5)
+
+    @pytest.mark.parametrize('cache', [True, False])
+    def test_float32_precision(self, cache):
+        # sums of float32 cubes with a large offset are accumulated in
+        # float64, whether or not they come from the cumulative sums
+        a = (1e5 + np.random.normal(size=(1, 2000, 4, 5))).astype(np.float32)
+        data = Data(a=a)
+        with patch.object(config.enable_collapse_cache, 'state', cache):
+            for zlim in [(0, 2000), (1000, 1003), (1999, 2000)]:
+                agg = Aggregate(data, 'a', 1, (0, 0, 'y', 'x'), zlim)
+                expected = a[0, zlim[0]:zlim[1]].astype(np.float64)
+                assert_allclose(agg.sum(), expected.sum(axis=0), rtol=1e-12)
+                assert_allclose(agg.mean(), expected.mean(axis=0),
+                                rtol=1e-12)
+
+    def test_built_once_per_plane(self):
+        with patch.object(Aggregate, '_read',
+                          side_effect=Aggregate._read,
+                          autospec=True) as read:
+            self.aggregate((3, 10)).sum()
+            assert read.call_count > 0
+            read.reset_mock()
+            self.aggregate((5, 20)).mean()
+            self.aggregate((1, 2), (1, 0, 'x', 'y')).sum()
+            assert read.call_count == 0
+
+            # other planes through the cube have their own sums
+            self.aggregate((5, 20), (2, 0, 'y', 'x')).sum()
+            assert read.call_count > 0
+        assert len(index_cache) == 2
+
+    def test_transpose(self):
+        actual = self.aggregate((2, 9), (1, 0, 'x', 'y')).mom1()
+        assert_allclose(actual, self.aggregate((2, 9)).mom1().T)
+
+    def test_update_invalidates(self):
+        self.aggregate((0, 5)).sum()
+        a = self.data['a'] * 2
+        self.data.update_components({self.data.id['a']: a})
+        assert_allclose(self.aggregate((0, 5)).sum(),
+                        np.nansum(a[1, :5], axis=0))
+
+    def test_infinite_values_not_cached(self):
+        a = self.data['a'].copy()
+        a[1, 2, 0, 0] = np.inf
+        self.data = Data(a=a)
+        actual = self.aggregate((3, 9)).sum()
+        assert_allclose(actual, np.nansum(a[1, 3:9], axis=0))
+        assert self.aggregate((3, 9))._prefix_sums('values') is None
+
+    def test_too_large(self):
+        with patch.object(index_cache, '_max_bytes', 1000):
+            assert self.aggregate((3, 9))._prefix_sums('values') is None
+            assert_allclose(self.aggregate((3, 9)).sum(),
+                            np.nansum(self.data['a'][1, 3:9], axis=0))
+        assert len(index_cache) == 0
+
+    @pytest.mark.parametrize('func', Aggregate.incremental_operators())
+    def test_checkpoints(self, func):
+        # the sums of every plane do not fit in the cache, so they are
+        # kept every few planes
+        with patch.object(index_cache, '_max_bytes', 8000):
+            for zlim in [(0, 30), (3, 4), (7, 21), (6, 29), (29, 30)]:
+                assert_allclose(func(self.aggregate(zlim)),
+                                self.expected(func, zlim), rtol=1e-10,
+                                atol=1e-5)
+            assert self.aggregate((0, 30))._prefix_sums('values').step > 1
+
+    def test_checkpoints_avoid_full_pass(self):
+        planes = []
+        original = Aggregate._read
+
+        def read(self, attribute, zlim):
+            planes.append(zlim[1] - zlim[0])
+            return original(self, attribute, zlim)
+
+        with patch.object(index_cache, '_max_bytes', 8000):
+            self.aggregate((0, 30)).sum()
+            step = self.aggregate((0, 30))._prefix_sums('values').step
+            assert step == 5
+
+            with patch.object(Aggregate, '_read', read):
+                actual = self.aggregate((7, 21)).mean()
+        assert 0 < sum(planes) <= 2 * step
+        assert_allclose(actual, self.expected(Aggregate.mean, (7, 21)))
@@ -0,0 +1,102 @@
+# pylint: disable=I0011,W0613,W0201,W0212,E1101,E1103
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+from mock import patch
+from numpy.testing import assert_allclose
+
+from .. import aperture
+from ..aperture import aperture_spectra, rectangle_aperture
+from ..data import Data
+
+
+def reference(cube, mask, weights=None):
+    # cube has axes (z, y, x)
+    weights = mask if weights is None else weights
+    finite = np.isfinite(cube)
+    total = np.where(finite, cube * weights, 0).sum(axis=(1, 2))
+    return total / (finite * weights).sum(axis=(1, 2))
+
+
+class TestApertureSpectra(object):
+
+    def setup_method(self, method):
+        np.random.seed(12345)
+        self.cube = np.random.random((7, 6, 5))
+        self.cube[2, 1, 1] = np.nan
+        self.data = Data(x=self.cube)
+        self.slc = (0, 'y', 'x')
+
+    def spectra(self, apertures, slc=None, zaxis=0):
+        return aperture_spectra(self.data, self.data.id['x'], apertures,
+                                slc or self.slc, zaxis)
+
+    def test_mask(self):
+        mask = self.cube[0] > .5
+        actual, = self.spectra([mask])
+        assert_allclose(actual, reference(self.cube, mask))
+
+    def test_weights(self):
+        weights = np.random.random((6, 5))
+        weights[0] = 0
+        actual, = self.spectra([weights])
+        assert_allclose(actual, reference(self.cube, weights != 0, weights))
+
+    def test_several_apertures(self):
+        masks = [self.cube[0] > .5, self.cube[0] <= .5,
+                 np.zeros((6, 5), dtype=bool)]
+        actual = self.spectra(masks)
+        assert actual.shape == (3, 7)
+        assert_allclose(actual[0], reference(self.cube, masks[0]))
+        assert_allclose(actual[1], reference(self.cube, masks[1]))
+        assert np.isnan(actual[2]).all()
+
+    def test_chunked(self):
+        mask = self.cube[0] > .5
+        expected, = self.spectra([mask])
+        with patch.object(aperture, 'CHUNK_BYTES', 8 * 30 * 2):
+            with patch.object(Data, '__getitem__', autospec=True,
+                              side_effect=Data.__getitem__) as getitem:
+                actual, = self.spectra([mask])
+        assert getitem.call_count == 4
+        assert_allclose(actual, expected)
+
+    def test_no_finite_values(self):
+        cube = self.cube.copy()
+        cube[:, 2, 3] = np.nan
+        data = Data(x=cube)
+        mask = np.zeros((6, 5), dtype=bool)
+        mask[2, 3] = True
+        actual = aperture_spectra(data, data.id['x'], [mask], self.slc, 0)
+        assert np.isnan(actual).all()
+
+    def test_axis_order(self):
+        # plane axes in data order are (z, x) for a cube sliced along y
+        cube = np.random.random((4, 3, 5))
+        data = Data(x=cube)
+        mask = cube[:, 0, :] > .3
+        actual, = aperture_spectra(data, data.id['x'], [mask],
+                                   ('x', 1, 'y'), 1)
+        expected = reference(cube.transpose(1, 0, 2), mask)
+        assert_allclose(actual, expected)
+
+    def test_4d(self):
+        cube = np.random.random((3, 4, 5, 6))
+        data = Data(x=cube)
+        mask = np.ones((5, 6), dtype=bool)
+        actual, = aperture_spectra(data, data.id['x'], [mask],
+                                   (2, 0, 'y', 'x'), 1)
+        assert_allclose(actual, cube[2].mean(axis=(1, 2)))
+
+
+def test_rectangle_aperture():
+    mask = rectangle_aperture((3, 4, 5), (0, 'x', 'y'), (1, 3), (0, 2))
+    expected = np.zeros((4, 5), dtype=bool)
+    expected[1:3, 0:2] = True
+    np.testing.assert_array_equal(mask, expected)
+
+    mask = rectangle_aperture((3, 4, 5), (0, 'y', 'x'), (1, 3), (0, 2))
+    expected = np.zeros((4, 5), dtype=bool)
+    expected[0:2, 1:3] = True
+    np.testing.assert_array_equal(mask, expected)
@@ -0,0 +1,173 @@
+# pylint: disable=I0011,W0613,W0201,W0212,E1101,E1103
+
+from __future__ import absolute_import, division, print_function
+
+import pytest
+import numpy as np
+from mock import patch
+
+from ..cache import ArrayCache, view_key, mask_cache, component_cache
+from ..component_link import ComponentLink
+from ..data import Data, ComponentID
+from ..roi import RectangularROI
+from ..subset import RoiSubsetState
+
+
+class TestArrayCache(object):
+
+    def setup_method(self, method):
+        self.cache = ArrayCache(max_bytes=100)
+
+    def test_get_set(self):
+        x = np.zeros(10, dtype=np.uint8)
+        self.cache.set('a', x)
+        assert self.cache.get('a') is x
+        assert self.cache.get('b') is None
+        assert self.cache.hits == 1
+        assert self.cache.misses == 1
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set('a', np.zeros(40, dtype=np.uint8))
+        self.cache.set('b', np.zeros(40, dtype=np.uint8))
+        self.cache.get('a')
+        self.cache.set('c', np.zeros(40, dtype=np.uint8))
+        assert 'a' in self.cache
+        assert 'b' not in self.cache
+        assert 'c' in self.cache
+        assert self.cache.nbytes == 80
+
+    def test_oversized_entry_not_stored(self):
+        self.cache.set('a', np.zeros(101, dtype=np.uint8))
+        assert 'a' not in self.cache
+        assert self.cache.nbytes == 0
+
+    def test_shrink_budget(self):
+        self.cache.set('a', np.zeros(40, dtype=np.uint8))
+        self.cache.set('b', np.zeros(40, dtype=np.uint8))
+        self.cache.max_bytes = 50
+        assert len(self.cache) == 1
+        assert 'b' in self.cache
+
+    def test_invalidate_owner(self):
+        o1, o2 = object(), object()
+        self.cache.set('a', np.zeros(10), owner=o1)
+        self.cache.set('b', np.zeros(1), owner=o2)
+        self.cache.invalidate(o1)
+        assert 'a' not in self.cache
+        assert 'b' in self.cache
+        assert self.cache.nbytes == 8
+
+
+def test_view_key():
+    assert view_key(None) is None
+    assert view_key(3) == 3
+    assert view_key((slice(0, 3), 1)) == (('slice', 0, 3, None), 1)
+    assert hash(view_key((slice(None, None, 2), Ellipsis)))
+    with pytest.raises(TypeError):
+        view_key(np.array([True, False]))
+
+
+class TestMaskCache(object):
+
+    def setup_method(self, method):
+        mask_cache.clear()
+        self.data = Data(x=[1, 2, 3], y=[2, 3, 4])
+        self.d2 = Data(x=[1, 2, 3], y=[2, 3, 4])
+        roi = RectangularROI(xmin=1.5, xmax=3.5, ymin=0, ymax=10)
+        self.state = RoiSubsetState(self.data.id['x'], self.data.id['y'], roi)
+        self.state2 = RoiSubsetState(self.d2.id['x'], self.d2.id['y'], roi)
+
+    def test_hits_and_misses(self):
+        m1 = self.state.to_mask(self.data)
+        m2 = self.state.to_mask(self.data)
+        assert m1 is m2
+        assert mask_cache.misses == 1
+        assert mask_cache.hits == 1
+
+    def test_views_cached_separately(self):
+        m = self.state.to_mask(self.data, slice(0, 2))
+        np.testing.assert_array_equal(m, [False, True])
+        self.state.to_mask(self.data, slice(0, 2))
+        assert mask_cache.hits == 1
+        np.testing.assert_array_equal(self.state.to_mask(self.data),
+                                      [False, True, True])
+
+    def test_combined_state_reuses_cached_mask(self):
+        self.state.to_mask(self.data)
+        other = RoiSubsetState(self.data.id['x'], self.data.id['y'],
+                               RectangularROI(xmin=0, xmax=1.5,
+                                              ymin=0, ymax=10))
+        combined = other | self.state
+        with patch.object(RectangularROI, 'contains',
+                          wraps=other.roi.contains) as contains:
+            np.testing.assert_array_equal(combined.to_mask(self.data),
+                                          [True, True, True])
+        assert contains.call_count == 1
+
+    def test_fancy_views_not_cached(self):
+        view = np.array([True, False, True])
+        np.testing.assert_array_equal(self.state.to_mask(self.data, view),
+                                      [False, True])
+        assert len(mask_cache) == 0
+
+    def test_update_invalidates_only_changed_data(self):
+        self.state.to_mask(self.data)
+        self.state2.to_mask(self.d2)
+        assert len(mask_cache) == 2
+
+        self.data.update_components({self.data.id['x']: [3, 2, 1]})
+        assert len(mask_cache) == 1
+        np.testing.assert_array_equal(self.state.to_mask(self.data),
+                                      [True, True, False])
+        self.state2.to_mask(self.d2)
+        assert mask_cache.hits == 1
+
+
+class TestComponentCache(object):
+
+    def setup_method(self, method):
+        component_cache.clear()
+        self.data = Data(x=np.arange(12).reshape((3, 4)))
+        self.calls = []
+
+        def double(x):
+            self.calls.append(x.shape)
+            return x * 2
+
+        def plus_one(y):
+            self.calls.append(y.shape)
+            return y + 1
+
+        self.y = ComponentID('y')
+        self.z = ComponentID('z')
+        self.data.add_component_link(ComponentLink([self.data.id['x']],
+                                                   self.y, using=double))
+        self.data.add_component_link(ComponentLink([self.y], self.z,
+                                                   using=plus_one))
+
+    def test_chain_computes_only_view(self):
+        result = self.data[self.z, 1]
+        np.testing.assert_array_equal(result, np.arange(4, 8) * 2 + 1)
+        assert self.calls == [(4,), (4,)]
+
+    def test_results_cached(self):
+        self.data[self.z, 1]
+        self.data[self.z, 1]
+        assert len(self.calls) == 2
+
+        # intermediate result is reused
+        self.data[self.y, 1]
+        assert len(self.calls) == 2
+
+    def test_views_served_from_full_result(self):
+        self.data[self.z]
+        assert len(self.calls) == 2
+        np.testing.assert_array_equal(self.data[self.z, :, 1],
+                                      [3, 11, 19])
+        assert len(self.calls) == 2
+
+    def test_update_invalidates(self):
+        self.data[self.z]
+        self.data.update_components({self.data.id['x']: np.zeros((3, 4))})
+        np.testing.assert_array_equal(self.data[self.z], np.ones((3, 4)))
+        assert len(self.calls) == 4
@@ -10,7 +10,7 @@ import numpy as np
 
 from ..data import (Component, ComponentID, Data,
                     DerivedComponent, CoordinateComponent,
-                    CategoricalComponent)
+                    CategoricalComponent, LazyComponent)
 from ... import core
 
 
@@ -224,6 +224,58 @@ class TestCoordinateComponent(object):
         np.testing.assert_array_equal(self.wz[view], z[view] * 3)
 
 
+class TestSeparableCoordinateComponent(object):
+
+    def setup_method(self, method):
+        calls = self.calls = []
+
+        class SeparableCoords(core.coordinates.Coordinates):
+
+            def pixel2world(self, *args):
+                calls.append(args[0].shape)
+                x, y, z = args
+                return x + y, x - y, z * 2
+
+            def dependent_axes(self, axis):
+                return (0,) if axis == 0 else (1, 2)
+
+        data = core.Data()
+        data.add_component(Component(np.zeros((5, 3, 4))), 'test')
+        data.coords = SeparableCoords()
+        self.data = data
+        self.wz = CoordinateComponent(data, 0, world=True)
+        self.wx = CoordinateComponent(data, 2, world=True)
+
+    def test_values(self):
+        z, y, x = np.mgrid[0:5, 0:3, 0:4]
+        np.testing.assert_array_equal(self.wz.data, z * 2)
+        np.testing.assert_array_equal(self.wx.data, x + y)
+
+    @pytest.mark.parametrize(('view'), VIEWS + (np.s_[..., 1],
+                                                (np.array([0, 2]),)))
+    def test_view(self, view):
+        z, y, x = np.mgrid[0:5, 0:3, 0:4]
+        np.testing.assert_array_equal(self.wz[view], (z * 2)[view])
+        np.testing.assert_array_equal(self.wx[view], (x + y)[view])
+
+    def test_only_dependent_axes_evaluated(self):
+        self.wz.data
+        assert self.calls == [(5,)]
+        self.wx[1]
+        assert self.calls == [(5,), (3, 4)]
+
+    def test_cached(self):
+        self.wz.data
+        self.wz[:, 1]
+        assert len(self.calls) == 1
+
+    def test_new_coords_invalidate(self):
+        self.wz.data
+        self.data.coords = core.coordinates.Coordinates()
+        z = np.mgrid[0:5, 0:3, 0:4][0]
+        np.testing.assert_array_equal(self.wz.data, z)
+
+
 def check_binary(result, left, right, op):
     assert isinstance(result, core.subset.InequalitySubsetState)
     assert result.left is left
@@ -292,6 +344,53 @@ def test_view(view):
     np.testing.assert_array_equal(comp[view], comp.data[view])
 
 
+class SliceRecorder(object):
+    """Array-like source which, like an h5py Dataset, only supports
+    positive-step slicing, and records which views are read"""
+
+    def __init__(self, array):
+        self.array = array
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self.reads = []
+
+    def __getitem__(self, view):
+        for v in view if isinstance(view, tuple) else (view,):
+            if isinstance(v, slice) and (v.step or 1) < 0:
+                raise ValueError("Step must be >= 1")
+        self.reads.append(view)
+        return self.array[view].copy()
+
+
+@pytest.mark.parametrize(('view'), VIEWS)
+def test_view_lazy(view):
+    source = SliceRecorder(np.array([[1, 2, 3], [2, 3, 4]]))
+    comp = LazyComponent(source)
+    np.testing.assert_array_equal(comp[view], source.array[view])
+    assert comp.shape == (2, 3)
+    assert comp.numeric
+
+
+def test_lazy_reads_only_view():
+    source = SliceRecorder(np.arange(24).reshape((2, 3, 4)))
+    d = core.Data()
+    cid = d.add_component(LazyComponent(source), 'x')
+    source.reads = []
+
+    np.testing.assert_array_equal(d[cid, 1, :, 0:2], source.array[1, :, 0:2])
+    assert source.reads == [(1, slice(None), slice(0, 2))]
+    assert not d[cid, 1].flags['WRITEABLE']
+
+
+def test_lazy_update_components():
+    source = SliceRecorder(np.array([1, 2, 3]))
+    d = core.Data()
+    cid = d.add_component(LazyComponent(source), 'x')
+    d.update_components({cid: [4, 5, 6]})
+    np.testing.assert_array_equal(d[cid], [4, 5, 6])
+    np.testing.assert_array_equal(d[cid, 1:], [5, 6])
+
+
 @pytest.mark.parametrize(('view'), VIEWS)
 def test_view_derived(view):
     comp = Component(np.array([[1, 2, 3], [2, 3, 4]]))
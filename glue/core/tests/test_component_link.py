@@ -2,11 +2,14 @@
 
 from __future__ import absolute_import, division, print_function
 
-import pytest
+import operator
 
+import pytest
 import numpy as np
-from numpy.testing import assert_array_equal
+from mock import patch
+from numpy.testing import assert_array_equal, assert_allclose
 
+from .. import component_link
 from ..data import ComponentID, Data, Component
 from ..component_link import ComponentLink, BinaryComponentLink
 from ..subset import InequalitySubsetState
@@ -287,3 +290,80 @@ def test_duplicated_links_remove_first_input():
     assert y not in d1.components
     assert x in d2.components
     assert x in d2.components
+
+
+class TestFusedKernel(object):
+
+    def setup_method(self, method):
+        np.random.seed(12345)
+        self.a = np.random.random((50, 40)) + 1
+        self.b = np.random.random((50, 40))
+        self.n = np.arange(2000).reshape((50, 40)) % 7
+        self.data = Data(a=self.a, b=self.b, n=self.n)
+        self.ida = self.data.id['a']
+        self.idb = self.data.id['b']
+        self.idn = self.data.id['n']
+
+    def test_shared_subexpressions(self):
+        a, b = self.ida, self.idb
+        expr = (a - b) / (a + b) ** 0.5 + (a - b) * (2 * 3)
+        kernel = component_link._FusedKernel(expr._left, expr._right,
+                                             expr._op)
+        assert len(kernel._inputs) == 2
+        # a - b, a + b, ** 0.5, /, * 6, +
+        assert len(kernel._code) == 6
+
+    @pytest.mark.parametrize('chunk_size', [7, 40, 130, 2 ** 16])
+    def test_chunked(self, chunk_size):
+        a, b, n = self.ida, self.idb, self.idn
+        expr = (a - b) / (a + b) ** 0.5 - 1 / (n + 1) + n * 2 + (a - b)
+        expected = ((self.a - self.b) / (self.a + self.b) ** 0.5 -
+                    1 / (self.n + 1) + self.n * 2 + (self.a - self.b))
+        with patch.object(component_link, 'CHUNK_SIZE', chunk_size):
+            result = self.data[expr]
+            assert_allclose(result, expected)
+            assert result.dtype == expected.dtype
+
+            view = (slice(3, 40, 2), slice(None, None, -3))
+            assert_allclose(self.data[expr, view], expected[view])
+
+    def test_integer_types(self):
+        n = self.idn
+        with patch.object(component_link, 'CHUNK_SIZE', 100):
+            result = self.data[(n * 3) ** 2 - n]
+            assert_array_equal(result, (self.n * 3) ** 2 - self.n)
+            assert result.dtype == self.n.dtype
+            result = self.data[n / 2 + 1]
+            assert_array_equal(result, self.n / 2 + 1)
+
+    def test_inputs_read_once(self):
+        a, b = self.ida, self.idb
+        with patch.object(Data, '__getitem__', autospec=True,
+                          side_effect=Data.__getitem__) as getitem:
+            self.data[(a * b + a) / (b - a * b)]
+        keys = [c[0][1] for c in getitem.call_args_list[1:]]
+        assert sorted(k[0].label for k in keys) == ['a', 'b']
+
+    def test_unknown_operator(self):
+        a = self.ida
+        link = BinaryComponentLink(a * 2, self.idb, np.maximum)
+        expr = link + 1
+        assert_array_equal(self.data[expr],
+                           np.maximum(self.a * 2, self.b) + 1)
+
+    def test_constant(self):
+        link = BinaryComponentLink(self.ida, 3, operator.mul)
+        link._left = 2
+        assert self.data[link] == 6
+
+    def test_inequality(self):
+        a, b = self.ida, self.idb
+        state = InequalitySubsetState((a - b) / (a + b), 0.2, operator.gt)
+        expected = (self.a - self.b) / (self.a + self.b) > 0.2
+        with patch.object(component_link, 'CHUNK_SIZE', 100):
+            mask = state.to_mask(self.data)
+            assert mask.dtype == bool
+            assert_array_equal(mask, expected)
+            view = (slice(5, 20), 3)
+            assert_array_equal(state.to_mask(self.data, view),
+                               expected[view])
@@ -322,6 +322,17 @@ class TestData(object):
             assert 'read-only' in exc.value
         assert not d['x'].flags['WRITEABLE']
 
+    def test_derived_and_coordinates_immutable(self):
+        d = Data(x=np.ones((3, 4)))
+        d.add_component_link(ComponentLink([d.id['x']], ComponentID('y'),
+                                           lambda x: x * 2))
+        for cid in [d.id['y'], d.get_pixel_component_id(1),
+                    d.get_world_component_id(0)]:
+            for view in [None, (slice(0, 2), 1)]:
+                with pytest.raises(ValueError):
+                    d[cid, view][...] = 5
+                d[cid, view].copy()[...] = 5  # copies can be modified
+
     def test_categorical_immutable(self):
         d = Data()
         c = CategoricalComponent(['M', 'M', 'F'], categories=['M', 'F'])
@@ -448,3 +459,43 @@ def test_add_binary_component():
     d.add_component(z, label='z')
 
     np.testing.assert_array_equal(d['z'], [3, 5, 7])
+
+
+class TestDependents(object):
+
+    def setup_method(self, method):
+        self.data = Data(x=[1, 2, 3], y=[2, 3, 4])
+        x, y = self.data.id['x'], self.data.id['y']
+        self.a = self.data.add_component(x + y, 'a')
+        self.b = self.data.add_component(self.data.id['a'] * 2, 'b')
+        self.c = self.data.add_component(y * 3, 'c')
+
+    def test_dependents(self):
+        x, y = self.data.id['x'], self.data.id['y']
+        assert self.data.dependents([x]) == set([self.a, self.b])
+        assert self.data.dependents([y]) == set([self.a, self.b, self.c])
+        assert self.data.dependents([self.b]) == set()
+
+    def test_remove_component(self):
+        self.data.remove_component(self.a)
+        assert self.data.dependents([self.data.id['x']]) == set()
+        assert self.data.dependents([self.a]) == set([self.b])
+
+    def test_replace_component(self):
+        x = self.data.id['x']
+        self.data.add_component(x * 5, self.c)
+        assert self.data.dependents([x]) == set([self.a, self.b, self.c])
+        assert self.data.dependents([self.data.id['y']]) == \
+            set([self.a, self.b])
+
+    def test_update_id(self):
+        self.data.hub = Hub(self.data)
+        x = self.data.id['x']
+        new = ComponentID('new')
+        self.data.update_id(x, new)
+        assert self.data.dependents([x]) == set()
+        assert self.data.dependents([new]) == set([self.a, self.b])
+
+        b = ComponentID('b2')
+        self.data.update_id(self.b, b)
+        assert self.data.dependents([self.a]) == set([b])
@@ -6,8 +6,9 @@ import numpy as np
 needs_modeling = pytest.mark.skipif("False", reason='')
 
 
+from ..data import Data
 from ..fitters import (PolynomialFitter, IntOption,
-                       BasicGaussianFitter)
+                       BasicGaussianFitter, fit_cube)
 
 from ...tests.helpers import requires_scipy, requires_astropy_ge_03, ASTROPY_GE_03_INSTALLED
 
@@ -200,3 +201,143 @@ class TestBasicGaussianFitter(object):
         expected = [3.67879441e-01, 1.83156389e-02, 1.23409804e-04]
         np.testing.assert_array_almost_equal(f.predict(r, [1, 2, 3]),
                                              expected)
+
+
+class TestBuildAndFitMany(object):
+
+    def setup_method(self, method):
+        np.random.seed(12345)
+        self.x = np.linspace(-5, 5, 20)
+        self.y = np.random.normal(size=(6, 20))
+
+    def test_polynomial_matches_single_fits(self):
+        f = PolynomialFitter(degree=2)
+        y = self.y.copy()
+        y[2, 3] = np.nan
+        y[4] = np.nan
+        results = f.build_and_fit_many(self.x, y)
+        assert len(results) == 6
+        assert results[4] is None
+        for i in [0, 1, 3, 5]:
+            np.testing.assert_allclose(results[i],
+                                       f.build_and_fit(self.x, y[i]))
+        good = np.isfinite(y[2])
+        np.testing.assert_allclose(results[2],
+                                   f.build_and_fit(self.x[good], y[2][good]))
+
+    def test_polynomial_single_solve(self):
+        f = PolynomialFitter(degree=1)
+        f.fit = MagicMock(wraps=f.fit)
+        f.build_and_fit_many(self.x, self.y, dy=np.ones(20))
+        assert f.fit.call_count == 1
+
+    def test_polynomial_errors_per_spectrum(self):
+        f = PolynomialFitter(degree=1)
+        dy = np.random.random((6, 20)) + 1
+        results = f.build_and_fit_many(self.x, self.y, dy=dy)
+        for y, d, r in zip(self.y, dy, results):
+            np.testing.assert_allclose(r, f.build_and_fit(self.x, y, d))
+
+    def test_process_pool(self):
+        f = PolynomialFitter(degree=1)
+        dy = np.random.random((6, 20)) + 1
+        expected = f.build_and_fit_many(self.x, self.y, dy=dy)
+        actual = f.build_and_fit_many(self.x, self.y, dy=dy, workers=2)
+        np.testing.assert_allclose(actual, expected)
+
+    def test_failed_fit(self):
+        f = PolynomialFitter(degree=1)
+        f.fit = MagicMock(side_effect=ValueError)
+        assert f.build_and_fit_many(self.x, self.y[:2],
+                                    dy=np.ones((2, 20))) == [None, None]
+
+    def test_parameters(self):
+        f = PolynomialFitter(degree=1)
+        assert f.parameters(np.array([2, 3])) == dict(c0=3, c1=2)
+
+
+@requires_scipy
+class TestBasicGaussianFitMany(object):
+
+    def test_seeded_from_previous(self):
+        f = BasicGaussianFitter()
+        x = np.linspace(-10, 10, 50)
+        means = np.linspace(-2, 2, 5)
+        y = np.array([2 * np.exp(-(x - m) ** 2 / 2) for m in means])
+
+        f.fit = MagicMock(wraps=f.fit)
+        results = f.build_and_fit_many(x, y)
+        for r, m in zip(results, means):
+            p = f.parameters(r)
+            np.testing.assert_allclose([p['amplitude'], p['mean'],
+                                        abs(p['stddev'])],
+                                       [2, m, 1], atol=1e-6)
+
+        seeds = [c[1]['constraints'] for c in f.fit.call_args_list]
+        assert seeds[0] == {}
+        np.testing.assert_allclose(seeds[1]['mean']['value'], means[0])
+
+
+@requires_astropy_ge_03
+class TestAstropySeed(object):
+
+    def test_seed_constraints(self):
+        f = SimpleAstropyGaussianFitter(amplitude=1, mean=2, stddev=3)
+        f.set_constraint('amplitude', fixed=True)
+        previous = f.build_and_fit([1, 2, 3], [2, 3, 2])
+        seeded = f.seed_constraints(f.constraints, previous)
+        assert seeded['amplitude'] == dict(value=1, fixed=True, limits=None)
+        assert seeded['mean']['value'] == previous[0].mean.value
+        assert f.constraints['mean']['value'] == 2
+
+    def test_parameters(self):
+        f = SimpleAstropyGaussianFitter(amplitude=1, mean=2, stddev=3)
+        result = f.build_and_fit([1, 2, 3], [2, 3, 2])
+        model = result[0]
+        assert f.parameters(result) == dict(amplitude=model.amplitude.value,
+                                            mean=model.mean.value,
+                                            stddev=model.stddev.value)
+
+
+class TestFitCube(object):
+
+    def setup_method(self, method):
+        z, y, x = np.mgrid[:10, :3, :4]
+        self.cube = 1. * z * y + x
+        self.data = Data(x=self.cube)
+
+    def test_maps(self):
+        f = PolynomialFitter(degree=1)
+        cids = fit_cube(f, self.data, self.data.id['x'], 0)
+        assert [c.label for c in cids] == ['x_c0', 'x_c1']
+        c0, c1 = self.data[cids[0]], self.data[cids[1]]
+        assert c0.shape == self.data.shape
+        yy, xx = np.mgrid[:3, :4]
+        np.testing.assert_allclose(c1[5], yy, atol=1e-10)
+        np.testing.assert_allclose(c0[0], xx, atol=1e-10)
+        np.testing.assert_array_equal(c1[0], c1[9])
+
+    def test_subset(self):
+        subset = self.data.new_subset()
+        subset.subset_state = self.data.id['x'] > 20
+        f = PolynomialFitter(degree=1)
+        cids = fit_cube(f, self.data, self.data.id['x'], 0, subset=subset,
+                        prefix='fit')
+        assert cids[0].label == 'fit_c0'
+        c1 = self.data[cids[1]][0]
+        fit = subset.to_mask().any(axis=0)
+        assert np.isnan(c1[~fit]).all()
+        np.testing.assert_allclose(c1[fit], np.mgrid[:3, :4][0][fit],
+                                   atol=1e-10)
+
+    def test_spectral_axis_last(self):
+        data = Data(x=np.rollaxis(self.cube, 0, 3))
+        subset = data.new_subset()
+        subset.subset_state = data.id['x'] > 20
+        f = PolynomialFitter(degree=1)
+        cids = fit_cube(f, data, data.id['x'], 2, subset=subset)
+        c1 = data[cids[1]][..., 0]
+        fit = subset.to_mask().any(axis=2)
+        assert np.isnan(c1[~fit]).all()
+        np.testing.assert_allclose(c1[fit], np.mgrid[:3, :4][0][fit],
+                                   atol=1e-10)
@@ -2,11 +2,19 @@
 
 from __future__ import absolute_import, division, print_function
 
+from functools import partial
+from timeit import timeit
+
 import pytest
-from mock import MagicMock
+import numpy as np
+from mock import MagicMock, patch
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 from ..exceptions import InvalidSubscriber, InvalidMessage
-from ..message import SubsetMessage, Message
+from ..message import (SubsetMessage, DataMessage, Message,
+                       SubsetCreateMessage, SubsetUpdateMessage,
+                       DataCollectionAddMessage)
 from ..hub import Hub, HubListener
 from ..subset import Subset
 from ..data import Data
@@ -149,6 +157,113 @@ class TestHub(object):
         self.hub.broadcast(msg_instance)
         subscriber.notify.assert_called_once_with(msg_instance)
 
+    def test_subscribe_after_broadcast(self):
+        msg, handler, subscriber = self.get_subscription()
+        self.hub.subscribe(subscriber, msg, handler)
+        self.hub.broadcast(SubsetMessage(Subset(None)))
+
+        handler2 = MagicMock()
+        self.hub.subscribe(subscriber, SubsetMessage, handler2)
+        msg_instance = SubsetMessage(Subset(None))
+        self.hub.broadcast(msg_instance)
+        handler2.assert_called_once_with(msg_instance)
+        assert handler.call_count == 1
+
+    def test_unsubscribe_during_broadcast(self):
+        msg, handler, subscriber = self.get_subscription()
+        subscriber2 = MagicMock(spec_set=HubListener)
+        handler2 = MagicMock()
+        handler.side_effect = lambda m: self.hub.unsubscribe_all(subscriber2)
+        self.hub.subscribe(subscriber, msg, handler)
+        self.hub.subscribe(subscriber2, msg, handler2)
+
+        self.hub.broadcast(msg("Test"))
+        assert handler.call_count == 1
+        assert handler2.call_count == 0
+
+    def test_broadcast_latency(self):
+        """
+        Broadcasting should not slow down as the number of subscribers
+        to unrelated messages grows
+        """
+
+        class Listener(HubListener):
+            def notify(self, message):
+                pass
+
+        def broadcast_time(nsubscribers):
+            hub = Hub()
+            for i in range(nsubscribers):
+                hub.subscribe(Listener(), DataMessage)
+            for i in range(10):
+                hub.subscribe(Listener(), SubsetMessage)
+            message = SubsetMessage(Subset(None))
+            return timeit(partial(hub.broadcast, message), number=200) / 200
+
+        for nsubscribers in [10, 100, 1000]:
+            assert broadcast_time(nsubscribers) < 1e-4  # set for Travis speed
+
+    def test_delay_callbacks(self):
+        msg, handler, subscriber = self.get_subscription()
+        self.hub.subscribe(subscriber, msg, handler)
+        subset = Subset(None)
+        with self.hub.delay_callbacks():
+            self.hub.broadcast(SubsetUpdateMessage(subset, attribute='style'))
+            self.hub.broadcast(SubsetUpdateMessage(subset, attribute='label'))
+            self.hub.broadcast(SubsetUpdateMessage(subset, attribute='style'))
+            self.hub.broadcast(SubsetUpdateMessage(Subset(None),
+                                                   attribute='style'))
+            assert handler.call_count == 0
+        assert handler.call_count == 3
+        assert [c[0][0].attribute for c in handler.call_args_list] == \
+            ['style', 'label', 'style']
+
+    def test_delay_callbacks_nested(self):
+        msg, handler, subscriber = self.get_subscription()
+        self.hub.subscribe(subscriber, msg, handler)
+        with self.hub.delay_callbacks():
+            with self.hub.delay_callbacks():
+                self.hub.broadcast(Message(None))
+            assert handler.call_count == 0
+        assert handler.call_count == 1
+        self.hub.broadcast(Message(None))
+        assert handler.call_count == 2
+
+    def test_delay_callbacks_error(self):
+        msg, handler, subscriber = self.get_subscription()
+        self.hub.subscribe(subscriber, msg, handler)
+        with pytest.raises(ValueError):
+            with self.hub.delay_callbacks():
+                self.hub.broadcast(Message(None))
+                raise ValueError()
+        assert handler.call_count == 1
+        self.hub.broadcast(Message(None))
+        assert handler.call_count == 2
+
+    def test_delay_callbacks_keeps_distinct_payloads(self):
+        msg, handler, subscriber = self.get_subscription()
+        self.hub.subscribe(subscriber, msg, handler)
+        dc = DataCollection()
+        d1, d2 = Data(label='d1'), Data(label='d2')
+        with self.hub.delay_callbacks():
+            for d in [d1, d2, d1]:
+                self.hub.broadcast(DataCollectionAddMessage(dc, d))
+        assert [c[0][0].data for c in handler.call_args_list] == [d1, d2]
+
+    def test_facet_subsets_redraw_once(self):
+        from ..util import facet_subsets
+
+        canvas = FigureCanvasAgg(Figure())
+        handler = MagicMock(side_effect=lambda msg: canvas.draw())
+        subscriber = MagicMock(spec_set=HubListener)
+
+        dc = DataCollection([Data(x=np.arange(100))])
+        dc.hub.subscribe(subscriber, SubsetCreateMessage, handler)
+        with patch.object(FigureCanvasAgg, 'draw') as draw:
+            facet_subsets(dc, dc[0].id['x'], steps=20)
+        assert handler.call_count == 20
+        assert draw.call_count == 1
+
     def test_autosubscribe(self):
         l = MagicMock(spec_set=HubListener)
         d = MagicMock(spec_set=Data)
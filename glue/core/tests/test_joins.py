@@ -1,3 +1,4 @@
+import numpy as np
 from numpy.testing import assert_array_equal
 import pytest
 
@@ -110,6 +111,57 @@ class TestSubsets(object):
             x.join_on_key(y, 'id1', 'bad_key')
         assert exc.value.args[0] == 'ComponentID not found in y: bad_key'
 
+    def test_join_with_view(self):
+        x = Data(id=[[0, 1, 2], [2, 3, 4]], label='x')
+        y = Data(id=[2, 3, 1], y=[1, 2, 3], label='y')
+        x.join_on_key(y, 'id', 'id')
+
+        s = x.new_subset()
+        s.subset_state = y.id['y'] > 1
+
+        assert_array_equal(s.to_mask(), [[False, True, False],
+                                         [False, True, False]])
+        assert_array_equal(s.to_mask((1,)), [False, True, False])
+        assert_array_equal(s.to_mask((slice(None), 0)), [False, False])
+
+    def test_join_index_reused(self):
+        x = Data(id=[0, 1, 2, 1], label='x')
+        y = Data(id=[1, 2, 5], y=[1, 2, 3], label='y')
+        x.join_on_key(y, 'id', 'id')
+
+        s = x.new_subset()
+        s.subset_state = y.id['y'] > 1
+        assert_array_equal(s.to_mask(), [False, False, True, False])
+        index = x._join_index(y)
+
+        s.subset_state = y.id['y'] < 2
+        assert_array_equal(s.to_mask(), [False, True, False, True])
+        assert x._join_index(y) is index
+
+    def test_join_index_invalidated(self):
+        x = Data(id=[0, 1, 2], label='x')
+        y = Data(id=[0, 1, 2], y=[1, 2, 3], label='y')
+        x.join_on_key(y, 'id', 'id')
+
+        s = x.new_subset()
+        s.subset_state = y.id['y'] > 2
+        assert_array_equal(s.to_mask(), [False, False, True])
+
+        y.update_components({y.id['id']: [2, 1, 0]})
+        assert_array_equal(s.to_mask(), [True, False, False])
+
+        x.update_components({x.id['id']: [0, 2, 2]})
+        assert_array_equal(s.to_mask(), [True, False, False])
+
+    def test_nan_keys_never_match(self):
+        x = Data(id=[0, np.nan, 2], label='x')
+        y = Data(id=[np.nan, 0, 2], y=[1, 2, 3], label='y')
+        x.join_on_key(y, 'id', 'id')
+
+        s = x.new_subset()
+        s.subset_state = y.id['y'] < 3
+        assert_array_equal(s.to_mask(), [True, False, False])
+
     def test_clone(self):
         x = Data(id=[0, 1, 2])
         y = Data(id=[0, 1, 2], x=[1, 2, 3])
@@ -10,6 +10,7 @@ from ..link_manager import (LinkManager, accessible_links, discover_links,
                             find_dependents)
 from ..data import ComponentID, DerivedComponent
 from ..data_collection import DataCollection
+from ..link_helpers import LinkSame
 
 comp = Component(data=np.array([1, 2, 3]))
 
@@ -240,3 +241,90 @@ class TestLinkManager(object):
         assert x not in d1.components
 
         np.testing.assert_array_equal(d1['z'], [8, 10, 12])
+
+
+class TestIncrementalUpdates(object):
+
+    def setup_method(self, method):
+        example_components(self, add_derived=False)
+        self.lm = LinkManager()
+        for link in self.links:
+            self.lm.add_link(link)
+        self.lm.update_data_components(self.data)
+
+    def test_up_to_date(self):
+        assert not self.lm.needs_update(self.data)
+
+    def test_unreachable_link(self):
+        self.lm.add_link(ComponentLink([self.cs[6]], self.cs[7], np.sqrt))
+        assert not self.lm.needs_update(self.data)
+
+    def test_reachable_link(self):
+        self.lm.add_link(ComponentLink([self.cs[4]], self.cs[7], np.sqrt))
+        assert self.lm.needs_update(self.data)
+        self.lm.update_data_components(self.data)
+        assert self.cs[7] in self.data.derived_components
+
+    def test_shorter_link(self):
+        link = ComponentLink([self.cs[0]], self.cs[4], np.sqrt)
+        self.lm.add_link(link)
+        assert self.lm.needs_update(self.data)
+        self.lm.update_data_components(self.data)
+        assert self.data.get_component(self.cs[4]).link is link
+
+    def test_remove_unused_link(self):
+        self.lm.remove_link(self.links[2])
+        assert not self.lm.needs_update(self.data)
+
+    def test_remove_used_link(self):
+        self.lm.remove_link(self.links[0])
+        assert self.lm.needs_update(self.data)
+
+    def test_primary_components_changed(self):
+        self.data.add_component(comp, self.cs[6])
+        assert self.lm.needs_update(self.data)
+
+    def test_merge_chain(self):
+        c9, c10 = ComponentID('c9'), ComponentID('c10')
+        self.lm.add_link(LinkSame(self.cs[6], c9))
+        self.lm.add_link(LinkSame(c9, c10))
+        assert not self.lm.needs_update(self.data)
+
+        other = Data()
+        other.add_component(comp, c10)
+        self.lm.update_data_components(other)
+        # merged into the first ID of the chain in one update
+        assert other.get_component(self.cs[6]) is other.get_component(c10)
+
+
+class TestLinkWebSetup(object):
+
+    """ Time to link many catalogs together """
+
+    def _make_collection(self, ndata):
+        datasets = [Data(ra=[1, 2, 3], dec=[2, 3, 4], label='d%i' % i)
+                    for i in range(ndata)]
+        dc = DataCollection(datasets)
+        for d1, d2 in zip(datasets[:-1], datasets[1:]):
+            dc.add_link(LinkSame(d1.id['ra'], d2.id['ra']))
+            dc.add_link(LinkSame(d1.id['dec'], d2.id['dec']))
+        return dc
+
+    def test_updates_scale_linearly(self):
+        from mock import patch
+        counts = []
+        for ndata in [25, 100]:
+            with patch.object(LinkManager, 'update_data_components',
+                              autospec=True,
+                              side_effect=LinkManager.update_data_components
+                              ) as update:
+                self._make_collection(ndata)
+            counts.append(update.call_count)
+        assert counts[1] <= 4 * counts[0] + 10
+
+    def test_setup_time(self):
+        from timeit import timeit
+        from functools import partial
+        # a generous bound, so that slow CI runners pass. Linking 100
+        # catalogs used to take minutes, and now takes well under a second
+        assert timeit(partial(self._make_collection, 100), number=1) < 10
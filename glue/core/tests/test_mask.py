@@ -0,0 +1,166 @@
+# pylint: disable=I0011,W0613,W0201,W0212,E1101,E1103
+
+from __future__ import absolute_import, division, print_function
+
+import operator
+
+import pytest
+import numpy as np
+from mock import patch
+
+from ..data import Data
+from ..mask import (DenseMask, IndexMask, RunLengthMask, BitMask,
+                    MASK_FORMATS, as_mask)
+from ..subset import ElementSubsetState, RangeSubsetState, OrState
+
+FORMATS = sorted(MASK_FORMATS)
+
+
+def example(seed, shape=(7, 11)):
+    np.random.seed(seed)
+    mask = np.random.random(shape) > 0.6
+    mask.flat[:5] = True  # a long run
+    return mask
+
+
+@pytest.mark.parametrize('format', FORMATS)
+def test_roundtrip(format):
+    dense = example(1)
+    mask = as_mask(dense).convert(format)
+    assert mask.format == format
+    assert mask.shape == dense.shape
+    assert mask.count() == dense.sum()
+    np.testing.assert_array_equal(mask.to_dense(), dense)
+    np.testing.assert_array_equal(mask.to_indices(), np.flatnonzero(dense))
+    for other in FORMATS:
+        np.testing.assert_array_equal(mask.convert(other).to_dense(), dense)
+
+
+@pytest.mark.parametrize('format', FORMATS)
+def test_empty_and_full(format):
+    for dense in [np.zeros((3, 5), dtype=bool), np.ones((3, 5), dtype=bool)]:
+        mask = as_mask(dense).convert(format)
+        np.testing.assert_array_equal(mask.to_dense(), dense)
+        np.testing.assert_array_equal((~mask).to_dense(), ~dense)
+        assert mask.any() == dense.any()
+
+
+@pytest.mark.parametrize(('format1', 'format2', 'op'),
+                         [(f1, f2, op) for f1 in FORMATS for f2 in FORMATS
+                          for op in (operator.and_, operator.or_,
+                                     operator.xor)])
+def test_combine(format1, format2, op):
+    d1, d2 = example(1), example(2)
+    m1 = as_mask(d1).convert(format1)
+    m2 = as_mask(d2).convert(format2)
+    result = op(m1, m2)
+    assert result.format == format1
+    np.testing.assert_array_equal(result.to_dense(), op(d1, d2))
+
+
+@pytest.mark.parametrize('format', FORMATS)
+def test_invert(format):
+    dense = example(3, shape=(13,))  # not a multiple of 8 elements
+    result = ~as_mask(dense).convert(format)
+    np.testing.assert_array_equal(result.to_dense(), ~dense)
+
+
+def test_combine_with_array():
+    d1, d2 = example(1), example(2)
+    result = IndexMask.from_dense(d1) | d2
+    np.testing.assert_array_equal(result.to_dense(), d1 | d2)
+
+
+def test_shape_mismatch():
+    with pytest.raises(ValueError) as exc:
+        IndexMask((3, 4)) & IndexMask((4, 3))
+    assert exc.value.args[0] == ("Cannot combine masks with shapes "
+                                 "(3, 4) and (4, 3)")
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError) as exc:
+        IndexMask((3,)).convert('sparse')
+    assert exc.value.args[0].startswith("Unknown mask format: sparse")
+
+
+def test_index_mask_normalizes_indices():
+    mask = IndexMask((2, 3), [5, 0, -1, 2, 0])
+    np.testing.assert_array_equal(mask.indices, [0, 2, 5])
+    with pytest.raises(IndexError):
+        IndexMask((2, 3), [6])
+
+
+@pytest.mark.parametrize('view', [(slice(None), 1), (1,), (slice(1, None, 2),
+                                  slice(None, None, -3)),
+                                  (Ellipsis, 2), (2, 3),
+                                  np.array([0, 2])])
+def test_index_mask_view(view):
+    dense = example(4, shape=(4, 5, 6))
+    result = IndexMask.from_dense(dense).to_dense(view)
+    np.testing.assert_array_equal(result, dense[view])
+
+
+def test_compact_formats_smaller():
+    dense = np.zeros(10000, dtype=bool)
+    dense[100:200] = True
+    dense[5000] = True
+    assert IndexMask.from_dense(dense).nbytes < dense.nbytes / 10
+    assert RunLengthMask.from_dense(dense).nbytes < 100
+    assert BitMask.from_dense(dense).nbytes == dense.nbytes / 8
+    assert DenseMask(dense).nbytes == dense.nbytes
+
+
+class TestSubsetStates(object):
+
+    def setup_method(self, method):
+        self.data = Data(x=np.arange(20).reshape((4, 5)))
+
+    def test_element_state(self):
+        state = ElementSubsetState([3, 7, 8])
+        mask = state.to_compressed_mask(self.data)
+        assert isinstance(mask, IndexMask)
+        np.testing.assert_array_equal(mask.indices, [3, 7, 8])
+        np.testing.assert_array_equal(state.to_mask(self.data, (1,)),
+                                      [False, False, True, True, False])
+
+    @pytest.mark.parametrize('format', FORMATS)
+    def test_composite_states(self, format):
+        x = self.data['x']
+        s1 = ElementSubsetState([3, 7, 8, 15])
+        s2 = RangeSubsetState(6, 16, self.data.id['x'])
+        for state in [s1 | s2, s1 & s2, s1 ^ s2, ~s1, s1 & ~s2]:
+            result = state.to_compressed_mask(self.data, format)
+            assert result.format == format
+            np.testing.assert_array_equal(result.to_dense(),
+                                          state.to_mask(self.data))
+        np.testing.assert_array_equal((s1 & s2).to_index_list(self.data),
+                                      [7, 8, 15])
+
+    def test_subset_getitem(self):
+        subset = self.data.new_subset()
+        subset.subset_state = ElementSubsetState([3, 7, 8])
+        np.testing.assert_array_equal(subset[self.data.id['x']], [3, 7, 8])
+        np.testing.assert_array_equal(subset[self.data.id['x'], 1], [7, 8])
+        assert subset.to_compressed_mask('runs').count() == 3
+
+    def test_index_list_dense_by_default(self):
+        # composites with a non-selective side use the (cached) dense mask
+        s1 = ElementSubsetState([3, 7, 8, 15])
+        s2 = RangeSubsetState(6, 16, self.data.id['x'])
+        state = s1 | s2
+        assert state._sparse_mask(self.data) is None
+        with patch.object(IndexMask, '_combine') as combine:
+            np.testing.assert_array_equal(state.to_index_list(self.data),
+                                          [3] + list(range(6, 17)))
+        assert combine.call_count == 0
+
+    def test_index_list_sparse_children(self):
+        # composites of sparse states never build a dense mask
+        state = ElementSubsetState([3, 7, 8]) | ElementSubsetState([8, 12])
+        with patch.object(OrState, 'to_mask') as to_mask:
+            np.testing.assert_array_equal(state.to_index_list(self.data),
+                                          [3, 7, 8, 12])
+            assert state.to_compressed_mask(self.data).count() == 4
+        assert to_mask.call_count == 0
+        assert (~state)._sparse_mask(self.data) is None
@@ -75,3 +75,25 @@ class TestPandasConversion(object):
         series = pd.Series(a.ravel())
 
         assert_series_equal(series, comp.to_series())
+
+    def test_Data_conversion_shares_memory(self):
+
+        x = np.arange(6.).reshape((2, 3))
+        d = Data(x=x, y=np.arange(6).reshape((2, 3)))
+        frame = d.to_dataframe(copy=False)
+        assert np.shares_memory(frame['x'].values, x)
+        assert np.shares_memory(frame['y'].values, d['y'])
+        np.testing.assert_array_equal(frame['y'], np.arange(6))
+        with pytest.raises(ValueError):
+            frame.loc[0, 'x'] = 10
+
+    def test_Data_conversion_copy(self):
+
+        x = np.arange(6.)
+        d = Data(x=x)
+        frame = d.to_dataframe()
+        assert not np.shares_memory(frame['x'].values, x)
+        frame.loc[0, 'x'] = 10
+        frame['x'] *= 2
+        assert frame['x'][0] == 20
+        assert d['x'][0] == 0
@@ -4,7 +4,7 @@ from __future__ import absolute_import, division, print_function
 
 import pytest
 import numpy as np
-from mock import MagicMock
+from mock import MagicMock, patch
 
 from ..data import ComponentID, Component, Data
 from ..subset import Subset
@@ -43,17 +43,12 @@ class TestParse(object):
         assert exc.value.args[0] == ("Tags from command not in "
                                      "reference mapping")
 
-    def test_dereference(self):
-        c1 = ComponentID('c1')
-        c2 = ComponentID('c2')
-        s1 = Subset(None, label='s1')
-        s2 = Subset(None, label='s2')
-        refs = dict([('c1', c1), ('c2', c2), ('s1', s1), ('s2', s2)])
-        cmd = '({c1} > 10) and {s1}'
-        expected = ('(data[references["c1"], __view] > 10) and '
-                    'references["s1"].to_mask(__view)')
-        result = parse._dereference(cmd, refs)
-        assert expected == result
+    def test_compile(self):
+        cmd = '({c1} > 10) and {s1} or { c1 } < 3'
+        compiled = parse._CompiledCommand(cmd, {})
+        assert compiled.variables == {'__ref0': 'c1', '__ref1': 's1'}
+        assert compiled.code.co_names == ('__ref0', '__ref1')
+        assert not compiled.elementwise
 
     def test_validate(self):
         ref = {'a': 1, 'b': 2}
@@ -202,3 +197,109 @@ class TestParsedSubsetState(object):
         expected = np.array([0, 1, 0, 0], dtype=bool)
 
         np.testing.assert_array_equal(result, expected)
+
+
+class TestCompiledCommand(object):
+
+    def setup_method(self, method):
+        from ... import env
+        self.patch = patch.object(env, 'np', np, create=True)
+        self.patch.start()
+        self.data = Data(g=np.arange(10.), h=np.arange(10.) % 3)
+        s = self.data.new_subset()
+        s.subset_state = self.data.id['g'] > 4
+        self.refs = {'g': self.data.id['g'], 'h': self.data.id['h'],
+                     's': s}
+
+    def teardown_method(self, method):
+        self.patch.stop()
+
+    def parsed(self, cmd):
+        return parse.ParsedCommand(cmd, self.refs)
+
+    @pytest.mark.parametrize(('cmd', 'expected'),
+                             [('{g} * 2 + {h}', True),
+                              ('np.sin({g}) > -{h} ** np.pi', True),
+                              ('{s} & ({g} < 6)', True),
+                              ('~{s} | np.isnan({g})', True),
+                              ('3', True),
+                              ('{g} > {g}.mean()', False),
+                              ('np.cumsum({g})', False),
+                              ('max({g}, 100)', False),
+                              ('{s} and {g}', False),
+                              ('1 < {g} < 5', False),
+                              ('{g}[::-1]', False),
+                              ('np.add({g}, 1, out={h})', False)])
+    def test_elementwise(self, cmd, expected):
+        assert self.parsed(cmd)._compile().elementwise is expected
+
+    def test_compiled_once(self):
+        p = self.parsed('{g} + {h}')
+        p.evaluate(self.data)
+        compiled = p._compiled
+        p.evaluate(self.data, view=slice(2, 4))
+        assert p._compiled is compiled
+
+    def test_reference_read_once(self):
+        data = MagicMock()
+        data.__getitem__.return_value = 5
+        p = parse.ParsedCommand('{g} + {g}', self.refs)
+        assert p.evaluate(data) == 10
+        data.__getitem__.assert_called_once_with((self.refs['g'], None))
+
+    def test_view_pushed_down(self):
+        view = slice(2, 8, 3)
+        p = self.parsed('{g} * 2 + {h}')
+        with patch.object(Data, '__getitem__', autospec=True,
+                          side_effect=Data.__getitem__) as getitem:
+            result = p.evaluate(self.data, view)
+        assert all(c[0][1][1] is view for c in getitem.call_args_list)
+        np.testing.assert_array_equal(result, (self.data['g'] * 2 +
+                                               self.data['h'])[view])
+
+    def test_view_pushed_down_not_elementwise(self):
+        view = slice(5, None)
+        p = self.parsed('{g} - np.cumsum({h})')
+        with patch.object(Data, '__getitem__', autospec=True,
+                          side_effect=Data.__getitem__) as getitem:
+            result = p.evaluate(self.data, view)
+        assert all(c[0][1][1] is view for c in getitem.call_args_list)
+        expected = self.data['g'][5:] - np.cumsum(self.data['h'][5:])
+        np.testing.assert_array_equal(result, expected)
+
+    def test_subset_state_reductions_global(self):
+        # the mask of the whole dataset is sliced, so the mean is
+        # computed over all the data
+        p = self.parsed('{g} > {g}.mean()')
+        state = parse.ParsedSubsetState(p)
+        np.testing.assert_array_equal(state.to_mask(self.data, slice(0, 6)),
+                                      [False] * 5 + [True])
+
+        # ParsedCommand evaluates the reduction over the view
+        np.testing.assert_array_equal(p.evaluate(self.data, slice(0, 6)),
+                                      [False] * 3 + [True] * 3)
+
+    def test_subset_state_view(self):
+        p = self.parsed('{s} & ({g} < 7)')
+        state = parse.ParsedSubsetState(p)
+        np.testing.assert_array_equal(state.to_mask(self.data, slice(4, 8)),
+                                      [False, True, True, False])
+
+    def test_chunked(self):
+        data = Data(g=np.random.random((40, 30)),
+                    h=np.arange(1200).reshape((40, 30)))
+        refs = {'g': data.id['g'], 'h': data.id['h']}
+        p = parse.ParsedCommand('np.sqrt({g}) * {h} + 1', refs)
+        expected = np.sqrt(data['g']) * data['h'] + 1
+        with patch.object(parse, 'CHUNK_SIZE', 100):
+            result = p.evaluate(data)
+            np.testing.assert_array_equal(result, expected)
+            assert result.dtype == expected.dtype
+            view = (slice(None, None, 3), slice(1, 20))
+            np.testing.assert_array_equal(p.evaluate(data, view),
+                                          expected[view])
+
+    def test_env_not_modified(self):
+        from ... import env
+        self.parsed('{g} + 1').evaluate(self.data, slice(1, 3))
+        assert '__view' not in vars(env)
@@ -0,0 +1,140 @@
+# pylint: disable=I0011,W0613,W0201,W0212,E1101,E1103
+
+from __future__ import absolute_import, division, print_function
+
+import pytest
+import numpy as np
+from mock import patch
+
+from ..cache import index_cache
+from ..data import Data, Component, LazyComponent
+from ..percentiles import (PercentileSketch, percentile_sketch,
+                           _ComponentSlabs)
+from .test_component import SliceRecorder
+
+PERCENTILES = [0, 0.1, 1, 5, 25, 50, 75, 95, 99, 99.9, 100]
+
+
+def datasets():
+    np.random.seed(12345)
+    normal = np.random.normal(size=300000)
+    hot = np.random.normal(size=300000)
+    hot[::1000] = 1e30
+    sparse = np.zeros(300000)
+    sparse[::97] = np.random.random(sparse[::97].size)
+    integer = np.random.randint(0, 50, 300000).astype(np.int16)
+    return [normal, hot, sparse, integer]
+
+
+class TestPercentileSketch(object):
+
+    @pytest.mark.parametrize('values', datasets())
+    def test_exact(self, values):
+        sketch = PercentileSketch(values, chunk_size=10000)
+        result = [sketch.percentile(p, exact=True) for p in PERCENTILES]
+        np.testing.assert_array_equal(result,
+                                      np.percentile(values, PERCENTILES))
+
+    @pytest.mark.parametrize('values', datasets())
+    def test_approximate(self, values):
+        sketch = PercentileSketch(values, nbins=1024, chunk_size=10000)
+        tolerance = 100 * 2. / sketch.nbins
+        srt = np.sort(values)
+        for p in PERCENTILES:
+            result = sketch.percentile(p)
+            # the result lies between the values at nearby percentiles
+            lo = np.percentile(srt, max(p - tolerance, 0))
+            hi = np.percentile(srt, min(p + tolerance, 100))
+            assert lo <= result <= hi
+
+    def test_small_arrays_exact(self):
+        values = np.arange(10.)
+        sketch = PercentileSketch(values)
+        assert sketch.percentile(50) == 4.5
+        assert sketch.percentile(5) == np.percentile(values, 5)
+
+    def test_non_finite_ignored(self):
+        values = np.array([np.nan, 3, np.inf, 1, 2, -np.inf])
+        sketch = PercentileSketch(values)
+        assert sketch.count == 3
+        assert sketch.percentile(0) == 1
+        assert sketch.percentile(50, exact=True) == 2
+        assert sketch.percentile(100) == 3
+
+    def test_empty(self):
+        sketch = PercentileSketch(np.array([np.nan, np.nan]))
+        assert np.isnan(sketch.percentile(50))
+        assert sketch.nbytes == 0
+
+    def test_constant(self):
+        sketch = PercentileSketch(np.ones(100000))
+        assert sketch.percentile(5) == 1
+        assert sketch.percentile(95, exact=True) == 1
+
+    def test_refinements_kept(self):
+        np.random.seed(0)
+        values = np.random.random(200000)
+        sketch = PercentileSketch(values, nbins=16)
+        sketch.max_collect = 100
+        nbytes = sketch.nbytes
+        assert sketch.percentile(37, exact=True) == np.percentile(values, 37)
+        assert sketch.nbytes > nbytes
+
+        # nearby percentiles reuse the refined histograms
+        nbytes = sketch.nbytes
+        assert (sketch.percentile(37.0001, exact=True) ==
+                np.percentile(values, 37.0001))
+        assert sketch.nbytes == nbytes
+
+
+class TestPercentileSketchCache(object):
+
+    def setup_method(self, method):
+        index_cache.clear()
+        self.data = Data(x=np.arange(100.))
+        self.data.add_component(Component(np.arange(100.) * 1j), 'z')
+
+    def test_cached(self):
+        sketch = percentile_sketch(self.data, self.data.id['x'])
+        assert percentile_sketch(self.data, self.data.id['x']) is sketch
+        assert len(index_cache) == 1
+
+    def test_unordered(self):
+        assert percentile_sketch(self.data, self.data.id['z']) is None
+
+    def test_update_invalidates(self):
+        sketch = percentile_sketch(self.data, self.data.id['x'])
+        self.data.update_components({self.data.id['x']: np.arange(100.) * 2})
+        assert len(index_cache) == 0
+        new = percentile_sketch(self.data, self.data.id['x'])
+        assert new is not sketch
+        assert new.percentile(100) == 198
+
+    def test_read_in_slabs(self):
+        data = Data(x=np.random.random((20, 30, 40)))
+        cid = data.add_component(data.id['x'] * 2, 'y')
+        with patch.object(Data, '__getitem__', autospec=True,
+                          side_effect=Data.__getitem__) as getitem:
+            sketch = PercentileSketch(_ComponentSlabs(data, cid),
+                                      chunk_size=2400)
+        views = [c[0][1][1] for c in getitem.call_args_list
+                 if c[0][1][0] is cid]
+        # slabs of two planes, read in one pass for the range of values
+        # and one for the histogram
+        assert len(views) == 20
+        assert all(v[0].stop - v[0].start == 2 and v[1:] == (slice(None),) * 2
+                   for v in views)
+        assert sketch.percentile(50, exact=True) == \
+            np.percentile(data['y'], 50)
+
+        sketch = percentile_sketch(data, cid)
+        assert sketch.percentile(50, exact=True) == \
+            np.percentile(data['y'], 50)
+
+    def test_lazy_not_read(self):
+        source = SliceRecorder(np.random.random((5, 10, 10)))
+        data = Data()
+        cid = data.add_component(LazyComponent(source), 'x')
+        source.reads = []
+        assert percentile_sketch(data, cid) is None
+        assert source.reads == []
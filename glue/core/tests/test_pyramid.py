@@ -0,0 +1,175 @@
+# pylint: disable=I0011,W0613,W0201,W0212,E1101,E1103
+
+from __future__ import absolute_import, division, print_function
+
+import pytest
+import numpy as np
+from mock import patch
+
+from ... import config
+from .. import pyramid as pyr
+from ..cache import index_cache
+from ..data import Data, LazyComponent
+from ..pyramid import ImagePyramid, image_pyramid, get_image_pyramid
+from .test_component import SliceRecorder
+
+
+def block_reduce(image, factor, func):
+    # reference implementation, for shapes that are multiples of factor
+    ny, nx = image.shape
+    blocks = image.reshape(ny // factor, factor, nx // factor, factor)
+    return func(func(blocks, axis=3), axis=1)
+
+
+class TestImagePyramid(object):
+
+    def setup_method(self, method):
+        np.random.seed(12345)
+        self.image = np.random.random((64, 128))
+
+    @pytest.mark.parametrize(('method', 'func'), [('mean', np.mean),
+                                                  ('max', np.max)])
+    def test_levels(self, method, func):
+        pyramid = ImagePyramid(self.image, method=method, min_size=16)
+        assert [l.shape for l in pyramid.levels] == [(64, 128), (32, 64),
+                                                     (16, 32), (8, 16)]
+        assert pyramid.levels[0] is self.image
+        for level in range(1, 4):
+            np.testing.assert_allclose(pyramid.levels[level],
+                                       block_reduce(self.image, 2 ** level,
+                                                    func))
+
+    def test_odd_shape_and_nan(self):
+        image = np.arange(15.).reshape((3, 5))
+        image[0, 0] = np.nan
+        image[2, 4] = np.nan
+        pyramid = ImagePyramid(image, min_size=2)
+        np.testing.assert_array_equal(pyramid.levels[1],
+                                      [[(1 + 5 + 6) / 3., 5, 6.5],
+                                       [10.5, 12.5, np.nan]])
+
+    def test_integer_image(self):
+        image = np.arange(16, dtype=np.int16).reshape((4, 4))
+        pyramid = ImagePyramid(image, min_size=2, method='max')
+        assert pyramid.levels[1].dtype == np.float32
+        np.testing.assert_array_equal(pyramid.levels[1], [[5, 7], [13, 15]])
+
+    def test_on_disk(self, tmpdir):
+        memory = ImagePyramid(self.image, min_size=16)
+        disk = ImagePyramid(self.image, min_size=16, cache_dir=str(tmpdir))
+        assert isinstance(disk.levels[1], np.memmap)
+        assert memory.nbytes == sum(l.nbytes for l in memory.levels)
+        assert disk.nbytes == self.image.nbytes  # only the original image
+        for l1, l2 in zip(memory.levels, disk.levels):
+            np.testing.assert_array_equal(l1, l2)
+
+    def test_invalid(self):
+        with pytest.raises(ValueError) as exc:
+            ImagePyramid(self.image, method='median')
+        assert exc.value.args[0] == "Unknown downsampling method: median"
+        with pytest.raises(ValueError):
+            ImagePyramid(np.zeros((3, 3, 3)))
+
+    @pytest.mark.parametrize(('step', 'level'), [(1, 0), (2, 1), (3, 1),
+                                                 (4, 2), (7, 2), (100, 3)])
+    def test_level_for_step(self, step, level):
+        pyramid = ImagePyramid(self.image, min_size=16)
+        assert pyramid.level_for_step(step) == level
+
+    def test_extract(self):
+        pyramid = ImagePyramid(self.image, min_size=16)
+        view = ('x', slice(8, 40, 4), slice(10, 127, 6))
+        image, equivalent = pyramid.extract(view)
+        np.testing.assert_array_equal(image,
+                                      pyramid.levels[2][2:10, 2:32])
+        assert equivalent == ('x', slice(8, 40, 4), slice(8, 128, 4))
+
+    def test_extract_full_resolution(self):
+        pyramid = ImagePyramid(self.image, min_size=16)
+        view = (slice(3, 10), 'x', slice(None, None, 1))
+        image, equivalent = pyramid.extract(view)
+        np.testing.assert_array_equal(image, self.image[3:10])
+        assert equivalent == (slice(3, 10, 1), 'x', slice(0, 128, 1))
+
+
+class TestDataPyramid(object):
+
+    def setup_method(self, method):
+        index_cache.clear()
+        self.data = Data(x=np.random.random((3, 40, 50)))
+        self.view = (self.data.id['x'], 1, slice(0, 40, 4), slice(0, 50, 4))
+        self.patches = [patch.object(pyr, 'MIN_PYRAMID_SIZE', 100),
+                        patch.object(config.enable_image_pyramid, 'state',
+                                     True)]
+        for p in self.patches:
+            p.start()
+
+    def teardown_method(self, method):
+        for p in self.patches:
+            p.stop()
+
+    def test_cached_per_plane(self):
+        assert get_image_pyramid(self.data, self.view) is None
+        pyramid = image_pyramid(self.data, self.view)
+        np.testing.assert_array_equal(pyramid.levels[0], self.data['x'][1])
+        assert get_image_pyramid(self.data, self.view) is pyramid
+        view = self.view[:2] + (slice(0, 40), slice(0, 50))
+        assert image_pyramid(self.data, view) is pyramid
+
+        other = (self.data.id['x'], 2) + self.view[2:]
+        assert image_pyramid(self.data, other) is not pyramid
+        assert len(index_cache) == 2
+
+    def test_disabled(self):
+        with patch.object(config.enable_image_pyramid, 'state', False):
+            assert image_pyramid(self.data, self.view) is None
+        assert len(index_cache) == 0
+
+    def test_small_plane(self):
+        with patch.object(pyr, 'MIN_PYRAMID_SIZE', 5000):
+            assert image_pyramid(self.data, self.view) is None
+
+    def test_update_invalidates(self):
+        image_pyramid(self.data, self.view)
+        x = self.data['x'] * 2
+        self.data.update_components({self.data.id['x']: x})
+        assert len(index_cache) == 0
+        pyramid = image_pyramid(self.data, self.view)
+        np.testing.assert_array_equal(pyramid.levels[0], x[1])
+
+    def test_full_resolution_not_copied(self):
+        source = SliceRecorder(np.random.random((2, 600, 300)))
+        data = Data()
+        cid = data.add_component(LazyComponent(source), 'x')
+        source.reads = []
+
+        view = (cid, 1, slice(0, 600, 4), slice(0, 300, 4))
+        with patch.object(pyr, '_CHUNK_ROWS', 16):
+            pyramid = image_pyramid(data, view)
+        assert len(pyramid.levels) == 3
+        assert not isinstance(pyramid.levels[0], np.ndarray)
+        assert pyramid.nbytes == sum(l.nbytes for l in pyramid.levels[1:])
+
+        # the full-resolution image is only read in blocks of rows
+        assert max(len(range(600)[r[1]]) for r in source.reads) == 32
+        np.testing.assert_array_equal(pyramid.levels[0], source.array[1])
+
+        source.reads = []
+        image, _ = pyramid.extract((cid, 1, slice(0, 10), slice(0, 20)))
+        np.testing.assert_array_equal(image, source.array[1, :10, :20])
+        assert source.reads == [(1, slice(0, 10, 1), slice(0, 20, 1))]
+
+    def test_over_cache_budget(self, tmpdir):
+        # pyramids too large for the memory budget are built on disk, and
+        # stay cached
+        with patch.object(index_cache, '_max_bytes', 100), \
+                patch.object(pyr, 'CACHE_DIR', str(tmpdir)), \
+                patch.object(pyr, '_CHUNK_ROWS', 4):
+            data = Data(x=np.random.random((600, 300)))
+            view = (data.id['x'], slice(0, 600, 4), slice(0, 300, 4))
+            pyramid = image_pyramid(data, view)
+            assert pyramid.on_disk
+            assert len(pyramid.levels) == 3
+            assert isinstance(pyramid.levels[1], np.memmap)
+            assert pyramid.nbytes == 0
+            assert get_image_pyramid(data, view) is pyramid
@@ -0,0 +1,162 @@
+# pylint: disable=I0011,W0613,W0201,W0212,E1101,E1103
+
+from __future__ import absolute_import, division, print_function
+
+import operator
+
+import pytest
+import numpy as np
+from mock import patch
+
+from ... import config
+from .. import sorted_index as sx
+from ..cache import index_cache
+from ..data import Data
+from ..sorted_index import SortedIndex, inequality_bounds
+from ..subset import RangeSubsetState, InequalitySubsetState
+
+
+class TestSortedIndex(object):
+
+    def setup_method(self, method):
+        np.random.seed(12345)
+        self.x = np.random.randint(0, 20, (40, 30)).astype(float)
+        self.x[0, :3] = [np.nan, np.inf, -np.inf]
+        self.index = SortedIndex(self.x)
+
+    @pytest.mark.parametrize(('lo', 'hi', 'lo_inc', 'hi_inc'),
+                             [(3, 7, True, True),
+                              (3, 7, False, False),
+                              (3, 3, True, True),
+                              (7, 3, True, True),
+                              (-np.inf, 5, True, False),
+                              (5, np.inf, False, True),
+                              (np.nan, 5, True, True)])
+    def test_matches_scan(self, lo, hi, lo_inc, hi_inc):
+        op_lo = operator.ge if lo_inc else operator.gt
+        op_hi = operator.le if hi_inc else operator.lt
+        expected = op_lo(self.x, lo) & op_hi(self.x, hi)
+
+        mask = self.index.mask(lo, hi, lo_inc, hi_inc)
+        np.testing.assert_array_equal(mask, expected)
+        np.testing.assert_array_equal(self.index.indices(lo, hi,
+                                                         lo_inc, hi_inc),
+                                      np.where(expected.flat)[0])
+        assert self.index.count(lo, hi, lo_inc, hi_inc) == expected.sum()
+
+    def test_integer_values(self):
+        x = np.arange(100) % 7
+        index = SortedIndex(x)
+        np.testing.assert_array_equal(index.mask(2, 4.5),
+                                      (x >= 2) & (x <= 4.5))
+
+
+@pytest.mark.parametrize('op', [operator.gt, operator.ge, operator.lt,
+                                operator.le, operator.eq])
+def test_inequality_bounds(op):
+    x = np.array([1., 2., 3.])
+    cid = object()
+    for left, right, expected in [(cid, 2, op(x, 2)), (2, cid, op(2, x))]:
+        lo, hi, lo_inc, hi_inc = inequality_bounds(left, right, op)
+        result = SortedIndex(x).mask(lo, hi, lo_inc, hi_inc)
+        np.testing.assert_array_equal(result, expected)
+
+
+def test_inequality_bounds_unsupported():
+    assert inequality_bounds(object(), object(), operator.gt) is None
+    assert inequality_bounds(1, 2, operator.gt) is None
+    assert inequality_bounds(object(), 2, operator.ne) is None
+
+
+class TestSubsetStateIndex(object):
+
+    def setup_method(self, method):
+        index_cache.clear()
+        np.random.seed(12345)
+        self.data = Data(x=np.random.random(5000), y=np.random.random(5000))
+        self.x = self.data['x']
+        self.patches = [patch.object(sx, 'MIN_INDEX_SIZE', 100),
+                        patch.object(sx, 'MIN_QUERIES', 0)]
+        for p in self.patches:
+            p.start()
+
+    def teardown_method(self, method):
+        for p in self.patches:
+            p.stop()
+
+    def test_range(self):
+        state = RangeSubsetState(0.2, 0.3, self.data.id['x'])
+        expected = (self.x >= 0.2) & (self.x <= 0.3)
+        np.testing.assert_array_equal(state.to_mask(self.data), expected)
+        np.testing.assert_array_equal(state.to_index_list(self.data),
+                                      np.where(expected)[0])
+        assert len(index_cache) == 1
+
+    def test_range_view_not_indexed(self):
+        state = RangeSubsetState(0.2, 0.3, self.data.id['x'])
+        np.testing.assert_array_equal(state.to_mask(self.data, slice(0, 10)),
+                                      (self.x[:10] >= 0.2) &
+                                      (self.x[:10] <= 0.3))
+        assert len(index_cache) == 0
+
+    def test_inequality(self):
+        state = 0.4 < self.data.id['x']
+        expected = self.x > 0.4
+        np.testing.assert_array_equal(state.to_mask(self.data), expected)
+        np.testing.assert_array_equal(state.to_index_list(self.data),
+                                      np.where(expected)[0])
+        assert len(index_cache) == 1
+
+    def test_component_comparison_not_indexed(self):
+        state = InequalitySubsetState(self.data.id['x'], self.data.id['y'],
+                                      operator.gt)
+        np.testing.assert_array_equal(state.to_mask(self.data),
+                                      self.x > self.data['y'])
+        assert len(index_cache) == 0
+
+    def test_disabled(self):
+        state = RangeSubsetState(0.2, 0.3, self.data.id['x'])
+        with patch.object(config.enable_sorted_index, 'state', False):
+            state.to_index_list(self.data)
+        assert len(index_cache) == 0
+
+    def test_update_invalidates(self):
+        state = RangeSubsetState(0.2, 0.3, self.data.id['x'])
+        state.to_index_list(self.data)
+        x = self.x + 0.1
+        self.data.update_components({self.data.id['x']: x})
+        assert len(index_cache) == 0
+        np.testing.assert_array_equal(state.to_index_list(self.data),
+                                      np.where((x >= 0.2) & (x <= 0.3))[0])
+
+    def test_built_after_repeated_queries(self):
+        state = RangeSubsetState(0.2, 0.3, self.data.id['x'])
+        with patch.object(sx, 'MIN_QUERIES', 2):
+            for expected in [0, 0, 1]:
+                state.to_mask(self.data)
+                assert len(index_cache) == expected
+
+    def test_sparse_mask_does_not_build(self):
+        state = RangeSubsetState(0.2, 0.205, self.data.id['x'])
+        assert state._sparse_mask(self.data) is None
+        assert len(index_cache) == 0
+        state.to_mask(self.data)
+        assert state._sparse_mask(self.data).count() == \
+            ((self.x >= 0.2) & (self.x <= 0.205)).sum()
+
+    def test_not_built_over_cache_budget(self):
+        state = RangeSubsetState(0.2, 0.3, self.data.id['x'])
+        with patch.object(index_cache, '_max_bytes', self.x.nbytes):
+            for i in range(3):
+                state.to_mask(self.data)
+        assert len(index_cache) == 0
+
+    def test_non_selective_range_scans(self):
+        RangeSubsetState(0.2, 0.3, self.data.id['x']).to_mask(self.data)
+        assert len(index_cache) == 1
+
+        state = RangeSubsetState(0.2, 0.9, self.data.id['x'])
+        with patch.object(SortedIndex, 'mask') as mask:
+            np.testing.assert_array_equal(state.to_mask(self.data),
+                                          (self.x >= 0.2) & (self.x <= 0.9))
+        assert mask.call_count == 0
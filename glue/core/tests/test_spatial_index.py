@@ -0,0 +1,213 @@
+# pylint: disable=I0011,W0613,W0201,W0212,E1101,E1103
+
+from __future__ import absolute_import, division, print_function
+
+import pytest
+import numpy as np
+from mock import patch
+
+from ... import config
+from .. import spatial_index as si
+from ..cache import index_cache
+from ..data import Data
+from ..roi import RectangularROI, CircularROI, PolygonalROI, XRangeROI
+from ..spatial_index import GridIndex, spatial_index
+from ..subset import RoiSubsetState
+
+
+def polygon():
+    # concave polygon, with vertices off the edge of the data
+    return PolygonalROI(vx=[-0.5, 0.3, 0.1, 0.6, 1.4, 0.5],
+                        vy=[0.2, -0.2, 0.5, 0.9, 0.4, 0.3])
+
+
+ROIS = [RectangularROI(xmin=0.2, xmax=0.7, ymin=-0.1, ymax=0.45),
+        CircularROI(xc=0.4, yc=0.6, radius=0.25),
+        CircularROI(xc=5, yc=5, radius=0.1),
+        polygon()]
+
+
+class TestGridIndex(object):
+
+    def setup_method(self, method):
+        np.random.seed(12345)
+        self.x = np.random.random((200, 50))
+        self.y = np.random.random((200, 50))
+        self.x[3, :5] = np.nan
+        self.y[5, :5] = np.inf
+        self.index = GridIndex(self.x, self.y, points_per_cell=16)
+
+    @pytest.mark.parametrize('roi', ROIS)
+    def test_matches_roi(self, roi):
+        expected = roi.contains(self.x, self.y)
+        result = self.index.contains(roi, self.x, self.y)
+        assert result.shape == self.x.shape
+        np.testing.assert_array_equal(result, expected)
+
+    def test_only_boundary_points_tested(self):
+        roi = polygon()
+        with patch.object(roi, 'contains', wraps=roi.contains) as contains:
+            self.index.contains(roi, self.x, self.y)
+        ntested = sum(c[0][0].size for c in contains.call_args_list)
+        assert ntested < self.x.size / 2
+
+    @pytest.mark.parametrize(('old', 'new'), [
+        (ROIS[0], RectangularROI(xmin=0.25, xmax=0.75, ymin=0., ymax=0.4)),
+        (ROIS[1], CircularROI(xc=0.45, yc=0.55, radius=0.3)),
+        (ROIS[0], ROIS[1]),
+        (ROIS[0], polygon()),
+        (polygon(), PolygonalROI(vx=polygon().vx + [0.2],
+                                 vy=polygon().vy + [0.25]))])
+    def test_update_matches_roi(self, old, new):
+        mask = old.contains(self.x, self.y)
+        result = self.index.update(mask, old, new, self.x, self.y)
+        np.testing.assert_array_equal(result, new.contains(self.x, self.y))
+        assert not np.may_share_memory(result, mask)
+
+    def test_update_self_intersecting(self):
+        # adding vertices to random self-intersecting lassos, the shared
+        # edges cross cells that are not retested
+        for i in range(50):
+            vx = list(np.random.uniform(-0.2, 1.2, 8))
+            vy = list(np.random.uniform(-0.2, 1.2, 8))
+            old = PolygonalROI(vx=list(vx), vy=list(vy))
+            mask = old.contains(self.x, self.y)
+            for px, py in np.random.uniform(-0.2, 1.2, (4, 2)):
+                vx.append(px)
+                vy.append(py)
+                new = PolygonalROI(vx=list(vx), vy=list(vy))
+                mask = self.index.update(mask, old, new, self.x, self.y)
+                np.testing.assert_array_equal(mask,
+                                              new.contains(self.x, self.y))
+                old = new
+
+    def test_update_retraced_edge(self):
+        # the edge from (0.3, 0.3) to (0.95, 0.3) is traced twice by the
+        # old polygon, and once by the new one
+        old = PolygonalROI(vx=[0.05, 0.3, 0.95, 0.3, 0.05],
+                           vy=[0.05, 0.3, 0.3, 0.3, 0.95])
+        new = PolygonalROI(vx=[0.05, 0.3, 0.95, 0.05],
+                           vy=[0.05, 0.3, 0.3, 0.95])
+        mask = old.contains(self.x, self.y)
+        result = self.index.update(mask, old, new, self.x, self.y)
+        np.testing.assert_array_equal(result, new.contains(self.x, self.y))
+
+    def test_update_retests_only_changed_region(self):
+        old = polygon()
+        new = PolygonalROI(vx=old.vx + [0.2], vy=old.vy + [0.25])
+        mask = old.contains(self.x, self.y)
+
+        def ntested(func):
+            with patch.object(new, 'contains', wraps=new.contains) as contains:
+                func()
+            return sum(c[0][0].size for c in contains.call_args_list)
+
+        n_update = ntested(lambda: self.index.update(mask, old, new,
+                                                     self.x, self.y))
+        n_contains = ntested(lambda: self.index.contains(new, self.x, self.y))
+        assert n_update < n_contains / 2
+
+    def test_edges_clipped_to_grid(self):
+        # a lasso much larger than the data, with one vertex inside it
+        roi = PolygonalROI(vx=[-1e12, 1e12, 0.5], vy=[-1e12, -1e12, 0.5])
+        with patch.object(si.np, 'linspace',
+                          wraps=np.linspace) as linspace:
+            result = self.index.contains(roi, self.x, self.y)
+        assert max(c[0][2] for c in linspace.call_args_list) < 1000
+        np.testing.assert_array_equal(result, roi.contains(self.x, self.y))
+
+    def test_unsupported_roi(self):
+        roi = XRangeROI(0.2, 0.4)
+        assert self.index.contains(roi, self.x, self.y) is None
+        mask = np.zeros(self.x.shape, dtype=bool)
+        assert self.index.update(mask, ROIS[1], roi, self.x, self.y) is None
+
+    def test_integer_data(self):
+        x = np.arange(1000) % 37
+        y = np.arange(1000) % 11
+        index = GridIndex(x, y, points_per_cell=4)
+        for roi in ROIS[:2] + [RectangularROI(xmin=3, xmax=30,
+                                              ymin=2, ymax=9)]:
+            np.testing.assert_array_equal(index.contains(roi, x, y),
+                                          roi.contains(x, y))
+
+    def test_degenerate(self):
+        x = np.ones(10)
+        y = np.zeros(10) * np.nan
+        index = GridIndex(x, y)
+        assert index.ncells == 0
+        roi = RectangularROI(xmin=0, xmax=2, ymin=-1, ymax=1)
+        assert not index.contains(roi, x, y).any()
+
+        y = np.zeros(10)
+        index = GridIndex(x, y)
+        np.testing.assert_array_equal(index.contains(roi, x, y), True)
+
+
+class TestRoiSubsetStateIndex(object):
+
+    def setup_method(self, method):
+        index_cache.clear()
+        np.random.seed(12345)
+        self.data = Data(x=np.random.random(5000), y=np.random.random(5000))
+        self.state = RoiSubsetState(self.data.id['x'], self.data.id['y'],
+                                    polygon())
+
+    def test_index_used(self):
+        with patch.object(si, 'MIN_INDEX_SIZE', 100):
+            mask = self.state.to_mask(self.data)
+            index = spatial_index(self.data, self.data.id['x'],
+                                  self.data.id['y'])
+        assert len(index_cache) == 1
+        assert index_cache.hits == 1
+        np.testing.assert_array_equal(mask, polygon().contains(self.data['x'],
+                                                               self.data['y']))
+
+    def test_rectangle_not_indexed(self):
+        self.state.roi = RectangularROI(0.2, 0.6, 0.1, 0.7)
+        with patch.object(si, 'MIN_INDEX_SIZE', 100):
+            self.state.to_mask(self.data)
+        assert len(index_cache) == 0
+
+    def test_small_data_not_indexed(self):
+        self.state.to_mask(self.data)
+        assert len(index_cache) == 0
+
+    def test_disabled(self):
+        with patch.object(si, 'MIN_INDEX_SIZE', 100):
+            with patch.object(config.enable_spatial_index, 'state', False):
+                self.state.to_mask(self.data)
+        assert len(index_cache) == 0
+
+    def test_update_invalidates(self):
+        with patch.object(si, 'MIN_INDEX_SIZE', 100):
+            self.state.to_mask(self.data)
+            assert len(index_cache) == 1
+
+            x = self.data['x'] + 1
+            self.data.update_components({self.data.id['x']: x})
+            assert len(index_cache) == 0
+
+            mask = self.state.to_mask(self.data)
+        np.testing.assert_array_equal(mask, polygon().contains(x,
+                                                               self.data['y']))
+
+    def test_edited_roi_updates_previous_mask(self):
+        with patch.object(si, 'MIN_INDEX_SIZE', 100):
+            self.state.to_mask(self.data)
+
+            roi = PolygonalROI(vx=polygon().vx + [0.2],
+                               vy=polygon().vy + [0.25])
+            new = RoiSubsetState(self.data.id['x'], self.data.id['y'], roi)
+            new.set_previous_state(self.state)
+            with patch.object(GridIndex, 'update',
+                              wraps=GridIndex.update, autospec=True) as update:
+                mask = new.to_mask(self.data)
+        assert update.call_count == 1
+        np.testing.assert_array_equal(mask, new.roi.contains(self.data['x'],
+                                                             self.data['y']))
+
+    def test_previous_state_on_other_attributes_ignored(self):
+        new = RoiSubsetState(self.data.id['y'], self.data.id['x'], polygon())
+        new.set_previous_state(self.state)
+        assert new._previous is None
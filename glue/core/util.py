@@ -163,10 +163,15 @@ def facet_subsets(data_collection, cid, lo=None, hi=None, steps=5,
             states.append((cid >= rng[i]) & (cid < rng[i + 1]))
             labels.append(prefix + '{0}<={1}<{2}'.format(rng[i], cid, rng[i + 1]))
 
-    result = []
-    for lbl, s in zip(labels, states):
-        sg = data_collection.new_subset_group(label=lbl, subset_state=s)
-        result.append(sg)
+    def new_groups():
+        return [data_collection.new_subset_group(label=lbl, subset_state=s)
+                for lbl, s in zip(labels, states)]
+
+    if data_collection.hub is None:
+        result = new_groups()
+    else:
+        with data_collection.hub.delay_callbacks():
+            result = new_groups()
 
     return result
 
@@ -3,7 +3,7 @@ import logging
 
 import numpy as np
 
-from ...external.qt.QtCore import Qt, Signal
+from ...external.qt.QtCore import Qt, Signal, QTimer
 from ...external.qt.QtGui import (QMainWindow, QWidget,
                                  QHBoxLayout, QTabWidget,
                                  QComboBox, QFormLayout, QPushButton,
@@ -24,10 +24,10 @@ from ...qt.glue_toolbar import GlueToolbar
 from ...qt.qtutil import load_ui, nonpartial, Worker
 from ...qt.widget_properties import CurrentComboProperty
 from ...core.aggregate import Aggregate
+from ...core.aperture import aperture_spectra, rectangle_aperture
 from ...qt.mime import LAYERS_MIME_TYPE
 from ...qt.simpleforms import build_form_item
 from ...config import fit_plugin
-from ...external.six.moves import range as xrange
 from ...qt.widgets.glue_mdi_area import GlueMdiSubWindow
 from ...qt.decorators import messagebox_on_error
 from ...utils import drop_axis
@@ -57,38 +57,17 @@ class Extractor(object):
     def spectrum(data, attribute, roi, slc, zaxis):
         xaxis = slc.index('x')
         yaxis = slc.index('y')
-        ndim, nz = data.ndim, data.shape[zaxis]
 
         l, r, b, t = roi.xmin, roi.xmax, roi.ymin, roi.ymax
         shp = data.shape
         # The 'or 0' is because Numpy in Python 3 cannot deal with 'None'
-        l, r = np.clip([l or 0, r or 0], 0, shp[xaxis])
-        b, t = np.clip([b or 0, t or 0], 0, shp[yaxis])
-
-        # extract sub-slice, without changing dimension
-        slc = [slice(s, s + 1)
-               if s not in ['x', 'y'] else slice(None)
-               for s in slc]
-        slc[xaxis] = slice(l, r)
-        slc[yaxis] = slice(b, t)
-        slc[zaxis] = slice(None)
-        x = Extractor.abcissa(data, zaxis)
-
-        data = data[attribute, tuple(slc)]
-        finite = np.isfinite(data)
-
-        assert data.ndim == ndim
+        l, r = np.clip([l or 0, r or 0], 0, shp[xaxis]).astype(int)
+        b, t = np.clip([b or 0, t or 0], 0, shp[yaxis]).astype(int)
 
-        for i in reversed(list(range(ndim))):
-            if i != zaxis:
-                data = np.nansum(data, axis=i)
-                finite = finite.sum(axis=i)
-
-        assert data.ndim == 1
-        assert data.size == nz
-
-        data = (1. * data / finite).ravel()
-        return x, data
+        aperture = rectangle_aperture(shp, slc, (l, r), (b, t))
+        x = Extractor.abcissa(data, zaxis)
+        y, = aperture_spectra(data, attribute, [aperture], slc, zaxis)
+        return x, y
 
     @staticmethod
     def world2pixel(data, axis, value):
@@ -120,32 +99,27 @@ class Extractor(object):
         :param slc: A tuple describing the slice
         :param zaxis: Which axis to integrate over
         """
-        data = subset.data
-        x = Extractor.abcissa(data, zaxis)
-
-        view = [slice(s, s + 1)
-                if s not in ['x', 'y'] else slice(None)
-                for s in slc]
-
-        mask = np.squeeze(subset.to_mask(view))
-        if slc.index('x') < slc.index('y'):
-            mask = mask.T
-
-        w = np.where(mask)
-        view[slc.index('x')] = w[1]
-        view[slc.index('y')] = w[0]
+        x, (y,) = Extractor.subset_spectra([subset], attribute, slc, zaxis)
+        return x, y
 
-        result = np.empty(x.size)
+    @staticmethod
+    def subset_spectra(subsets, attribute, slc, zaxis):
+        """
+        Extract the spectra of several subsets of the same data, reading
+        the cube once. See :meth:`subset_spectrum`.
 
-        # treat each channel separately, to reduce memory storage
-        for i in xrange(data.shape[zaxis]):
-            view[zaxis] = i
-            val = data[attribute, view]
-            result[i] = np.nansum(val) / np.isfinite(val).sum()
+        :returns: The abcissa, and a list of spectra
+        """
+        data = subsets[0].data
+        x = Extractor.abcissa(data, zaxis)
 
-        y = result
+        view = tuple(slice(s, s + 1) if s not in ['x', 'y'] else slice(None)
+                     for s in slc)
+        shape = [data.shape[i] for i, s in enumerate(slc) if s in ['x', 'y']]
+        masks = [s.to_mask(view).reshape(shape) for s in subsets]
 
-        return x, y
+        y = aperture_spectra(data, attribute, masks, slc, zaxis)
+        return x, list(y)
 
 
 class SpectrumContext(object):
@@ -201,6 +175,12 @@ class SpectrumContext(object):
         if self.grip is not None:
             self.grip.disable()
 
+    def reset(self):
+        """
+        Forget any state derived from the current spectrum
+        """
+        pass
+
     def recenter(self, lim):
         """Re-center the grip to the given x axlis limit tuple"""
         if self.grip is None:
@@ -311,10 +291,64 @@ class CollapseContext(SpectrumContext):
         self.widget = w
         self._combo = combo
         self._agg = None
+        self._enabled = False
+
+        # while the range grip is dragged, recompute the collapse at most
+        # once per interval
+        self._follow_timer = QTimer()
+        self._follow_timer.setInterval(100)
+        self._follow_timer.setSingleShot(True)
+        self._follow_timer.timeout.connect(nonpartial(self._follow_range))
 
     def _connect(self):
         self._run.clicked.connect(nonpartial(self._aggregate))
         self._save.clicked.connect(nonpartial(self._choose_save))
+        add_callback(self.grip, 'range', nonpartial(self._update_collapse))
+
+    def enable(self):
+        super(CollapseContext, self).enable()
+        self._enabled = True
+
+    def disable(self):
+        super(CollapseContext, self).disable()
+        self._enabled = False
+
+    def reset(self):
+        self._agg = None
+        self._follow_timer.stop()
+
+    def _following(self):
+        """
+        Whether the collapsed image is displayed, and should follow the
+        range grip
+        """
+        if self._agg is not None and \
+                self.client._override_image is not self._agg:
+            # the image has been replaced, e.g. by a change of slice
+            self.reset()
+        return self._enabled and self._agg is not None
+
+    def _update_collapse(self):
+        # follow the range grip once a collapse has been displayed, for
+        # aggregations that are cheap to recompute over a new range
+        if not self._following():
+            return
+        if self.aggregator not in Aggregate.incremental_operators():
+            return
+        if not self._follow_timer.isActive():
+            self._follow_timer.start()
+
+    def _follow_range(self):
+        if not self._following():
+            return
+        try:
+            self._aggregate()
+        except Exception:
+            # stop following the grip until the next explicit collapse
+            self._agg = None
+            msg = "Could not update the collapsed image:\n%s" % \
+                traceback.format_exc()
+            logging.getLogger(__name__).warn(msg)
 
     @property
     def aggregator(self):
@@ -793,6 +827,8 @@ class SpectrumTool(object):
         self.hide()
         self.mouse_mode.clear()
         self._relim_requested = True
+        for ctx in self._contexts:
+            ctx.reset()
 
     @property
     def data(self):
@@ -58,6 +58,55 @@ class TestSpectrumTool(object):
         self.image.client.slice = ('x', 1, 'y')
         assert self.tool.reset.call_count > 0
 
+    def _collapse(self):
+        # display a collapsed image from the Collapse tab
+        self.tool._tabs.setCurrentIndex(2)
+        ctx = self.tool._contexts[2]
+        ctx._agg = np.zeros((3, 3))
+        self.tool.client.override_image(ctx._agg)
+        ctx._aggregate = MagicMock()
+        return ctx
+
+    def test_collapse_follows_range_throttled(self):
+        ctx = self._collapse()
+        for i in range(3):
+            ctx._update_collapse()
+        assert ctx._aggregate.call_count == 0
+        assert ctx._follow_timer.isActive()
+
+        ctx._follow_timer.stop()
+        ctx._follow_range()
+        assert ctx._aggregate.call_count == 1
+
+    def test_collapse_follow_error_caught(self):
+        ctx = self._collapse()
+        ctx._aggregate.side_effect = ValueError("bad range")
+        ctx._follow_range()
+        assert ctx._agg is None
+
+    def test_navigate_does_not_recollapse(self):
+        ctx = self._collapse()
+        self.tool._tabs.setCurrentIndex(0)
+
+        # extracting a new spectrum recenters all grips
+        self.build_spectrum()
+        self.tool._recenter_grips()
+        assert not ctx._follow_timer.isActive()
+        ctx._follow_range()
+        assert ctx._aggregate.call_count == 0
+
+    def test_collapse_forgotten_when_cleared(self):
+        ctx = self._collapse()
+        self.tool.client.clear_override()
+        ctx._update_collapse()
+        assert ctx._agg is None
+        assert not ctx._follow_timer.isActive()
+
+    def test_collapse_forgotten_on_reset(self):
+        ctx = self._collapse()
+        self.tool.reset()
+        assert ctx._agg is None
+
 
 class Test3DExtractor(object):
 
@@ -128,6 +177,19 @@ class Test3DExtractor(object):
                                               slc, 0)
         np.testing.assert_array_almost_equal(expected, actual)
 
+    def test_extract_subsets(self):
+        subsets = [self.data.new_subset(), self.data.new_subset()]
+        subsets[0].subset_state = self.data.id['x'] > .5
+        subsets[1].subset_state = self.data.id['x'] <= .5
+        slc = (0, 'x', 'y')
+        _, actual = Extractor.subset_spectra(subsets, self.data.id['x'],
+                                             slc, 0)
+        assert len(actual) == 2
+        for sub, y in zip(subsets, actual):
+            _, expected = Extractor.subset_spectrum(sub, self.data.id['x'],
+                                                    slc, 0)
+            np.testing.assert_array_almost_equal(expected, y)
+
 
 class Test4DExtractor(object):
 
@@ -15,6 +15,7 @@ import numpy as np
 
 try:
     from .core import Data
+    from .utils import readonly_view
 except ImportError:
     # let qglue import, even though this won't work
     # qglue will throw an ImportError
@@ -48,7 +49,7 @@ def _parse_data_dataframe(data, label):
     label = label or 'Data'
     result = Data(label=label)
     for c in data.columns:
-        result.add_component(data[c], str(c))
+        result.add_component(readonly_view(data[c]), str(c))
     return [result]
 
 
@@ -62,12 +63,12 @@ def _parse_data_dict(data, label):
 
 
 def _parse_data_recarray(data, label):
-    kwargs = dict((n, data[n]) for n in data.dtype.names)
+    kwargs = dict((n, readonly_view(data[n])) for n in data.dtype.names)
     return [Data(label=label, **kwargs)]
 
 
 def _parse_data_astropy_table(data, label):
-    kwargs = dict((c, data[c]) for c in data.columns)
+    kwargs = dict((c, readonly_view(data[c])) for c in data.columns)
     return [Data(label=label, **kwargs)]
 
 
@@ -19,9 +19,10 @@ from .. import env
 from ..qt import get_qapp
 from .decorators import set_cursor, messagebox_on_error
 from ..core.application_base import Application
+from ..clients.compute import set_scheduler
 
 from .actions import act
-from .qtutil import (pick_class, data_wizard,
+from .qtutil import (pick_class, data_wizard, event_loop_scheduler,
                      GlueTabBar, load_ui, get_icon, nonpartial)
 from .widgets.glue_mdi_area import GlueMdiArea, GlueMdiSubWindow
 from .widgets.edit_subset_mode_toolbar import EditSubsetModeToolBar
@@ -773,7 +774,15 @@ class GlueApplication(Application, QMainWindow):
         # figures are still inlined in the notebook.
         # XXX find out a better place for this
         _fix_ipython_pylab()
-        return self.app.exec_()
+
+        # compute layers in the background while the event loop runs
+        scheduler = event_loop_scheduler()
+        previous = set_scheduler(scheduler)
+        try:
+            return self.app.exec_()
+        finally:
+            set_scheduler(previous)
+            scheduler.shutdown()
 
     exec_ = start
 
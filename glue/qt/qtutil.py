@@ -14,7 +14,8 @@ import numpy as np
 
 from ..external.axescache import AxesCache
 from ..external.qt import QtGui
-from ..external.qt.QtCore import (Qt, QThread, QAbstractListModel, QModelIndex)
+from ..external.qt.QtCore import (Qt, QThread, QAbstractListModel, QModelIndex,
+                                  QObject)
 from ..external.qt.QtGui import (QColor, QInputDialog, QColorDialog,
                                  QListWidget, QTreeWidget, QPushButton,
                                  QMessageBox,
@@ -28,6 +29,7 @@ from .mime import PyMimeData, LAYERS_MIME_TYPE
 from ..external.qt import is_pyside
 from ..external.qt.QtCore import Signal
 from .. import core
+from ..clients.compute import ComputeScheduler
 from . import ui, icons
 
 # We import nonpartial here for convenience
@@ -971,6 +973,41 @@ class Worker(QThread):
             self.error.emit(sys.exc_info())
 
 
+class EventLoopDispatcher(QObject):
+
+    """
+    Call functions on the thread that owns this object (usually the main
+    thread), through the Qt event loop.
+
+    Instances are callable, and can be passed as the ``dispatch``
+    argument of :class:`~glue.clients.compute.ComputeScheduler` to apply
+    results from worker threads on the main thread.
+    """
+
+    _call = Signal(object)
+
+    def __init__(self, parent=None):
+        super(EventLoopDispatcher, self).__init__(parent)
+        self._call.connect(self._run, Qt.QueuedConnection)
+
+    def __call__(self, func):
+        self._call.emit(func)
+
+    def _run(self, func):
+        func()
+
+
+def event_loop_scheduler(workers=2):
+    """
+    Create a :class:`~glue.clients.compute.ComputeScheduler` which computes
+    layers in background threads, and applies the results through the Qt
+    event loop, so that expensive computations do not freeze the GUI
+
+    :param workers: The number of worker threads
+    """
+    return ComputeScheduler(workers=workers, dispatch=EventLoopDispatcher())
+
+
 def update_combobox(combo, labeldata):
     """
     Redefine the items in a combobox
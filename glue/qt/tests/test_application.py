@@ -22,6 +22,7 @@ from ...external.qt.QtCore import QMimeData, QUrl
 from ..widgets.scatter_widget import ScatterWidget
 from ..widgets.image_widget import ImageWidget
 from ...core import Data
+from ...clients.compute import get_scheduler
 
 from ...external.six import PY3
 
@@ -46,6 +47,21 @@ class TestGlueApplication(object):
         self.app.new_tab()
         assert tab_count(self.app) == t0 + 1
 
+    def test_threaded_scheduler_while_running(self):
+        schedulers = []
+
+        def exec_():
+            schedulers.append(get_scheduler())
+            return 0
+
+        previous = get_scheduler()
+        with patch.object(self.app, 'app') as qapp:
+            qapp.exec_.side_effect = exec_
+            self.app.start()
+
+        assert schedulers[0].asynchronous
+        assert get_scheduler() is previous
+
     def test_save_session(self):
         self.app.save_session = MagicMock()
         with patch('glue.qt.glue_application.QFileDialog') as fd:
@@ -1,17 +1,22 @@
 # pylint: disable=I0011,W0613,W0201,W0212,E1101,E1103
 
 from __future__ import absolute_import, division, print_function
+import time
+
 import pytest
+import numpy as np
+from matplotlib.figure import Figure
 
-from .. import qtutil
+from .. import qtutil, get_qapp
 from ...external.qt import QtGui
-from ...external.qt.QtCore import Qt
+from ...external.qt.QtCore import Qt, QTimer
 from mock import MagicMock, patch
 from ..qtutil import GlueDataDialog
 from ..qtutil import pretty_number, GlueComboBox, PythonListModel
 
 from glue.config import data_factory
-from glue.core import Subset
+from glue.core import Subset, Data
+from glue.clients.layer_artist import SubsetImageLayerArtist
 
 
 def test_glue_action_button():
@@ -452,3 +457,48 @@ class TestListModel(object):
     def test_iter(self):
         m = PythonListModel([1, 2, 3])
         assert list(m) == [1, 2, 3]
+
+
+class TestEventLoopScheduler(object):
+
+    def test_mask_does_not_block_event_loop(self):
+        app = get_qapp()
+        data = Data(x=np.arange(100).reshape(10, 10))
+        subset = data.new_subset()
+        subset.subset_state = data.id['x'] > 50
+        view = (data.id['x'], slice(None), slice(None))
+
+        artist = SubsetImageLayerArtist(subset, Figure().add_subplot(111))
+        artist.redraw = MagicMock()
+        artist.scheduler = qtutil.event_loop_scheduler()
+
+        to_mask = subset.to_mask
+
+        def slow_mask(view=None):
+            time.sleep(0.5)
+            return to_mask(view)
+
+        ticks = []
+        timer = QTimer()
+        timer.timeout.connect(lambda: ticks.append(time.time()))
+        timer.start(10)
+        try:
+            with patch.object(subset, 'to_mask', slow_mask):
+                start = time.time()
+                artist.update(view)
+                assert time.time() - start < 0.25
+
+                # the result is applied by the event loop
+                while artist.redraw.call_count == 0 and \
+                        time.time() - start < 5:
+                    app.processEvents()
+                    time.sleep(0.01)
+        finally:
+            timer.stop()
+            artist.scheduler.shutdown()
+
+        assert artist.redraw.call_count == 1
+        assert len(artist.artists) == 1
+
+        # the timer kept firing while the mask was computed
+        assert len([t for t in ticks if t < start + 0.5]) > 5
@@ -1,5 +1,7 @@
 from __future__ import absolute_import, division, print_function
 
+import pytest
+
 from ..config import qt_client, link_function, data_factory
 
 
@@ -72,3 +74,14 @@ def test_data_factory_default():
     @data_factory('', '', '')
     def baz(x):
         pass
+
+
+def test_choice_setting():
+    from ..config import ChoiceSetting
+    setting = ChoiceSetting('a', ['a', 'b'])
+    assert setting() == 'a'
+    assert setting('b') == 'b'
+    assert setting() == 'b'
+    with pytest.raises(ValueError) as exc:
+        setting('c')
+    assert exc.value.args[0] == "Invalid setting: c. Valid options are: ['a', 'b']"
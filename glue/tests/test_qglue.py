@@ -95,6 +95,22 @@ class TestQGlue(object):
         dc = qglue(data4=self.astropy_table).data_collection
         self.check_setup(dc, {'data4': ['x', 'y']})
 
+    def test_columns_not_copied(self):
+        frame = pd.DataFrame({'x': self.x, 'y': self.y * 1.5})
+        data = qglue(data1=frame, data2=self.recarray_data,
+                     data3=self.astropy_table).data_collection
+
+        for d, source in zip(data, [frame, self.recarray_data,
+                                    self.astropy_table]):
+            for c in d.visible_components:
+                values = d[c]
+                assert np.shares_memory(values, np.asarray(source[c.label]))
+                assert not values.flags.writeable
+
+        # the caller's objects stay writeable
+        assert frame['x'].values.flags.writeable
+        assert self.astropy_table['x'].flags.writeable
+
     def test_multi_data(self):
         dc = qglue(data1=self.dict_data, data2=self.xy).data_collection
         self.check_setup(dc, {'data1': ['u', 'v'],
@@ -6,7 +6,7 @@ import pandas as pd
 from ..external.six import string_types
 
 __all__ = ['unique', 'shape_to_string', 'view_shape', 'stack_view',
-           'coerce_numeric', 'check_sorted']
+           'coerce_numeric', 'check_sorted', 'readonly_view']
 
 
 def unique(array):
@@ -86,6 +86,23 @@ def coerce_numeric(arr):
     return pd.Series(arr).convert_objects(convert_numeric=True).values
 
 
+def readonly_view(values):
+    """
+    Return a read-only view of an array-like object, without copying
+    its values when it already wraps a numpy array (e.g. a pandas
+    Series, an astropy Column, or a field of a record array).
+
+    Unlike ``values.setflags(write=False)``, the original object is left
+    writeable.
+
+    :param values: The array-like object
+    :rtype: :class:`numpy.ndarray`
+    """
+    result = np.asarray(values).view()
+    result.setflags(write=False)
+    return result
+
+
 def check_sorted(array):
     """ Return True if the array is sorted, False otherwise.
     """
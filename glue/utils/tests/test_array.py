@@ -1,9 +1,11 @@
 import pytest
 import numpy as np
+import pandas as pd
 
 from ...external.six import string_types, PY2
 
-from ..array import view_shape, coerce_numeric, stack_view, unique, shape_to_string, check_sorted
+from ..array import (view_shape, coerce_numeric, stack_view, unique, shape_to_string,
+                     check_sorted, readonly_view)
 
 
 @pytest.mark.parametrize(('before', 'ref_after', 'ref_indices'),
@@ -75,3 +77,18 @@ def test_stack_view(shape, views):
                          (([1, 3, 4, 3], False), ([1, 2, np.nan, 3], True), ([1, 3, 4, 4.1], True)))
 def test_check_sorted(array, is_sorted):
     assert check_sorted(array) is is_sorted
+
+
+def test_readonly_view():
+    values = np.arange(5.)
+    view = readonly_view(values)
+    assert np.shares_memory(view, values)
+    assert not view.flags.writeable
+    assert values.flags.writeable
+
+    series = pd.Series(values)
+    view = readonly_view(series)
+    assert np.shares_memory(view, values)
+    assert series.values.flags.writeable
+
+    np.testing.assert_array_equal(readonly_view([1, 2]), [1, 2])